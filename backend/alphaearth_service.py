@@ -1,13 +1,480 @@
+"""
+AlphaEarth embedding providers
+
+Every provider answers get_embeddings(lat, lon, date=None) -> (64,) and
+batch_get_embeddings(locations, date=None) -> (N, 64) float32, plus
+fetch()/batch_fetch(), which also say which answers are fallback stand-ins:
+
+    MockProvider   deterministic embeddings generated from the coordinates
+    FileProvider   ingested exports (embedding_store.py) and precomputed
+                   rasters (region_rasters.py), with another provider for the
+                   points they don't cover
+    HTTPProvider   the AlphaEarth API over a keep-alive connection pool;
+                   concurrent single-point lookups are merged into batch
+                   calls, failed calls are retried with jittered backoff and
+                   in-flight calls are capped
+
+FallbackProvider answers from the mock when the API is unavailable after
+its retries (connection errors, 429, 5xx), and flags those answers so they
+are never cached as real data. AlphaEarthService puts them together (files first, then HTTP or
+the mock) and is what the rest of the backend uses.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 
-class AlphaEarthService:
+EMBEDDING_DIM = 64
+
+# Bumped whenever generate_mock_embeddings_batch's output changes (caches key on it)
+MOCK_VERSION = 2
+
+
+def location_seeds(lats, lons):
+    """
+    Deterministic per-location seeds (same formula the mock has always used)
+
+    Args:
+        lats: Array-like of latitudes
+        lons: Array-like of longitudes
+
+    Returns:
+        int64 array of non-negative seeds, one per location
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return ((lats + 90) * 1000 + (lons + 180) * 1000).astype(np.int64)
+
+
+def _splitmix64(values):
+    """SplitMix64 finalizer over a uint64 array (wraps modulo 2**64)"""
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def seed_uniforms(seeds, count):
+    """
+    (N, count) uniforms in (0, 1), a pure function of each seed
+
+    Counter-based: value j of a row hashes (seed, j), so the whole array is
+    built in a few vectorized operations with no per-seed generator.
+    """
+    keys = _splitmix64(np.asarray(seeds).astype(np.uint64))
+    counters = np.arange(count, dtype=np.uint64)
+    bits = _splitmix64(keys[:, None] + counters[None, :]) >> np.uint64(11)
+    return (bits.astype(np.float64) + 0.5) * 2.0 ** -53
+
+
+def generate_mock_embeddings_batch(lats, lons):
+    """
+    Generate mock embeddings for many locations in one NumPy pass
+
+    Every location's random values are hashed from a seed derived from its
+    coordinates (seed_uniforms), so results are deterministic, independent
+    of batch order, and never touch the global np.random state (safe across
+    threads).
+
+    Args:
+        lats: Array-like of N latitudes
+        lons: Array-like of N longitudes
+
+    Returns:
+        (N, 64) float32 array
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+
+    # 64 normals (Box-Muller over 32 uniform pairs) plus 10 uniforms
+    # (productivity noise) per row
+    uniforms = seed_uniforms(location_seeds(lats, lons), EMBEDDING_DIM + 10)
+    half = EMBEDDING_DIM // 2
+    radius = np.sqrt(-2.0 * np.log(uniforms[:, :half]))
+    angle = 2.0 * np.pi * uniforms[:, half:EMBEDDING_DIM]
+    noise = np.concatenate([radius * np.cos(angle), radius * np.sin(angle)], axis=1)
+    productivity = uniforms[:, EMBEDDING_DIM:]
+
+    abs_lat = np.abs(lats)[:, None]
+
+    # Embeddings 0-10: Temperature-related (latitude dependent)
+    noise[:, 0:10] += (90 - abs_lat) / 50
+
+    # Embeddings 10-20: Productivity-related (coastal vs open ocean)
+    pacific_atlantic = (np.abs(lons) > 100)[:, None]
+    noise[:, 10:20] += np.where(pacific_atlantic, productivity * 0.5, 0.0)
+
+    # Embeddings 20-30: Depth-related
+    noise[:, 20:30] -= abs_lat / 90
+
+    # Normalize each row
+    noise -= noise.mean(axis=1, keepdims=True)
+    noise /= noise.std(axis=1, keepdims=True)
+
+    return noise.astype(np.float32)
+
+
+class AlphaEarthError(Exception):
+    """The AlphaEarth API could not answer (e.g. it rejected the request)"""
+
+
+class AlphaEarthUnavailable(AlphaEarthError):
+    """The AlphaEarth API was unreachable, throttled or failing (after retries)"""
+
+
+class MockProvider:
+    """Deterministic mock embeddings (generate_mock_embeddings_batch)"""
+
+    name = 'mock'
+
+    def get_embeddings(self, lat, lon, date=None):
+        return generate_mock_embeddings_batch([lat], [lon])[0]
+
+    def batch_get_embeddings(self, locations, date=None):
+        coords = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        return generate_mock_embeddings_batch(coords[:, 0], coords[:, 1])
+
+    def fetch(self, lat, lon, date=None):
+        return self.get_embeddings(lat, lon, date), False
+
+    def batch_fetch(self, locations, date=None):
+        vectors = self.batch_get_embeddings(locations, date)
+        return vectors, np.zeros(len(vectors), dtype=bool)
+
+    def describe(self):
+        return {'provider': self.name}
+
+
+class FileProvider:
     """
-    Service to interact with AlphaEarth API
+    Embeddings from local files, falling back to another provider
+
+    Args:
+        store: Optional EmbeddingStoreSet; points near an ingested sample get
+            its real embedding
+        rasters: Optional RegionRasterSet; points inside a raster are
+            interpolated
+        fallback: Provider for points neither covers
+    """
+
+    name = 'file'
+
+    def __init__(self, store=None, rasters=None, fallback=None):
+        self.store = store
+        self.rasters = rasters
+        self.fallback = fallback or MockProvider()
+
+    def lookup(self, lats, lons):
+        """
+        Embeddings from the store, then the rasters, for the points they cover
+
+        Returns:
+            (covered_mask, (N, 64) array; rows outside the mask are undefined)
+        """
+        result = np.empty((len(lats), EMBEDDING_DIM), dtype=np.float32)
+        covered = np.zeros(len(lats), dtype=bool)
+        for source in (self.store, self.rasters):
+            if not source or covered.all():
+                continue
+            pending = np.flatnonzero(~covered)
+            found, vectors = source.lookup(lats[pending], lons[pending])
+            result[pending[found]] = vectors
+            covered[pending[found]] = True
+        return covered, result
+
+    def get_embeddings(self, lat, lon, date=None):
+        return self.fetch(lat, lon, date)[0]
+
+    def batch_get_embeddings(self, locations, date=None):
+        return self.batch_fetch(locations, date)[0]
+
+    def fetch(self, lat, lon, date=None):
+        covered, vectors = self.lookup(np.array([lat], dtype=np.float64), np.array([lon], dtype=np.float64))
+        if covered[0]:
+            return vectors[0], False
+        return self.fallback.fetch(lat, lon, date)
+
+    def batch_fetch(self, locations, date=None):
+        coords = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        covered, result = self.lookup(coords[:, 0], coords[:, 1])
+        stand_in = np.zeros(len(coords), dtype=bool)
+        if not covered.all():
+            rest = coords[~covered]
+            result[~covered], stand_in[~covered] = self.fallback.batch_fetch(rest, date)
+        return result, stand_in
+
+    def describe(self):
+        return {
+            'provider': self.name,
+            'stores': self.store.describe() if self.store else [],
+            'rasters': self.rasters.describe() if self.rasters else [],
+            'fallback': self.fallback.describe(),
+        }
+
+
+class _MicroBatcher:
     """
-    def __init__(self, api_key=None):
+    Merges single-point lookups that arrive within `window` seconds
+
+    The first request of a batch starts a timer; the batch is sent when the
+    timer fires or as soon as it reaches max_batch points.
+    """
+
+    def __init__(self, fetch_batch, window, max_batch):
+        self.fetch_batch = fetch_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, lat, lon, date=None):
+        future = Future()
+        batch = None
+        with self._lock:
+            self._pending.append((lat, lon, date, future))
+            if len(self._pending) >= self.max_batch:
+                batch, self._pending = self._pending, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._dispatch(batch)
+        return future
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._timer = None
+        if batch:
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        by_date = {}
+        for entry in batch:
+            by_date.setdefault(entry[2], []).append(entry)
+        for date, entries in by_date.items():
+            try:
+                vectors = self.fetch_batch([(lat, lon) for lat, lon, _, _ in entries], date)
+            except Exception as e:
+                for _, _, _, future in entries:
+                    future.set_exception(e)
+                continue
+            for (_, _, _, future), vector in zip(entries, vectors):
+                future.set_result(vector)
+
+
+class HTTPProvider:
+    """
+    AlphaEarth API client
+
+    API:
+        GET  {base_url}/embeddings?lat=..&lon=..[&date=..]     -> {"embeddings": [64 floats]}
+        POST {base_url}/embeddings/batch {"locations": [{"lat", "lon"}], "date"?}
+                                                              -> {"embeddings": [[...], ...]}
+
+    Args:
+        base_url: API root, e.g. https://api.alphaearth.ai/v1
+        api_key: Sent as a bearer token
+        max_concurrency: Upstream calls in flight at once (also the pool size)
+        batch_window: Seconds single lookups wait to be merged (0 disables)
+        max_batch: Points per upstream batch call
+        retries: Extra attempts on connection errors, 429 and 5xx (then
+            AlphaEarthUnavailable; other failures raise AlphaEarthError)
+        backoff: Base delay in seconds, doubled per attempt, with +-50% jitter
+        timeout: Per-call timeout in seconds
+    """
+
+    name = 'http'
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url, api_key=None, max_concurrency=8, batch_window=0.005, max_batch=256,
+                 retries=3, backoff=0.1, max_backoff=5.0, timeout=10.0):
+        self.base_url = base_url.rstrip('/')
         self.api_key = api_key
-        self.base_url = "https://api.alphaearth.ai/v1"  # Replace with actual URL
+        self.max_batch = int(max_batch)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.timeout = float(timeout)
+        self.max_concurrency = max(1, int(max_concurrency))
+
+        # One keep-alive pool shared by every thread: no handshake per lookup
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if api_key:
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='alphaearth')
+        self._batcher = _MicroBatcher(self._fetch_batch, batch_window, self.max_batch) if batch_window > 0 else None
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'batch_calls': 0, 'points': 0, 'retries': 0, 'errors': 0, 'in_flight': 0}
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, amount in increments.items():
+                self._stats[name] += amount
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _call(self, method, path, **kwargs):
+        """One API call under the concurrency cap, retried with jittered backoff"""
+        url = f'{self.base_url}{path}'
+        for attempt in range(self.retries + 1):
+            response = None
+            with self._slots:
+                self._count(calls=1, in_flight=1)
+                try:
+                    response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                    if response.status_code not in self.RETRY_STATUSES:
+                        response.raise_for_status()
+                        return response.json()
+                    error = AlphaEarthUnavailable(f'AlphaEarth API returned {response.status_code}')
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = AlphaEarthUnavailable(f'AlphaEarth API unreachable: {e}')
+                except (requests.HTTPError, ValueError) as e:
+                    # 4xx or an unreadable body: retrying won't help
+                    self._count(errors=1)
+                    raise AlphaEarthError(f'AlphaEarth API error: {e}') from e
+                finally:
+                    self._count(in_flight=-1)
+            if attempt < self.retries:
+                self._count(retries=1)
+                time.sleep(self._delay(attempt, response))
+        self._count(errors=1)
+        raise error
+
+    def _fetch_batch(self, locations, date=None):
+        payload = {'locations': [{'lat': float(lat), 'lon': float(lon)} for lat, lon in locations]}
+        if date:
+            payload['date'] = date
+        vectors = np.asarray(self._call('POST', '/embeddings/batch', json=payload)['embeddings'], dtype=np.float32)
+        if vectors.shape != (len(locations), EMBEDDING_DIM):
+            self._count(errors=1)
+            raise AlphaEarthError(f'Expected {len(locations)} embeddings, got shape {vectors.shape}')
+        self._count(batch_calls=1, points=len(locations))
+        return vectors
+
+    def get_embeddings(self, lat, lon, date=None):
+        if self._batcher is not None:
+            return self._batcher.submit(float(lat), float(lon), date).result()
+        params = {'lat': lat, 'lon': lon}
+        if date:
+            params['date'] = date
+        vector = np.asarray(self._call('GET', '/embeddings', params=params)['embeddings'], dtype=np.float32)
+        self._count(points=1)
+        return vector
+
+    def batch_get_embeddings(self, locations, date=None):
+        coords = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        if not len(coords):
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        chunks = [coords[i:i + self.max_batch] for i in range(0, len(coords), self.max_batch)]
+        if len(chunks) == 1:
+            return self._fetch_batch(chunks[0], date)
+        return np.concatenate(list(self._pool.map(lambda chunk: self._fetch_batch(chunk, date), chunks)))
+
+    def fetch(self, lat, lon, date=None):
+        return self.get_embeddings(lat, lon, date), False
+
+    def batch_fetch(self, locations, date=None):
+        vectors = self.batch_get_embeddings(locations, date)
+        return vectors, np.zeros(len(vectors), dtype=bool)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def describe(self):
+        return {'provider': self.name, 'base_url': self.base_url, **self.stats()}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+
+class FallbackProvider:
+    """
+    A provider that answers from `fallback` whenever `primary` raises
+    AlphaEarthUnavailable
+
+    fetch()/batch_fetch() flag those answers as stand-ins; errors that
+    retrying or waiting won't fix (a rejected request) are raised.
+    """
+
+    def __init__(self, primary, fallback=None):
+        self.primary = primary
+        self.fallback = fallback or MockProvider()
+        self.name = primary.name
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def _fall_back(self, error):
+        print(f"⚠️  AlphaEarth unavailable, answering from {self.fallback.name}: {error}")
+        with self._lock:
+            self.fallbacks += 1
+
+    def get_embeddings(self, lat, lon, date=None):
+        return self.fetch(lat, lon, date)[0]
+
+    def batch_get_embeddings(self, locations, date=None):
+        return self.batch_fetch(locations, date)[0]
+
+    def fetch(self, lat, lon, date=None):
+        try:
+            return self.primary.get_embeddings(lat, lon, date), False
+        except AlphaEarthUnavailable as e:
+            self._fall_back(e)
+            return self.fallback.get_embeddings(lat, lon, date), True
+
+    def batch_fetch(self, locations, date=None):
+        try:
+            vectors = self.primary.batch_get_embeddings(locations, date)
+            return vectors, np.zeros(len(vectors), dtype=bool)
+        except AlphaEarthUnavailable as e:
+            self._fall_back(e)
+            vectors = self.fallback.batch_get_embeddings(locations, date)
+            return vectors, np.ones(len(vectors), dtype=bool)
+
+    def describe(self):
+        return {**self.primary.describe(), 'fallbacks': self.fallbacks, 'fallback': self.fallback.describe()}
+
+
+class AlphaEarthService:
+    """
+    Service to interact with AlphaEarth
+
+    Local files (an EmbeddingStoreSet and/or RegionRasterSet) answer the
+    points they cover; everything else goes to `provider` (an HTTPProvider,
+    or the mock by default). If the API is unavailable after its retries,
+    the mock answers instead so an analysis can still run; fetch() and
+    batch_fetch() report which answers those were.
+    """
+    def __init__(self, rasters=None, store=None, provider=None):
+        self.store = store
+        self.rasters = rasters
+        source = FallbackProvider(provider) if provider is not None else MockProvider()
+        self.provider = FileProvider(store, rasters, source) if (store or rasters) else source
     
     def get_embeddings(self, lat, lon, date=None):
         """
@@ -21,59 +488,32 @@ class AlphaEarthService:
         Returns:
             64-dimensional numpy array
         """
-        # TODO: Replace with actual AlphaEarth API call when available
-        # For now, generate mock embeddings based on location
-        
-        try:
-            # Actual API call would look like:
-            # response = requests.get(
-            #     f"{self.base_url}/embeddings",
-            #     params={'lat': lat, 'lon': lon, 'date': date},
-            #     headers={'Authorization': f'Bearer {self.api_key}'}
-            # )
-            # return np.array(response.json()['embeddings'])
-            
-            # Mock embeddings for demo
-            return self._generate_mock_embeddings(lat, lon)
-            
-        except Exception as e:
-            print(f"Error fetching AlphaEarth data: {e}")
-            return self._generate_mock_embeddings(lat, lon)
-    
-    def _generate_mock_embeddings(self, lat, lon):
-        """
-        Generate realistic-looking mock embeddings based on location
-        """
-        # Set seed based on location for consistency
-        np.random.seed(int((lat + 90) * 1000 + (lon + 180) * 1000))
-        
-        # Generate 64D vector with realistic patterns
-        embeddings = np.random.randn(64)
-        
-        # Add location-based patterns
-        # Embeddings 0-10: Temperature-related (latitude dependent)
-        embeddings[0:10] += (90 - abs(lat)) / 50
-        
-        # Embeddings 10-20: Productivity-related (coastal vs open ocean)
-        if abs(lon) > 100:  # Pacific/Atlantic
-            embeddings[10:20] += np.random.rand(10) * 0.5
-        
-        # Embeddings 20-30: Depth-related
-        embeddings[20:30] -= abs(lat) / 90
-        
-        # Normalize
-        embeddings = (embeddings - embeddings.mean()) / embeddings.std()
-        
-        return embeddings
+        return self.provider.get_embeddings(lat, lon, date)
     
-    def batch_get_embeddings(self, locations):
+    def batch_get_embeddings(self, locations, date=None):
         """
         Fetch embeddings for multiple locations
         
         Args:
             locations: List of (lat, lon) tuples
+            date: Optional date (defaults to most recent)
         
         Returns:
-            List of 64D numpy arrays
+            (N, 64) float32 numpy array
         """
-        return [self.get_embeddings(lat, lon) for lat, lon in locations]
\ No newline at end of file
+        if len(locations) == 0:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        return self.provider.batch_get_embeddings(locations, date)
+
+    def fetch(self, lat, lon, date=None):
+        """get_embeddings, plus whether the vector is a fallback stand-in: (vector, bool)"""
+        return self.provider.fetch(lat, lon, date)
+
+    def batch_fetch(self, locations, date=None):
+        """batch_get_embeddings, plus a mask of fallback stand-in rows: ((N, 64), (N,) bool)"""
+        if len(locations) == 0:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32), np.zeros(0, dtype=bool)
+        return self.provider.batch_fetch(locations, date)
+
+    def describe(self):
+        return self.provider.describe()
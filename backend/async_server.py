@@ -0,0 +1,724 @@
+"""
+OceanCarbon AI Backend Server (asyncio mode)
+
+Same API as server.py for the long-running endpoints, served as coroutines:
+sphinx-cli runs through asyncio.create_subprocess_exec (killed with its
+process group on timeout or when the request goes away) and Claude through
+the pooled AsyncAnthropic client, so one process holds hundreds of
+concurrent analyses instead of one blocked thread each.
+
+Prompts, caches, notebooks and the embedding store are shared with
+server.py. CPU-bound work (embedding generation, notebook writes, SQLite)
+runs in the default thread pool. Job, streaming-ranking, raster,
+similarity, heatmap and ranking-session endpoints stay on the threaded
+server.
+
+Requires Quart: pip install quart quart-cors
+Run with: python async_server.py (or hypercorn async_server:app)
+"""
+
+import asyncio
+import codecs
+import concurrent.futures
+import json
+import time
+
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+from alphaearth_service import AlphaEarthError
+from cancellation import (
+    SupersedeRegistry, cancelled_payload, cancelled_status, requested_deadline, requested_session, requested_timeout
+)
+from embedding_codec import (
+    BINARY_ENCODINGS, OCTET_STREAM, EmbeddingDecodeError, decode_request_embeddings, encode_binary,
+    encode_json, negotiate_encoding
+)
+from jobs import CancelToken, DeadlineExceeded, JobCancelled, kill_process_tree
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, record_stage, request_timings,
+    server_timing_header, stage, start_request_timing
+)
+from scoring import rank_sites_local, score_sites_local
+from sharded_ranking import sharded_rank
+from singleflight import AsyncSingleFlight
+from sphinx_output import JSONStreamExtractor, final_result
+from server import (
+    CLAUDE_API_KEY, HTTP_REQUEST_SECONDS, MAX_BATCH_LOCATIONS, RANK_SHARD_SIZE, REQUEST_DEADLINE_CAP,
+    RESULT_CACHE_LOOKUPS, SERVER_TIMING, SPHINX_API_KEY, SPHINX_MAX_PARALLEL, SPHINX_PARSE_FALLBACKS, SPHINX_RUNS,
+    SPHINX_TIMEOUT, PROMPT_TEMPLATE_VERSION, alphaearth, analyze_site_request, analyze_sites_batch_task,
+    build_chat_request, validate_batch_sites,
+    chat_context, claude_chat, compare_sites_prepare, compare_sites_request, fast_rank_options, is_cacheable_result,
+    mock_sphinx_result, narrative_sites, notebook_store, rank_sites_request, region_rasters, result_cache,
+    site_embedding_matrix, sphinx_command, stream_event
+)
+
+app = cors(Quart(__name__))
+
+# Coalesces identical concurrent Sphinx runs within this event loop
+sphinx_flights = AsyncSingleFlight('sphinx-async')
+
+# Latest request per (session, kind) on this loop; a newer one cancels it
+request_sessions = SupersedeRegistry()
+
+REGISTRY.callback(
+    'oceancarbon_sphinx_async_in_flight', 'Distinct Sphinx runs in flight on the event loop',
+    lambda: sphinx_flights.stats()['in_flight']
+)
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+@app.before_request
+async def start_timing():
+    g.request_started = time.perf_counter()
+    start_request_timing()
+
+
+@app.after_request
+async def record_timing(response):
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = server_timing_header(request_timings() or [], elapsed)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus text exposition of the backend's metrics"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+# ============================================================================
+# ALPHA EARTH EMBEDDINGS SERVICE
+# ============================================================================
+
+async def request_body():
+    """JSON body with any encoded embeddings decoded (see embedding_codec.py)"""
+    return decode_request_embeddings(await request.get_json())
+
+
+@app.errorhandler(EmbeddingDecodeError)
+async def embedding_decode_error(e):
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(AlphaEarthError)
+async def alphaearth_error(e):
+    return jsonify({'error': str(e)}), 502
+
+
+def embeddings_response(embeddings, encoding, **fields):
+    """Embeddings in the negotiated encoding: a raw body for f32/i8, else JSON with `fields`"""
+    if encoding in BINARY_ENCODINGS:
+        body, headers = encode_binary(embeddings, encoding)
+        return Response(body, mimetype=OCTET_STREAM, headers=headers)
+    return jsonify({'embeddings': encode_json(embeddings, encoding), **fields})
+
+
+@app.route('/api/get-embeddings', methods=['POST'])
+async def get_embeddings():
+    """
+    Fetch AlphaEarth embeddings for a location
+    """
+    data = await request.get_json()
+    lat = data.get('lat')
+    lon = data.get('lon')
+
+    if lat is None or lon is None:
+        return jsonify({'error': 'Missing lat or lon'}), 400
+
+    print(f"📡 Fetching embeddings for {lat}, {lon}")
+    with stage('embeddings'):
+        embeddings = await asyncio.to_thread(alphaearth.get_embeddings, lat, lon)
+
+    encoding = negotiate_encoding(request.args, data, request.headers.get('Accept'))
+    return embeddings_response(embeddings, encoding, location={'lat': lat, 'lon': lon})
+
+
+@app.route('/api/get-embeddings-batch', methods=['POST'])
+async def get_embeddings_batch():
+    """
+    Fetch AlphaEarth embeddings for many locations in one request
+
+    Body: {"locations": [{"lat": ..., "lon": ...}, ...]}
+    """
+    data = await request.get_json() or {}
+    locations = data.get('locations', [])
+
+    if not isinstance(locations, list) or not locations:
+        return jsonify({'error': 'Missing locations'}), 400
+    if len(locations) > MAX_BATCH_LOCATIONS:
+        return jsonify({'error': f'At most {MAX_BATCH_LOCATIONS} locations per batch'}), 400
+
+    try:
+        coords = [(float(loc['lat']), float(loc['lon'])) for loc in locations]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each location needs numeric lat and lon'}), 400
+
+    print(f"📡 Fetching embeddings for {len(coords)} locations")
+    with stage('embeddings'):
+        embeddings = await asyncio.to_thread(alphaearth.batch_get_embeddings, coords)
+
+    encoding = negotiate_encoding(request.args, data, request.headers.get('Accept'))
+    return embeddings_response(
+        embeddings, encoding, locations=[{'lat': lat, 'lon': lon} for lat, lon in coords]
+    )
+
+
+def request_scope(data):
+    """(timeout seconds or None, session id or None) for the current request"""
+    return (
+        requested_timeout(request.headers, data, REQUEST_DEADLINE_CAP),
+        requested_session(request.headers, data)
+    )
+
+
+async def await_in_request_scope(kind, scope, work):
+    """
+    Await the coroutine `work` as its own task under the request's deadline
+
+    A newer request of the same kind from the session cancels the task.
+    Client disconnects need nothing extra: Quart cancels the handler, and
+    the cancellation reaches run_sphinx_analysis, which kills the process
+    group.
+
+    Raises:
+        DeadlineExceeded, or JobCancelled('superseded')
+    """
+    timeout, session = scope
+    task = asyncio.ensure_future(work)
+    request_sessions.begin(session, kind, task)
+    try:
+        return await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded('deadline exceeded') from None
+    except asyncio.CancelledError:
+        current = asyncio.current_task()
+        if not task.cancelled() or (hasattr(current, 'cancelling') and current.cancelling()):
+            raise  # the request itself is being cancelled
+        raise JobCancelled('superseded') from None
+    finally:
+        request_sessions.end(session, kind, task)
+
+
+def stopped_reason(error):
+    """cancelled_payload reason for a DeadlineExceeded / JobCancelled"""
+    return None if isinstance(error, DeadlineExceeded) else (error.args[0] if error.args else 'cancelled')
+
+
+async def run_in_request_scope(kind, data, work):
+    """jsonify(await work) under await_in_request_scope; 504 or 409 if stopped"""
+    try:
+        return jsonify(await await_in_request_scope(kind, request_scope(data), work))
+    except JobCancelled as e:
+        reason = stopped_reason(e)
+        return jsonify(cancelled_payload(reason)), cancelled_status(reason)
+
+
+# ============================================================================
+# SPHINX ANALYSIS ENDPOINTS
+# ============================================================================
+
+@app.route('/api/analyze-site', methods=['POST'])
+async def analyze_site():
+    """
+    Analyze a single site using Sphinx AI
+    """
+    data = await request_body()
+    return await run_in_request_scope('analyze-site', data, cached_sphinx_analysis(*analyze_site_request(data), data))
+
+
+def run_on_loop(coro, loop, token):
+    """
+    Run a coroutine on the event loop from a worker thread and wait for it
+
+    The wait polls `token` (a jobs.CancelToken): once it is cancelled the
+    coroutine is cancelled too and JobCancelled is raised in the thread.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    while True:
+        if token.cancelled:
+            future.cancel()
+            token.check()
+        try:
+            return future.result(timeout=0.25)
+        except concurrent.futures.TimeoutError:
+            continue
+
+
+@app.route('/api/analyze-sites-batch', methods=['POST'])
+async def analyze_sites_batch():
+    """
+    Analyze many sites in shared Sphinx sessions (see server.analyze_sites_batch)
+
+    Cache lookups and batching run in a worker thread; each session's
+    sphinx-cli run is scheduled back onto the event loop.
+    """
+    data = await request_body()
+    error = validate_batch_sites(data.get('sites', []))
+    if error:
+        return jsonify({'error': error}), 400
+
+    loop = asyncio.get_running_loop()
+    token = CancelToken()
+
+    def run_session(*batch_request):
+        return run_on_loop(sphinx_batch_session(*batch_request), loop, token)
+
+    async def run_batch():
+        try:
+            return await asyncio.to_thread(analyze_sites_batch_task, data, token, run_session)
+        finally:
+            token.cancel()  # stops the worker thread's sessions too
+
+    return await run_in_request_scope('analyze-sites-batch', data, run_batch())
+
+
+@app.route('/api/rank-sites', methods=['POST'])
+async def rank_sites():
+    """
+    Rank multiple sites using Sphinx AI
+    Send {"mode": "fast"} (or ?mode=fast) to rank locally without Sphinx
+    """
+    data = await request_body()
+    sites = data.get('sites', [])
+
+    if request.args.get('stream') or data.get('stream'):
+        return jsonify({'error': 'Streaming rankings are served by server.py'}), 400
+
+    if (request.args.get('mode') or data.get('mode')) == 'fast':
+        return await rank_sites_fast(data)
+
+    if len(sites) > RANK_SHARD_SIZE and not data.get('noShard'):
+        return await run_in_request_scope('rank-sites', data, rank_sites_sharded(data))
+    return await run_in_request_scope('rank-sites', data, cached_sphinx_analysis(*rank_sites_request(data), data))
+
+
+@app.route('/api/compare-sites', methods=['POST'])
+async def compare_sites():
+    """
+    Compare 2-5 sites side-by-side
+    The local comparison is returned under 'local' (alone with mode=fast, or
+    as the first event with {"stream": "ndjson" | "sse"})
+    """
+    data = await request_body()
+    sites = data.get('sites', [])
+
+    if len(sites) < 2 or len(sites) > 5:
+        return jsonify({'error': 'Can only compare 2-5 sites'}), 400
+
+    try:
+        prepared = await asyncio.to_thread(compare_sites_prepare, data)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each site needs embeddings or numeric lat and lon'}), 400
+    local = prepared[1]
+
+    if (request.args.get('mode') or data.get('mode')) == 'fast':
+        return jsonify({'success': True, 'mode': 'fast', 'data': local})
+
+    stream_format = request.args.get('stream') or data.get('stream')
+    if stream_format:
+        if stream_format is True:
+            stream_format = 'sse' if 'text/event-stream' in request.headers.get('Accept', '') else 'ndjson'
+        return Response(
+            compare_sites_streaming(data, prepared, stream_format, request_scope(data)),
+            mimetype='text/event-stream' if stream_format == 'sse' else 'application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    async def compare():
+        result = await cached_sphinx_analysis(*compare_sites_request(data, prepared), data)
+        return {**result, 'local': local}
+
+    return await run_in_request_scope('compare-sites', data, compare())
+
+
+async def compare_sites_streaming(data, prepared, stream_format, scope):
+    """'local' event at once, then the Sphinx 'final' event"""
+    yield stream_event(stream_format, 'local', {'source': 'local', 'data': prepared[1]})
+    try:
+        result = await await_in_request_scope(
+            'compare-sites', scope, cached_sphinx_analysis(*compare_sites_request(data, prepared), data)
+        )
+        yield stream_event(stream_format, 'final', {'source': 'sphinx', 'result': {**result, 'local': prepared[1]}})
+    except JobCancelled as e:
+        yield stream_event(stream_format, 'error', cancelled_payload(stopped_reason(e)))
+    except Exception as e:
+        print(f"❌ Streaming comparison failed: {e}")
+        yield stream_event(stream_format, 'error', {'error': str(e)})
+    yield stream_event(stream_format, 'done', {})
+
+
+async def rank_sites_fast(data):
+    """
+    Rank sites with the local scoring engine (see server.rank_sites_fast)
+
+    Optional "narrativeTopK": K awaits a Sphinx ranking of the top K sites.
+    """
+    sites = data.get('sites', [])
+    project_type = data.get('projectType')
+
+    try:
+        limit, top_k = fast_rank_options(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit and narrativeTopK must be non-negative integers'}), 400
+
+    try:
+        with stage('embeddings'):
+            embeddings = await asyncio.to_thread(site_embedding_matrix, sites)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each site needs embeddings or numeric lat and lon'}), 400
+
+    ranked = rank_sites_local(sites, embeddings, project_type, limit=limit)
+    print(f"⚡ Fast-ranked {len(sites)} sites for {project_type}")
+
+    response = {'success': True, 'mode': 'fast', 'data': ranked}
+
+    if top_k > 0 and ranked:
+        narrative_request = {**data, 'sites': narrative_sites(sites, embeddings, ranked, top_k)}
+        response['narrative'] = await cached_sphinx_analysis(*rank_sites_request(narrative_request), narrative_request)
+
+    return jsonify(response)
+
+
+async def rank_sites_sharded(data):
+    """
+    Sharded ranking (see server.rank_sites_sharded_task)
+
+    The shard pool's threads only wait: each shard's Sphinx run is scheduled
+    back onto the event loop. When the request is cancelled (deadline,
+    disconnect, supersession) the token stops the pool and its shard runs.
+    """
+    sites = data.get('sites', [])
+    project_type = data.get('projectType')
+    shard_size = max(2, int(data.get('shardSize') or RANK_SHARD_SIZE))
+    loop = asyncio.get_running_loop()
+    token = CancelToken()
+
+    with stage('embeddings'):
+        embeddings = await asyncio.to_thread(site_embedding_matrix, sites)
+    sites = [{**site, 'embeddings': embeddings[i].tolist()} for i, site in enumerate(sites)]
+    prescores = [site['score'] for site in score_sites_local(sites, embeddings, project_type)]
+
+    def rank_shard(shard_sites):
+        shard_request = {**data, 'sites': shard_sites}
+        return run_on_loop(cached_sphinx_analysis(*rank_sites_request(shard_request), shard_request), loop, token)
+
+    try:
+        return await asyncio.to_thread(
+            sharded_rank,
+            sites,
+            rank_shard,
+            prescores,
+            shard_size=shard_size,
+            max_parallel=SPHINX_MAX_PARALLEL,
+            top_k=int(data.get('topK') or 10),
+            tie_margin=float(data.get('tieMargin') or 2.0),
+            token=token
+        )
+    finally:
+        token.cancel()  # stops shards still queued or running in the pool
+
+
+async def leased_notebook(create_notebook):
+    """
+    create_notebook() in a worker thread; returns the leased notebook path
+
+    If we're cancelled while the thread is still writing, the lease is
+    handed back once it finishes instead of leaking.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(create_notebook))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        task.add_done_callback(
+            lambda done: done.cancelled() or done.exception() or notebook_store.release(done.result())
+        )
+        raise
+
+
+async def cached_sphinx_analysis(kind, inputs, create_notebook, prompt, data):
+    """
+    run_sphinx_analysis behind the result cache and single-flight
+    (async counterpart of server.cached_sphinx_analysis)
+    """
+    key = result_cache.make_key(kind, PROMPT_TEMPLATE_VERSION, inputs)
+
+    if data.get('bypassCache'):
+        result_cache.record_bypass()
+        RESULT_CACHE_LOOKUPS.inc(kind=kind, result='bypass')
+    else:
+        cached = await asyncio.to_thread(result_cache.get, key)
+        RESULT_CACHE_LOOKUPS.inc(kind=kind, result='hit' if cached is not None else 'miss')
+        if cached is not None:
+            print(f"💾 Cache hit for {kind} ({key[:12]})")
+            return {**cached, 'cached': True}
+
+    async def run():
+        with stage('notebook'):
+            notebook_path = await leased_notebook(create_notebook)
+        try:
+            result = await run_sphinx_analysis(notebook_path, prompt, kind)
+        finally:
+            notebook_store.release(notebook_path)
+
+        if is_cacheable_result(result):
+            await asyncio.to_thread(result_cache.put, key, kind, result)
+        return result
+
+    result, shared = await sphinx_flights.do(key, run)
+    if shared:
+        print(f"🔗 Joined in-flight {kind} run ({key[:12]})")
+    return {**result, 'cached': False, 'coalesced': shared}
+
+
+async def sphinx_batch_session(kind, inputs, create_notebook, prompt):
+    """One coalesced, uncached Sphinx session (async counterpart of server.sphinx_batch_session)"""
+    key = result_cache.make_key(kind, PROMPT_TEMPLATE_VERSION, inputs)
+
+    async def run():
+        with stage('notebook'):
+            notebook_path = await leased_notebook(create_notebook)
+        try:
+            return await run_sphinx_analysis(notebook_path, prompt, kind)
+        finally:
+            notebook_store.release(notebook_path)
+
+    result, shared = await sphinx_flights.do(key, run)
+    if shared:
+        print(f"🔗 Joined in-flight {kind} run ({key[:12]})")
+    return result
+
+
+# ============================================================================
+# CLAUDE CHAT
+# ============================================================================
+
+@app.route('/api/chat', methods=['POST'])
+async def chat_with_claude():
+    """
+    Chat endpoint using Claude API for ocean site questions
+    Send {"stream": true} to receive tokens as server-sent events
+    Deadlines and supersession work as in server.chat_with_claude
+    """
+    data = await request.get_json()
+
+    if not CLAUDE_API_KEY:
+        return jsonify({
+            'success': False,
+            'message': 'Claude API key not configured. Please add CLAUDE_API_KEY to your .env file.'
+        }), 500
+
+    try:
+        claude_chat.async_client()
+        token = CancelToken(requested_deadline(request.headers, data, REQUEST_DEADLINE_CAP))
+        session = requested_session(request.headers, data)
+
+        # May summarize older turns with a (blocking) Claude call, bounded by the deadline
+        with stage('chat_context'):
+            system, claude_messages, context_info = await asyncio.to_thread(
+                build_chat_request, data, token.remaining()
+            )
+        if token.expired:
+            return jsonify(cancelled_payload(None)), cancelled_status(None)
+
+        print(f"💬 Sending to Claude API... ({len(claude_messages)} messages, "
+              f"{context_info['summarized']} summarized, ~{context_info['estimated_tokens']} tokens)")
+
+        if data.get('stream'):
+            return Response(
+                stream_chat(system, claude_messages, token, session),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        try:
+            with stage('claude'):
+                assistant_message, usage = await await_in_request_scope(
+                    'chat', (token.remaining(), session),
+                    claude_chat.acomplete(system, claude_messages, max_tokens=1000, timeout=token.remaining())
+                )
+        except JobCancelled as e:
+            reason = stopped_reason(e)
+            return jsonify(cancelled_payload(reason)), cancelled_status(reason)
+
+        print(f"✅ Claude response received ({len(assistant_message)} chars, {usage.get('cache_read_input_tokens', 0)} cached tokens)")
+
+        return jsonify({
+            'success': True,
+            'message': assistant_message,
+            'usage': usage,
+            'context': context_info
+        })
+
+    except ImportError:
+        return jsonify({
+            'success': False,
+            'message': 'Anthropic library not installed. Run: pip install anthropic'
+        }), 500
+    except Exception as e:
+        print(f"❌ Claude API error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Error communicating with Claude: {str(e)}'
+        }), 500
+
+
+async def stream_chat(system, claude_messages, token, session=None):
+    """SSE generator relaying Claude's token stream (stopped early if token is cancelled or expires)"""
+    chars = 0
+    started = time.perf_counter()
+    items = claude_chat.astream(system, claude_messages, max_tokens=1000, timeout=token.remaining())
+    request_sessions.begin(session, 'chat', token)
+    try:
+        async for item in items:
+            if token.cancelled or token.expired:
+                print(f"🛑 Claude stream stopped ({token.reason or 'deadline'}) after {chars} chars")
+                yield f"event: error\ndata: {json.dumps(cancelled_payload(token.reason))}\n\n"
+                return
+            if isinstance(item, str):
+                if not chars:
+                    record_stage('claude_first_token', time.perf_counter() - started)
+                chars += len(item)
+                yield f"event: delta\ndata: {json.dumps({'text': item})}\n\n"
+            else:
+                record_stage('claude', time.perf_counter() - started)
+                print(f"✅ Claude stream finished ({chars} chars)")
+                yield f"event: done\ndata: {json.dumps({'success': True, **item})}\n\n"
+    except Exception as e:
+        print(f"❌ Claude API error: {e}")
+        error = {'success': False, 'message': f'Error communicating with Claude: {str(e)}'}
+        yield f"event: error\ndata: {json.dumps(error)}\n\n"
+    finally:
+        request_sessions.end(session, 'chat', token)
+        await items.aclose()  # closes the HTTP stream if we stopped early
+
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """Check backend health and Sphinx configuration"""
+    return jsonify({
+        'status': 'ok',
+        'mode': 'async',
+        'sphinx_configured': bool(SPHINX_API_KEY),
+        'claude_configured': bool(CLAUDE_API_KEY),
+        'embedding_cache': alphaearth.stats(),
+        'embedding_rasters': region_rasters.describe(),
+        'result_cache': result_cache.stats(),
+        'sphinx_coalescing': sphinx_flights.stats(),
+        'request_cancellation': {'deadline_cap_s': REQUEST_DEADLINE_CAP, 'sessions': request_sessions.describe()},
+        'notebooks': notebook_store.stats(),
+        'chat_context': chat_context.stats()
+    })
+
+
+# ============================================================================
+# SPHINX CLI EXECUTION
+# ============================================================================
+
+async def run_sphinx_analysis(notebook_path, prompt, kind=None, timeout=SPHINX_TIMEOUT):
+    """
+    Execute Sphinx CLI without blocking the event loop
+
+    stdout is parsed incrementally as it arrives. On timeout, or if the
+    awaiting request is cancelled, the whole process group is killed.
+    """
+    if not SPHINX_API_KEY:
+        SPHINX_RUNS.inc(outcome='mock')
+        return mock_sphinx_result()
+
+    cmd, env = sphinx_command(notebook_path, prompt)
+    print(f"🤖 Running Sphinx CLI...")
+    print(f"📓 Notebook: {notebook_path}")
+
+    try:
+        with stage('sphinx_spawn'):
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                env=env,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True  # own process group, so the kill reaches its children
+            )
+    except OSError as e:
+        print(f"❌ Error running Sphinx: {e}")
+        SPHINX_RUNS.inc(outcome='error')
+        return {'success': False, 'error': str(e)}
+    run_started = time.perf_counter()
+
+    extractor = JSONStreamExtractor()
+    values = []
+
+    async def read_stdout():
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            chunk = await process.stdout.read(65536)
+            if not chunk:
+                break
+            values.extend(extractor.feed(decoder.decode(chunk)))
+        values.extend(extractor.feed(decoder.decode(b'', final=True)))
+
+    async def communicate():
+        return await asyncio.gather(read_stdout(), process.stderr.read(), process.wait())
+
+    try:
+        _, stderr, _ = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        kill_process_tree(process)
+        await process.wait()
+        print("❌ Sphinx CLI timed out")
+        SPHINX_RUNS.inc(outcome='timeout')
+        return {'success': False, 'error': 'Analysis timed out'}
+    except asyncio.CancelledError:
+        kill_process_tree(process)
+        # Reap it in the background: awaiting here would delay the cancellation
+        asyncio.ensure_future(process.wait())
+        print("🛑 Sphinx run cancelled")
+        SPHINX_RUNS.inc(outcome='cancelled')
+        raise
+    finally:
+        record_stage('sphinx_run', time.perf_counter() - run_started)
+
+    if process.returncode != 0:
+        stderr = stderr.decode('utf-8', errors='replace')
+        print(f"❌ Sphinx CLI error: {stderr}")
+        SPHINX_RUNS.inc(outcome='error')
+        return {'success': False, 'error': stderr}
+
+    output = extractor.output
+    print(f"✅ Sphinx output received ({len(output)} chars)")
+
+    with stage('parse'):
+        analysis_result = final_result(extractor, values, kind)
+    if analysis_result is None:
+        print(f"⚠️ Could not parse JSON from Sphinx output")
+        SPHINX_PARSE_FALLBACKS.inc(kind=kind or 'unknown')
+        analysis_result = {'raw_output': output}
+
+    SPHINX_RUNS.inc(outcome='ok')
+
+    return {
+        'success': True,
+        'data': analysis_result
+    }
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🚀 OceanCarbon AI Backend Server Starting (async mode)...")
+    print("=" * 60)
+    print(f"📊 Sphinx AI: {'Configured ✓' if SPHINX_API_KEY else 'Not configured ✗'}")
+    print(f"💬 Claude AI: {'Configured ✓' if CLAUDE_API_KEY else 'Not configured ✗'}")
+    print(f"🌐 API URL: http://localhost:5001")
+    print(f"🌊 Ready to analyze ocean sites!\n")
+
+    app.run(debug=True, port=5001)
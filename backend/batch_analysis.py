@@ -0,0 +1,109 @@
+"""
+Many single-site analyses in as few Sphinx sessions as possible
+
+Every /api/analyze-site call pays for a sphinx-cli start, a notebook and a
+model warm-up. A batch packs its sites into one notebook and one prompt that
+asks for a JSON object keyed by site key, splits the per-site answers out of
+it, and re-runs only the sites whose entries are missing or malformed (in a
+smaller batch, so the retry is cheap). Very large batches are cut into
+chunks of `batch_size` sites run in parallel under a concurrency cap.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sphinx_output import SCHEMAS, matches_schema
+
+
+def batch_keys(sites):
+    """
+    Key for each site: its "id" if given, else its position
+
+    Raises ValueError on duplicate keys.
+    """
+    keys = [str(site.get('id')) if site.get('id') is not None else str(i) for i, site in enumerate(sites)]
+    if len(set(keys)) != len(keys):
+        raise ValueError('Site ids must be unique')
+    return keys
+
+
+def valid_site_answer(entry):
+    """True for an analyze-site shaped answer with a numeric score"""
+    if not matches_schema(entry, SCHEMAS['analyze-site']):
+        return False
+    score = entry['score']
+    return isinstance(score, (int, float)) and not isinstance(score, bool)
+
+
+def split_batch_result(result, keys):
+    """
+    Well-formed per-site answers in one batch result
+
+    Accepts the keyed object itself or one wrapped in {"results": {...}};
+    a batch of a single site may also be answered with the bare analysis.
+
+    Returns:
+        {key: answer} for the keys with a valid entry
+    """
+    data = result.get('data') if result.get('success') else None
+    if not isinstance(data, dict):
+        return {}
+    if isinstance(data.get('results'), dict) and not any(key in data for key in keys):
+        data = data['results']
+
+    answers = {key: data[key] for key in keys if valid_site_answer(data.get(key))}
+    if not answers and len(keys) == 1 and valid_site_answer(data):
+        answers[keys[0]] = data
+    return answers
+
+
+def analyze_batch(keys, run_fn, batch_size=25, max_parallel=4, retries=1, token=None):
+    """
+    Analyze sites through keyed batch runs, retrying only what is missing
+
+    Args:
+        keys: Site keys to analyze
+        run_fn: Callable(list_of_keys) -> run_sphinx_analysis style result
+        batch_size: Sites per Sphinx session
+        max_parallel: Concurrent sessions when there is more than one chunk
+        retries: Extra rounds for sites with a missing or malformed entry
+        token: Optional jobs.CancelToken
+
+    Returns:
+        (answers {key: answer}, errors {key: message}, stats dict)
+    """
+    answers = {}
+    errors = {}
+    pending = list(keys)
+    runs = 0
+    rerun = 0
+
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt:
+            rerun += len(pending)
+            print(f"🔁 Re-running {len(pending)} sites with missing or malformed answers")
+
+        chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+        def run_chunk(chunk):
+            if token is not None:
+                token.check()
+            return chunk, run_fn(chunk)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(chunks))),
+                                thread_name_prefix='batch-analysis') as pool:
+            outcomes = list(pool.map(run_chunk, chunks))
+        runs += len(chunks)
+
+        for chunk, result in outcomes:
+            found = split_batch_result(result, chunk)
+            answers.update(found)
+            for key in chunk:
+                if key in found:
+                    errors.pop(key, None)
+                else:
+                    errors[key] = result.get('error') or 'Missing or malformed entry in the batch answer'
+        pending = [key for key in pending if key not in answers]
+
+    return answers, errors, {'sphinxRuns': runs, 'rerun': rerun, 'failed': len(errors)}
@@ -0,0 +1,14 @@
+"""
+Benchmark suite for the backend
+
+Run from backend/:
+
+    python -m benchmarks micro                  # in-process micro-benchmarks
+    python -m benchmarks load                   # endpoints under load
+    python -m benchmarks all --out results/run.json
+    python -m benchmarks compare old.json new.json
+
+Load runs start server.py (or async_server.py with --server async) against
+a stub sphinx-cli and a stub AlphaEarth/Claude HTTP server, so nothing here
+needs API keys or network access.
+"""
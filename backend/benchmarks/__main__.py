@@ -0,0 +1,134 @@
+"""
+Command line entry point: python -m benchmarks {micro,load,all,compare}
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.load import ENDPOINTS, run_load
+from benchmarks.micro import run_micro
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, cwd=RESULTS_DIR.parent, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _write_results(results, out):
+    path = Path(out) if out else RESULTS_DIR / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2))
+    print(f"💾 Results written to {path}")
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return ''
+    return f'{(new - old) / old * 100:+.1f}%'
+
+
+def compare(old_path, new_path):
+    """Print per-case differences between two result files"""
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    print(f"Comparing {old.get('commit')} ({old_path}) -> {new.get('commit')} ({new_path})\n")
+
+    old_micro, new_micro = old.get('micro', {}), new.get('micro', {})
+    if old_micro or new_micro:
+        print(f"{'micro-benchmark':40} {'old µs':>12} {'new µs':>12} {'change':>9}")
+        for name in sorted(set(old_micro) | set(new_micro)):
+            before = old_micro.get(name, {}).get('median_us')
+            after = new_micro.get(name, {}).get('median_us')
+            print(f"{name:40} {before if before is not None else '-':>12} "
+                  f"{after if after is not None else '-':>12} {_change(before, after):>9}")
+        print()
+
+    def runs(results):
+        return {(r['endpoint'], r['concurrency']): r for r in results.get('load', {}).get('runs', [])}
+
+    old_runs, new_runs = runs(old), runs(new)
+    if old_runs or new_runs:
+        print(f"{'endpoint @ concurrency':30} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'req/s':>16}")
+        for key in sorted(set(old_runs) | set(new_runs)):
+            before, after = old_runs.get(key, {}), new_runs.get(key, {})
+            cells = []
+            for metric in ('p50', 'p95', 'p99'):
+                a = before.get('latency_ms', {}).get(metric)
+                b = after.get('latency_ms', {}).get(metric)
+                cells.append(f"{b if b is not None else '-'} {_change(a, b):>7}")
+            cells.append(f"{after.get('rps', '-')} {_change(before.get('rps'), after.get('rps')):>7}")
+            print(f"{key[0] + ' @ ' + str(key[1]):30} " + ' '.join(f'{cell:>16}' for cell in cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='OceanCarbon AI backend benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_run_options(command, load=True, micro=True):
+        command.add_argument('--out', help='Result file (default: benchmarks/results/bench-<time>.json)')
+        if micro:
+            command.add_argument('--quick', action='store_true', help='Fewer iterations per micro-benchmark')
+        if load:
+            command.add_argument('--endpoints', nargs='+', default=list(ENDPOINTS), choices=ENDPOINTS)
+            command.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32])
+            command.add_argument('--requests', type=int, default=100, help='Requests per endpoint and level')
+            command.add_argument('--server', choices=['sync', 'async'], default='sync')
+            command.add_argument('--port', type=int, default=5099)
+            command.add_argument('--sphinx-latency', default='0.2', help='Seconds, or a range like 0.2-0.8')
+            command.add_argument('--sphinx-output', default='json', choices=['json', 'prose', 'malformed', 'fail'])
+            command.add_argument('--stub-latency', type=float, default=0.0, help='AlphaEarth/Claude stub delay')
+            command.add_argument('--cache', action='store_true', help='Let the result cache serve repeats')
+
+    add_run_options(commands.add_parser('micro', help='In-process micro-benchmarks'), load=False)
+    add_run_options(commands.add_parser('load', help='Endpoints under load against the stubs'), micro=False)
+    add_run_options(commands.add_parser('all', help='Micro-benchmarks, then the load run'))
+    compare_parser = commands.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        compare(args.old, args.new)
+        return 0
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+    }
+    if args.command in ('micro', 'all'):
+        print("🔬 Micro-benchmarks")
+        results['micro'] = run_micro(quick=args.quick)
+    if args.command in ('load', 'all'):
+        print("🚦 Load benchmarks")
+        results['load'] = run_load(
+            endpoints=args.endpoints,
+            concurrency=args.concurrency,
+            requests=args.requests,
+            server=args.server,
+            port=args.port,
+            sphinx_latency=args.sphinx_latency,
+            sphinx_output=args.sphinx_output,
+            stub_latency=args.stub_latency,
+            use_cache=args.cache,
+        )
+    _write_results(results, args.out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+Load generator for the backend endpoints
+
+Starts the server as a subprocess wired to the stubs (stub sphinx-cli on
+PATH, CLAUDE_BASE_URL at the stub server, caches in a scratch directory),
+then drives each endpoint with a fixed number of requests at each
+concurrency level over keep-alive connections. The server's RSS is sampled
+while each run is in flight.
+"""
+
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from alphaearth_service import generate_mock_embeddings_batch
+from benchmarks.stubs import StubServer, install_stub_sphinx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = ('get-embeddings', 'analyze-site', 'analyze-sites-batch', 'rank-sites', 'compare-sites', 'chat')
+
+SERVER_COMMANDS = {
+    'sync': "import server; server.app.run(host='127.0.0.1', port={port}, threaded=True)",
+    'async': "import async_server; async_server.app.run(host='127.0.0.1', port={port})",
+}
+
+
+def _site(rng, i):
+    lat, lon = rng.uniform(-60, 60), rng.uniform(-180, 180)
+    embeddings = generate_mock_embeddings_batch([lat], [lon])[0]
+    return {'name': f'Site {i}', 'lat': lat, 'lon': lon, 'embeddings': embeddings.tolist()}
+
+
+def make_payload(endpoint, i, rng, use_cache=False, rank_sites=8, batch_sites=20):
+    """(path, body) for the i-th request to an endpoint"""
+    bypass = {} if use_cache else {'bypassCache': True}
+    if endpoint == 'get-embeddings':
+        return '/api/get-embeddings', {'lat': rng.uniform(-60, 60), 'lon': rng.uniform(-180, 180)}
+    if endpoint == 'analyze-site':
+        site = _site(rng, i)
+        return '/api/analyze-site', {
+            'location': {'lat': site['lat'], 'lon': site['lon']},
+            'embeddings': site['embeddings'],
+            'projectType': 'Kelp Cultivation',
+            **bypass
+        }
+    if endpoint == 'analyze-sites-batch':
+        return '/api/analyze-sites-batch', {
+            'sites': [_site(rng, j) for j in range(batch_sites)],
+            'projectType': 'Kelp Cultivation',
+            **bypass
+        }
+    if endpoint == 'rank-sites':
+        return '/api/rank-sites', {
+            'sites': [_site(rng, j) for j in range(rank_sites)],
+            'projectType': 'Kelp Cultivation',
+            **bypass
+        }
+    if endpoint == 'compare-sites':
+        return '/api/compare-sites', {
+            'sites': [_site(rng, j) for j in range(3)],
+            'projectType': 'Kelp Cultivation',
+            **bypass
+        }
+    if endpoint == 'chat':
+        return '/api/chat', {
+            'messages': [{'role': 'user', 'content': f'Which site is best for kelp? ({i})'}],
+            'context': {'region': 'Monterey Bay', 'projectType': 'Kelp Cultivation'}
+        }
+    raise ValueError(f'Unknown endpoint {endpoint}')
+
+
+def read_rss_mb(pid, field='VmRSS'):
+    """Resident (or, with field='VmHWM', peak resident) memory of a process in MB"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class ServerProcess:
+    """The backend under test, started against the stubs"""
+
+    def __init__(self, kind='sync', port=5099, stub_url=None, env=None):
+        self.kind = kind
+        self.port = port
+        self.scratch = tempfile.TemporaryDirectory(prefix='oceancarbon-bench-')
+        scratch = Path(self.scratch.name)
+        bin_dir = install_stub_sphinx(scratch / 'bin')
+
+        self.env = os.environ.copy()
+        self.env.update({
+            'PATH': bin_dir + os.pathsep + self.env.get('PATH', ''),
+            'SPHINX_API_KEY': 'bench',
+            'CLAUDE_API_KEY': 'bench',
+            'EMBEDDING_CACHE_DIR': str(scratch / 'embeddings'),
+            'EMBEDDING_RASTER_DIR': str(scratch / 'rasters'),
+            'RESULT_CACHE_PATH': str(scratch / 'results.sqlite3'),
+            'NOTEBOOK_DIR': str(scratch / 'notebooks'),
+            'PYTHONUNBUFFERED': '1',
+        })
+        if stub_url:
+            self.env['CLAUDE_BASE_URL'] = stub_url
+            self.env['ALPHAEARTH_URL'] = stub_url + '/v1'
+        self.env.update(env or {})
+        self.process = None
+
+    def start(self, timeout=30):
+        command = SERVER_COMMANDS[self.kind].format(port=self.port)
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', command],
+            cwd=BACKEND_DIR,
+            env=self.env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{self.kind} server exited with code {self.process.returncode}')
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                connection.request('GET', '/health')
+                if connection.getresponse().status == 200:
+                    return self
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'{self.kind} server did not come up on port {self.port}')
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.scratch.cleanup()
+
+
+class _RSSSampler:
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = read_rss_mb(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def summarize(latencies, errors, elapsed):
+    """Latency percentiles (ms) and throughput for one run"""
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    completed = len(latencies_ms)
+    summary = {
+        'requests': completed + errors,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(completed / elapsed, 2) if elapsed > 0 else None,
+    }
+    if completed:
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        summary['latency_ms'] = {
+            'p50': round(float(p50), 2),
+            'p95': round(float(p95), 2),
+            'p99': round(float(p99), 2),
+            'mean': round(float(latencies_ms.mean()), 2),
+            'max': round(float(latencies_ms.max()), 2),
+        }
+    return summary
+
+
+def run_endpoint(port, pid, endpoint, concurrency, requests, use_cache=False, seed=0, timeout=300):
+    """
+    Fire `requests` requests at one endpoint with `concurrency` workers
+
+    Payloads are generated up front so client-side work is not timed.
+    """
+    rng = random.Random(f'{seed}-{endpoint}')
+    payloads = [make_payload(endpoint, i, rng, use_cache) for i in range(requests)]
+    next_index = iter(range(requests))
+    index_lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def worker():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                break
+            path, body = payloads[i]
+            encoded = json.dumps(body).encode('utf-8')
+            started = time.perf_counter()
+            try:
+                connection.request('POST', path, body=encoded, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                ok = False
+            elapsed = time.perf_counter() - started
+            (latencies if ok else errors).append(elapsed)
+        connection.close()
+
+    with _RSSSampler(pid) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+        elapsed = time.perf_counter() - started
+
+    summary = summarize(latencies, len(errors), elapsed)
+    summary.update({
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'cache': use_cache,
+        'peak_rss_mb': round(sampler.peak, 1),
+    })
+    return summary
+
+
+def run_load(endpoints=ENDPOINTS, concurrency=(1, 8, 32), requests=100, server='sync',
+             port=5099, sphinx_latency='0.2', sphinx_output='json', stub_latency=0.0,
+             use_cache=False):
+    """
+    Start the stubs and the server, run every endpoint at every concurrency level
+
+    Returns:
+        {'config': ..., 'runs': [...], 'server_peak_rss_mb': ...}
+    """
+    stub = StubServer(latency=stub_latency).start()
+    process = ServerProcess(server, port, stub_url=stub.url, env={
+        'STUB_SPHINX_LATENCY': str(sphinx_latency),
+        'STUB_SPHINX_OUTPUT': sphinx_output,
+    })
+    runs = []
+    try:
+        process.start()
+        for endpoint in endpoints:
+            for level in concurrency:
+                print(f"⏱️  {endpoint} x{requests} at concurrency {level}")
+                result = run_endpoint(port, process.pid, endpoint, level, requests, use_cache)
+                latency = result.get('latency_ms', {})
+                print(f"   p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, "
+                      f"p99 {latency.get('p99')} ms, {result['rps']} req/s, {result['errors']} errors")
+                runs.append(result)
+        server_peak = read_rss_mb(process.pid, 'VmHWM')
+    finally:
+        process.stop()
+        stub.stop()
+
+    return {
+        'config': {
+            'server': server,
+            'requests': requests,
+            'concurrency': list(concurrency),
+            'sphinx_latency': str(sphinx_latency),
+            'sphinx_output': sphinx_output,
+            'stub_latency': stub_latency,
+            'cache': use_cache,
+        },
+        'runs': runs,
+        'server_peak_rss_mb': round(server_peak, 1) if server_peak is not None else None,
+        'stub_requests': dict(stub.requests),
+    }
@@ -0,0 +1,154 @@
+"""
+In-process micro-benchmarks
+
+Each case is timed with timeit (best-of and median of several repeats) and
+reported per operation, so runs on the same machine can be compared.
+"""
+
+import json
+import tempfile
+import timeit
+
+import numpy as np
+
+from alphaearth_service import AlphaEarthService, generate_mock_embeddings_batch
+from embedding_cache import EmbeddingCache
+from embedding_store import EmbeddingStore, ingest
+from heatmap import HeatmapTiles, tiles_for_bbox
+from notebooks import NotebookStore
+from ranking_sessions import RankingSession
+from scoring import rank_sites_local
+from sphinx_output import JSONStreamExtractor, extract_result
+
+
+def _timed(fn, number, repeat):
+    times = np.asarray(timeit.Timer(fn).repeat(repeat=repeat, number=number)) / number
+    return {
+        'number': number,
+        'repeat': repeat,
+        'best_us': round(float(times.min()) * 1e6, 2),
+        'median_us': round(float(np.median(times)) * 1e6, 2),
+    }
+
+
+def _sphinx_output(sites=20, padding=50000):
+    """Realistic sphinx-cli stdout: chatter with stray braces, then a fenced ranking"""
+    ranking = [
+        {'rank': i + 1, 'name': f'Site {i}', 'score': 90 - i,
+         'metrics': {'temperature': 14.0, 'chlorophyll': 2.0},
+         'analysis': {'strengths': ['a "quoted" {brace}'], 'concerns': []}}
+        for i in range(sites)
+    ]
+    chatter = ('Looking at cell {3} of the notebook [draft]. ' * (padding // 45 + 1))[:padding]
+    return chatter + '\n```json\n' + json.dumps(ranking, indent=2) + '\n```\nDone.\n'
+
+
+def _sites(n, rng):
+    lats = rng.uniform(-60, 60, n)
+    lons = rng.uniform(-180, 180, n)
+    embeddings = generate_mock_embeddings_batch(lats, lons)
+    sites = [{'name': f'Site {i}', 'lat': float(lats[i]), 'lon': float(lons[i])} for i in range(n)]
+    return sites, embeddings
+
+
+def run_micro(quick=False):
+    """
+    Run every micro-benchmark
+
+    Returns:
+        {case name: {'number', 'repeat', 'best_us', 'median_us'}}
+    """
+    repeat = 3 if quick else 5
+    scale = 0.2 if quick else 1.0
+    rng = np.random.default_rng(0)
+    results = {}
+
+    def case(name, fn, number):
+        number = max(1, int(number * scale))
+        results[name] = _timed(fn, number, repeat)
+        print(f"⏱️  {name}: {results[name]['median_us']} µs/op")
+
+    # Embedding generation
+    service = AlphaEarthService()
+    coords = iter(rng.uniform(-60, 60, (10 ** 6, 2)))
+    case('embeddings.single_mock', lambda: service.get_embeddings(*next(coords)), 500)
+    lats, lons = rng.uniform(-60, 60, 1000), rng.uniform(-180, 180, 1000)
+    case('embeddings.batch_1000', lambda: generate_mock_embeddings_batch(lats, lons), 20)
+
+    cache = EmbeddingCache(service, maxsize=1024)
+    cache.get_embeddings(36.6, -121.9)
+    case('embedding_cache.lru_hit', lambda: cache.get_embeddings(36.6, -121.9), 5000)
+
+    # Ingested export store: nearest-point lookups over 200k samples
+    with tempfile.TemporaryDirectory(prefix='oceancarbon-bench-store-') as directory:
+        export = f'{directory}/export.npz'
+        np.savez(export, lats=rng.uniform(30, 40, 200000), lons=rng.uniform(-125, -115, 200000),
+                 embeddings=rng.standard_normal((200000, 64)).astype(np.float32))
+        store = EmbeddingStore(ingest(export, directory, name='export'))
+        queries = rng.uniform((30, -125), (40, -115), (1000, 2))
+        points = iter(queries.tolist() * 10 ** 3)
+
+        def lookup_single():
+            lat, lon = next(points)
+            store.lookup([lat], [lon])
+
+        case('embedding_store.lookup_single', lookup_single, 500)
+        case('embedding_store.lookup_1000', lambda: store.lookup(queries[:, 0], queries[:, 1]), 20)
+
+    # Notebook writing (fresh inputs each call, so nothing is reused)
+    with tempfile.TemporaryDirectory(prefix='oceancarbon-bench-nb-') as directory:
+        store = NotebookStore(directory, gc_every=10 ** 9)
+        vectors = iter(rng.standard_normal((10 ** 5, 64)).astype(np.float32))
+        case('notebook.site_analysis',
+             lambda: store.site_analysis(next(vectors), {'lat': 36.6, 'lon': -121.9}, 'Kelp Cultivation'), 200)
+
+        sites, embeddings = _sites(50, rng)
+        counter = iter(range(10 ** 6))
+
+        def write_ranking():
+            shift = next(counter)
+            store.ranking(
+                [{**site, 'embeddings': embeddings[i] + shift} for i, site in enumerate(sites)],
+                'Kelp Cultivation'
+            )
+
+        case('notebook.ranking_50', write_ranking, 50)
+
+    # Output parsing
+    output = _sphinx_output()
+    case('parse.extract_result_50kb', lambda: extract_result(output, 'rank-sites'), 20)
+
+    chunks = [output[i:i + 4096] for i in range(0, len(output), 4096)]
+
+    def stream_parse():
+        extractor = JSONStreamExtractor()
+        for chunk in chunks:
+            extractor.feed(chunk)
+
+    case('parse.stream_extractor_4kb_chunks', stream_parse, 20)
+
+    # Local scoring
+    sites, embeddings = _sites(1000, rng)
+    case('scoring.rank_local_1000', lambda: rank_sites_local(sites, embeddings, 'Kelp Cultivation'), 20)
+
+    # Ranking session edits over 1000 sites: one site added and one removed
+    session = RankingSession('Kelp Cultivation', lambda chunk: generate_mock_embeddings_batch(
+        [site['lat'] for site in chunk], [site['lon'] for site in chunk]))
+    session.apply(add=sites)
+    edits = iter(range(10 ** 6))
+
+    def edit_session():
+        i = next(edits)
+        session.apply(add=[{'id': f'edit-{i}', 'lat': 10.0 + i * 1e-3, 'lon': 20.0}],
+                      remove=[f'edit-{i - 1}'] if i else [])
+
+    case('ranking_session.edit_1000', edit_session, 200)
+
+    # Heatmap tiles (64x64 cells): scoring fresh tiles, then cache hits
+    monterey = tiles_for_bbox((36.2, 37.0, -122.2, -121.6), 9)
+    case('heatmap.score_4_tiles', lambda: HeatmapTiles(service).get_tiles(monterey, 'Kelp Cultivation'), 5)
+    warm = HeatmapTiles(service)
+    warm.get_tiles(monterey, 'Kelp Cultivation')
+    case('heatmap.cached_4_tiles', lambda: warm.get_tiles(monterey, 'Seagrass Restoration'), 2000)
+
+    return results
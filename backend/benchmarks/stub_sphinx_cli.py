@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Stand-in for `sphinx-cli chat --notebook-filepath NB --prompt PROMPT`
+
+Answers with JSON shaped like the prompt asks for (analysis, keyed batch
+analysis, ranking or comparison), wrapped in some prose.
+
+Environment:
+    STUB_SPHINX_LATENCY   Seconds before answering, or a range "0.2-0.8"
+    STUB_SPHINX_OUTPUT    json (default) | prose (no JSON) | malformed | fail
+    STUB_SPHINX_PADDING   Extra characters of chatter before the answer
+    STUB_SPHINX_DROP      Fraction of batch entries left out (exercises re-runs)
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+
+
+def latency():
+    spec = os.environ.get('STUB_SPHINX_LATENCY', '0.2')
+    if '-' in spec:
+        low, high = (float(x) for x in spec.split('-', 1))
+        return random.uniform(low, high)
+    return float(spec)
+
+
+def site_analysis():
+    return {
+        'score': random.randint(60, 95),
+        'metrics': {'temperature': 14.2, 'chlorophyll': 2.8, 'wave_energy': 4, 'depth': 120,
+                    'nutrients': 'Medium', 'ph': 8.1},
+        'strengths': ['Nutrient supply', 'Moderate waves', 'Accessible depth'],
+        'concerns': ['Seasonal storms'],
+        'recommendation': 'Proceed with a pilot deployment.'
+    }
+
+
+def answer_for(prompt):
+    names = re.findall(r'"name":\s*"([^"]*)"', prompt)
+    if prompt.lstrip().startswith('Analyze each'):
+        drop = float(os.environ.get('STUB_SPHINX_DROP', 0))
+        keys = re.findall(r'"key":\s*"([^"]*)"', prompt)
+        return {key: site_analysis() for key in keys if random.random() >= drop}
+    if prompt.lstrip().startswith('Rank'):
+        return [
+            {
+                'rank': i + 1,
+                'name': name,
+                'score': round(90 - i * 3 + random.random(), 1),
+                'metrics': {'temperature': 14.0, 'chlorophyll': 2.1},
+                'analysis': {'strengths': ['Stable conditions'], 'concerns': []}
+            }
+            for i, name in enumerate(names)
+        ]
+    if prompt.lstrip().startswith('Compare'):
+        best = names[0] if names else 'Site A'
+        return {
+            'comparison_table': {name: {'score': 80 - i} for i, name in enumerate(names)},
+            'best_for': {'protected waters': best},
+            'tradeoffs': 'Deeper sites trade access for stability.',
+            'recommendation': {'site': best, 'confidence': 80, 'reasoning': 'Highest score.'}
+        }
+    return site_analysis()
+
+
+def main(argv):
+    prompt = argv[argv.index('--prompt') + 1] if '--prompt' in argv else ''
+    mode = os.environ.get('STUB_SPHINX_OUTPUT', 'json')
+    time.sleep(latency())
+
+    if mode == 'fail':
+        sys.stderr.write('stub sphinx-cli: simulated failure\n')
+        return 1
+
+    padding = int(os.environ.get('STUB_SPHINX_PADDING', 0))
+    sys.stdout.write('Reading the notebook {cells} and running the analysis.\n')
+    sys.stdout.write(('Thinking about ocean conditions. ' * (padding // 33 + 1))[:padding] + '\n')
+    if mode == 'prose':
+        sys.stdout.write('The site looks promising overall.\n')
+    elif mode == 'malformed':
+        sys.stdout.write('```json\n{"score": 80, "metrics": {"temperature": 14.2,\n```\n')
+    else:
+        sys.stdout.write('```json\n' + json.dumps(answer_for(prompt), indent=2) + '\n```\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,178 @@
+"""
+Local stand-ins for the external services
+
+- install_stub_sphinx(): puts a `sphinx-cli` wrapper around
+  stub_sphinx_cli.py into a bin directory for PATH
+- StubServer: one HTTP server playing AlphaEarth and the Claude Messages API
+
+AlphaEarth stub API:
+    GET  /v1/embeddings?lat=..&lon=..          -> {"embeddings": [64 floats]}
+    POST /v1/embeddings/batch {"locations": [{"lat", "lon"}, ...]}
+                                               -> {"embeddings": [[...], ...]}
+Claude stub: POST /v1/messages (plain JSON, or SSE with "stream": true)
+"""
+
+import json
+import os
+import stat
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from alphaearth_service import generate_mock_embeddings_batch
+
+STUB_SPHINX = Path(__file__).resolve().parent / 'stub_sphinx_cli.py'
+
+CLAUDE_REPLY = (
+    "Based on the analysis, the top site offers stable temperatures and moderate "
+    "wave energy, which suits kelp farming. Consider a pilot deployment first."
+)
+
+
+def install_stub_sphinx(bin_dir):
+    """Write bin_dir/sphinx-cli running the stub with this interpreter; returns bin_dir"""
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    wrapper = bin_dir / 'sphinx-cli'
+    wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{STUB_SPHINX}" "$@"\n')
+    wrapper.chmod(wrapper.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return str(bin_dir)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/v1/embeddings':
+            return self._send_json({'error': 'not found'}, 404)
+        query = parse_qs(url.query)
+        try:
+            lat, lon = float(query['lat'][0]), float(query['lon'][0])
+        except (KeyError, ValueError):
+            return self._send_json({'error': 'lat and lon required'}, 400)
+        self._delay()
+        self.server.count('embeddings')
+        vector = generate_mock_embeddings_batch([lat], [lon])[0]
+        self._send_json({'embeddings': vector.tolist()})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        data = self._read_json()
+        if path == '/v1/embeddings/batch':
+            locations = data.get('locations', [])
+            self._delay()
+            self.server.count('embeddings_batch')
+            vectors = generate_mock_embeddings_batch(
+                [loc['lat'] for loc in locations], [loc['lon'] for loc in locations]
+            )
+            return self._send_json({'embeddings': vectors.tolist()})
+        if path == '/v1/messages':
+            self._delay()
+            self.server.count('messages')
+            if data.get('stream'):
+                return self._stream_message(data)
+            return self._send_json(self._message(data))
+        self._send_json({'error': 'not found'}, 404)
+
+    def _message(self, data):
+        return {
+            'id': f'msg_{uuid.uuid4().hex[:24]}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': data.get('model', 'stub'),
+            'content': [{'type': 'text', 'text': CLAUDE_REPLY}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': 500, 'output_tokens': 40,
+                      'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 400}
+        }
+
+    def _stream_message(self, data):
+        message = self._message(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def event(name, payload):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps({'type': name, **payload})}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        start = {**message, 'content': [], 'stop_reason': None,
+                 'usage': {**message['usage'], 'output_tokens': 1}}
+        event('message_start', {'message': start})
+        event('content_block_start', {'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for word in CLAUDE_REPLY.split(' '):
+            event('content_block_delta', {'index': 0, 'delta': {'type': 'text_delta', 'text': word + ' '}})
+        event('content_block_stop', {'index': 0})
+        event('message_delta', {'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                'usage': {'output_tokens': message['usage']['output_tokens']}})
+        event('message_stop', {})
+        self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    AlphaEarth + Claude stub on a background thread
+
+    Args:
+        port: 0 picks a free port
+        latency: Seconds added to every answer
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0):
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name='stub-server')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('STUB_PORT', 5055))
+    server = StubServer(port, latency=float(os.environ.get('STUB_LATENCY', 0)))
+    print(f"🧪 Stub AlphaEarth/Claude server on {server.url}")
+    server.serve_forever()
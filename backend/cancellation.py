@@ -0,0 +1,206 @@
+"""
+Request deadlines, client-disconnect detection and superseded requests
+
+A Sphinx run can take minutes, and nothing stopped it when nobody was left
+to read the answer. Three things now end it early:
+
+- Deadlines: the client sends X-Request-Timeout-Ms (or "timeoutMs" in the
+  body), capped by the server; it rides on the request's CancelToken and
+  bounds every blocking wait below it.
+- Disconnects: DisconnectMonitor watches the client sockets of in-flight
+  requests and cancels the token when the peer hangs up, which kills the
+  sphinx-cli process group straight away.
+- Supersession: requests carrying a session id (X-Session-Id or
+  "sessionId") cancel the previous still-running request of the same kind
+  from that session, e.g. a re-analysis after the user moved the pin.
+"""
+
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+SESSION_HEADER = 'X-Session-Id'
+
+
+def requested_timeout(headers, data, cap):
+    """
+    Seconds the client allows for this request, at most `cap`
+
+    Missing or unparsable values fall back to the cap; a cap of None or 0
+    means no server limit.
+    """
+    value = headers.get(DEADLINE_HEADER)
+    if value is None and isinstance(data, dict):
+        value = data.get('timeoutMs')
+    try:
+        timeout = float(value) / 1000 if value is not None else None
+    except (TypeError, ValueError):
+        timeout = None
+    if timeout is not None and timeout <= 0:
+        timeout = None
+    if not cap:
+        return timeout
+    return cap if timeout is None else min(timeout, cap)
+
+
+def requested_deadline(headers, data, cap):
+    """time.monotonic() deadline for this request, or None"""
+    timeout = requested_timeout(headers, data, cap)
+    return time.monotonic() + timeout if timeout is not None else None
+
+
+def requested_session(headers, data):
+    """Client session id, or None"""
+    session = headers.get(SESSION_HEADER)
+    if not session and isinstance(data, dict):
+        session = data.get('sessionId')
+    return str(session) if session else None
+
+
+def cancelled_payload(reason):
+    """Error body for a request stopped early; reason None means its deadline passed"""
+    if reason is None or reason == 'deadline':
+        return {'success': False, 'error': 'Deadline exceeded', 'reason': 'deadline'}
+    return {'success': False, 'error': f'Request cancelled ({reason})', 'reason': reason}
+
+
+def cancelled_status(reason):
+    """HTTP status for cancelled_payload(reason): 504, 409 or 499 (client gone)"""
+    if reason is None or reason == 'deadline':
+        return 504
+    return 409 if reason == 'superseded' else 499
+
+
+class SupersedeRegistry:
+    """
+    Latest in-flight request per (session, kind)
+
+    Works with anything that has cancel(reason): a jobs.CancelToken, or an
+    asyncio.Task (whose cancel takes a message).
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.superseded = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, session, kind, handle):
+        """Make `handle` the current request; cancels the one it replaces"""
+        if not session:
+            return None
+        key = (session, kind)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            self._entries[key] = handle
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if previous is not None and previous is not handle:
+            self.superseded += 1
+            print(f"⏭️  Superseding previous {kind} request from session {session[:12]}")
+            previous.cancel('superseded')
+        return previous
+
+    def end(self, session, kind, handle):
+        """Forget `handle` if it is still the current request"""
+        if not session:
+            return
+        with self._lock:
+            if self._entries.get((session, kind)) is handle:
+                del self._entries[(session, kind)]
+
+    def describe(self):
+        with self._lock:
+            active = len(self._entries)
+        return {'active': active, 'superseded': self.superseded}
+
+
+def client_socket(environ):
+    """
+    The raw client socket of a WSGI request, or None if the server hides it
+
+    Werkzeug's dev server and gunicorn's sync workers expose it; TLS sockets
+    are skipped because they cannot be peeked at.
+    """
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    return sock if type(sock) is socket.socket else None
+
+
+class DisconnectMonitor:
+    """
+    Cancels tokens whose client went away
+
+    One background thread polls the watched sockets. A readable socket is
+    peeked at: end-of-file (or an error) means the client closed the
+    connection; pending bytes mean a pipelined request, after which the
+    socket can no longer tell us anything and is dropped from the watch.
+    """
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.disconnects = 0
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+
+    def watch(self, sock, token):
+        """Cancel `token` with reason 'disconnected' if `sock`'s peer hangs up"""
+        with self._lock:
+            self._watched[id(sock)] = (sock, token)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='disconnect-monitor', daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def unwatch(self, sock):
+        with self._lock:
+            self._watched.pop(id(sock), None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._watched:
+                    self._wakeup.wait()
+                watched = list(self._watched.items())
+
+            selector = selectors.DefaultSelector()
+            try:
+                for key, (sock, _) in watched:
+                    try:
+                        selector.register(sock, selectors.EVENT_READ, key)
+                    except (ValueError, OSError):
+                        self._hung_up(key)  # already closed
+                ready = selector.select(self.interval)
+            finally:
+                selector.close()
+
+            for selected, _ in ready:
+                key = selected.data
+                sock = selected.fileobj
+                try:
+                    pending = sock.recv(1, socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0))
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    pending = b''
+                if pending:
+                    self.unwatch(sock)
+                else:
+                    self._hung_up(key)
+
+    def _hung_up(self, key):
+        with self._lock:
+            entry = self._watched.pop(key, None)
+        if entry is not None and not entry[1].cancelled:
+            self.disconnects += 1
+            print("🔌 Client disconnected, cancelling its request")
+            entry[1].cancel('disconnected')
+
+    def describe(self):
+        with self._lock:
+            watched = len(self._watched)
+        return {'watched': watched, 'disconnects': self.disconnects}
@@ -0,0 +1,186 @@
+"""
+Token-budgeted conversation context for /api/chat
+
+Recent turns are sent verbatim up to a token budget. Older turns are
+replaced by a rolling summary that is cached by the hash of the turns it
+covers, and extended incrementally (previous summary + newly dropped turns)
+so each summary call only sees a few messages. Extractive fallback summaries
+are used for the current request but not cached, so the model is asked again
+on the next turn. The window moves in
+fixed-size chunks so the summary, and with it the prompt-cache prefix, stays
+stable for several turns. Analysis results are serialized compactly with
+only the fields the assistant uses.
+"""
+
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+
+# Site fields worth showing the assistant
+ANALYSIS_FIELDS = ('rank', 'name', 'lat', 'lon', 'score', 'metrics', 'analysis')
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and an ocean-carbon site "
+    "selection assistant for use as context in later turns. Keep site names, "
+    "numbers, decisions and open questions. Be brief: at most 150 words."
+)
+
+# Per-message framing overhead in the token estimate
+_MESSAGE_OVERHEAD = 4
+
+# Tokens set aside for the summary when older turns are dropped
+SUMMARY_RESERVE_TOKENS = 300
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~3.5 characters per token for English/JSON)"""
+    return math.ceil(len(text) / 3.5) if text else 0
+
+
+def message_tokens(message):
+    content = message.get('content')
+    if not isinstance(content, str):
+        content = json.dumps(content, separators=(',', ':'))
+    return estimate_tokens(content) + _MESSAGE_OVERHEAD
+
+
+def compact_analysis_context(results, limit=3):
+    """Top analysis results as compact JSON (no indentation, only used fields)"""
+    if not results:
+        return None
+    trimmed = [
+        {field: site[field] for field in ANALYSIS_FIELDS if site.get(field) is not None}
+        for site in results[:limit]
+    ]
+    return 'Top ranked sites from recent analysis:\n' + json.dumps(trimmed, separators=(',', ':'))
+
+
+def _prefix_keys(messages):
+    """Cache keys of messages[:1], messages[:2], ... in one forward pass"""
+    h = hashlib.sha256()
+    keys = []
+    for message in messages:
+        h.update(message['role'].encode('utf-8'))
+        h.update(b'\x00')
+        h.update(str(message.get('content')).encode('utf-8'))
+        h.update(b'\x01')
+        keys.append(h.copy().hexdigest())
+    return keys
+
+
+class ExtractiveSummary(str):
+    """A summary built without the model; used once, never cached"""
+
+
+def extractive_summary(previous, messages, max_chars=900):
+    """Fallback summary without a model: first sentence of each turn"""
+    lines = [previous] if previous else []
+    for message in messages:
+        text = str(message.get('content', '')).strip().replace('\n', ' ')
+        first = text.split('. ')[0][:160]
+        lines.append(f"{message['role']}: {first}")
+    summary = '\n'.join(lines)
+    return ExtractiveSummary(summary[-max_chars:])
+
+
+class ConversationContext:
+    """
+    Fits a chat history into a token budget
+
+    Args:
+        budget_tokens: Budget for the verbatim turns plus the summary
+        summarizer: Callable(previous_summary, messages, timeout) -> str;
+                    timeout is the request's remaining seconds (or None).
+                    An ExtractiveSummary result is not cached.
+        chunk: Older turns are summarized in steps of this many messages
+        cache_size: Rolling summaries kept (LRU)
+    """
+
+    def __init__(self, budget_tokens=3000, summarizer=None, chunk=6, cache_size=512):
+        self.budget_tokens = int(budget_tokens)
+        self.summarizer = summarizer or (lambda previous, messages, timeout=None: extractive_summary(previous, messages))
+        self.chunk = max(2, int(chunk))
+        self.cache_size = cache_size
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.summary_calls = 0
+        self.summary_hits = 0
+
+    def _remember(self, key, summary):
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+
+    def _summary_for(self, messages, split, timeout=None):
+        """Rolling summary of messages[:split], reusing the longest cached prefix"""
+        keys = _prefix_keys(messages[:split])
+
+        # Longest cached prefix; extend it instead of re-reading everything
+        previous, start = None, 0
+        with self._lock:
+            for j in range(split, 0, -1):
+                cached = self._summaries.get(keys[j - 1])
+                if cached is not None:
+                    self._summaries.move_to_end(keys[j - 1])
+                    previous, start = cached, j
+                    break
+            if start == split:
+                self.summary_hits += 1
+                return previous
+
+        summary = self.summarizer(previous, messages[start:split], timeout)
+        with self._lock:
+            self.summary_calls += 1
+        if not isinstance(summary, ExtractiveSummary):
+            self._remember(keys[-1], summary)
+        return summary
+
+    def fit(self, messages, timeout=None):
+        """
+        Choose what to send
+
+        timeout bounds the summarizer call, if one is needed.
+
+        Returns:
+            (summary or None, verbatim messages, info dict)
+        """
+        messages = [m for m in messages if m.get('role') in ('user', 'assistant')]
+        total = sum(message_tokens(m) for m in messages)
+        if total <= self.budget_tokens or len(messages) <= 1:
+            return None, messages, {'summarized': 0, 'verbatim': len(messages), 'estimated_tokens': total}
+
+        # Reserve room for the summary, then keep as many recent turns as fit
+        remaining = self.budget_tokens - SUMMARY_RESERVE_TOKENS
+        keep = 0
+        for message in reversed(messages):
+            cost = message_tokens(message)
+            if keep and cost > remaining:
+                break
+            remaining -= cost
+            keep += 1
+
+        # Move the boundary in whole chunks, and start the verbatim part on a user turn
+        split = len(messages) - keep
+        split = min(len(messages) - 1, math.ceil(split / self.chunk) * self.chunk)
+        while split < len(messages) - 1 and messages[split]['role'] != 'user':
+            split += 1
+        if split <= 0:
+            return None, messages, {'summarized': 0, 'verbatim': len(messages), 'estimated_tokens': total}
+
+        summary = self._summary_for(messages, split, timeout)
+        verbatim = messages[split:]
+        used = estimate_tokens(summary) + sum(message_tokens(m) for m in verbatim)
+        return summary, verbatim, {'summarized': split, 'verbatim': len(verbatim), 'estimated_tokens': used}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget_tokens': self.budget_tokens,
+                'cached_summaries': len(self._summaries),
+                'summary_calls': self.summary_calls,
+                'summary_hits': self.summary_hits,
+            }
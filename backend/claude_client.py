@@ -0,0 +1,178 @@
+"""
+Process-wide Claude client for the chat endpoint
+
+One anthropic.Anthropic client is created lazily and shared by every
+request, so its HTTP connection pool (and TLS sessions) are reused instead
+of being rebuilt per message. System prompts are sent as content blocks with
+cache_control breakpoints, so the large static instructions and the analysis
+results context are served from the prompt cache on follow-up turns.
+
+The async server uses the AsyncAnthropic counterparts (acomplete/astream),
+pooled the same way.
+
+Set CLAUDE_BASE_URL to point the client at a local stub server.
+"""
+
+import os
+import threading
+
+CLAUDE_MODEL = os.environ.get('CLAUDE_MODEL', 'claude-sonnet-4-20250514')
+
+# Model used to summarize older chat turns (a cheaper one works fine)
+CLAUDE_SUMMARY_MODEL = os.environ.get('CLAUDE_SUMMARY_MODEL', CLAUDE_MODEL)
+
+
+def system_blocks(static_prompt, cached_context=None, dynamic_context=None, summary=None):
+    """
+    System prompt as content blocks, most stable first
+
+    The static instructions, the (per-analysis) context and the summary of
+    older turns each end with a cache breakpoint; the small per-turn context
+    comes last, uncached.
+    """
+    blocks = [{
+        'type': 'text',
+        'text': static_prompt,
+        'cache_control': {'type': 'ephemeral'}
+    }]
+    if cached_context:
+        blocks.append({
+            'type': 'text',
+            'text': cached_context,
+            'cache_control': {'type': 'ephemeral'}
+        })
+    if summary:
+        blocks.append({
+            'type': 'text',
+            'text': f"Summary of the earlier conversation:\n{summary}",
+            'cache_control': {'type': 'ephemeral'}
+        })
+    if dynamic_context:
+        blocks.append({'type': 'text', 'text': dynamic_context})
+    return blocks
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return {}
+    fields = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+    return {name: getattr(usage, name, None) for name in fields if getattr(usage, name, None) is not None}
+
+
+class ClaudeChat:
+    """
+    Shared, lazily-created Claude client
+
+    Raises ImportError from the first call if the anthropic package is missing.
+    """
+
+    def __init__(self, api_key, base_url=None, model=CLAUDE_MODEL, max_connections=20, timeout=60.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _options(self, anthropic, async_client=False):
+        options = {'api_key': self.api_key, 'timeout': self.timeout, 'max_retries': 2}
+        if self.base_url:
+            options['base_url'] = self.base_url
+        try:
+            import httpx
+
+            http_client = anthropic.DefaultAsyncHttpxClient if async_client else anthropic.DefaultHttpxClient
+            options['http_client'] = http_client(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        except (ImportError, AttributeError):
+            pass  # older SDK: its default pooled client is used
+        return options
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import anthropic
+
+                    self._client = anthropic.Anthropic(**self._options(anthropic))
+        return self._client
+
+    def async_client(self):
+        """AsyncAnthropic client; create and use it from one event loop"""
+        if self._async_client is None:
+            import anthropic
+
+            self._async_client = anthropic.AsyncAnthropic(**self._options(anthropic, async_client=True))
+        return self._async_client
+
+    def _bounded(self, client, timeout):
+        """client limited to `timeout` seconds overall (no retries past a deadline)"""
+        if timeout is None:
+            return client
+        return client.with_options(timeout=max(timeout, 0.001), max_retries=0)
+
+    def complete(self, system, messages, max_tokens=1000, model=None, timeout=None):
+        """
+        Whole completion in one call
+
+        timeout (seconds) is the caller's remaining deadline, if it has one.
+
+        Returns:
+            (text, usage dict)
+        """
+        response = self._bounded(self.client(), timeout).messages.create(
+            model=model or self.model,
+            max_tokens=max_tokens,
+            system=system,
+            messages=messages
+        )
+        text = ''.join(block.text for block in response.content if getattr(block, 'type', 'text') == 'text')
+        return text, _usage_dict(response.usage)
+
+    def stream(self, system, messages, max_tokens=1000, timeout=None):
+        """
+        Token stream
+
+        Yields text deltas as they arrive, then a final dict with usage.
+        Closing the generator early closes the HTTP stream.
+        """
+        with self._bounded(self.client(), timeout).messages.stream(
+            model=self.model,
+            max_tokens=max_tokens,
+            system=system,
+            messages=messages
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+            final = stream.get_final_message()
+        yield {'usage': _usage_dict(final.usage)}
+
+    async def acomplete(self, system, messages, max_tokens=1000, model=None, timeout=None):
+        """Async complete(); returns (text, usage dict)"""
+        response = await self._bounded(self.async_client(), timeout).messages.create(
+            model=model or self.model,
+            max_tokens=max_tokens,
+            system=system,
+            messages=messages
+        )
+        text = ''.join(block.text for block in response.content if getattr(block, 'type', 'text') == 'text')
+        return text, _usage_dict(response.usage)
+
+    async def astream(self, system, messages, max_tokens=1000, timeout=None):
+        """Async stream(): text deltas, then a final dict with usage"""
+        async with self._bounded(self.async_client(), timeout).messages.stream(
+            model=self.model,
+            max_tokens=max_tokens,
+            system=system,
+            messages=messages
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            final = await stream.get_final_message()
+        yield {'usage': _usage_dict(final.usage)}
@@ -0,0 +1,288 @@
+"""
+Tiered cache for AlphaEarth embeddings
+
+Tier 1 is a bounded in-process LRU. Tier 2 is a fixed-capacity open-addressing
+hash table stored in two memory-mapped .npy files (keys + vectors) that every
+worker process maps, so one worker's fetch is a disk hit for all the others.
+Entries evicted from the LRU stay on disk and are promoted back on next use.
+"""
+
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from alphaearth_service import EMBEDDING_DIM
+from singleflight import SingleFlight
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# Key row layout in keys.npy: quantized lat, quantized lon, date key, valid flag
+_KEY_COLUMNS = 4
+_MAX_PROBES = 16
+
+
+def date_key(date):
+    """Map an optional date ('YYYY-MM-DD' or similar) to a stable int64"""
+    if not date:
+        return 0
+    text = str(date)
+    digits = text.replace('-', '')
+    if digits.isdigit():
+        return int(digits)
+    return zlib.crc32(text.encode('utf-8'))
+
+
+class _FileLock:
+    """Cross-process lock on a sidecar file (shared for reads, exclusive for writes)"""
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._thread_lock = threading.Lock()
+
+    def acquire(self, exclusive):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+class DiskEmbeddingStore:
+    """
+    Persistent memory-mapped embedding table shared across processes
+
+    Slots are addressed by hashing the quantized key with linear probing.
+    When every probe slot is taken the home slot is overwritten, which keeps
+    the files at a fixed size.
+    """
+
+    def __init__(self, directory, capacity=65536):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.capacity = int(capacity)
+        self._lock = _FileLock(self.directory / 'store.lock')
+
+        self._lock.acquire(exclusive=True)
+        try:
+            self.keys = self._open('keys.npy', (self.capacity, _KEY_COLUMNS), np.int64)
+            self.vectors = self._open('vectors.npy', (self.capacity, EMBEDDING_DIM), np.float32)
+        finally:
+            self._lock.release()
+
+    def _open(self, name, shape, dtype):
+        path = self.directory / name
+        if path.exists():
+            array = np.load(path, mmap_mode='r+')
+            if array.shape == shape and array.dtype == dtype:
+                return array
+            print(f"⚠️ Embedding cache file {path} has an unexpected layout, recreating")
+        # Build the file aside and rename it in so other processes never map a partial file
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+        array.flush()
+        del array
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r+')
+
+    def _slots(self, key):
+        qlat, qlon, dkey = key
+        home = ((qlat * 73856093) ^ (qlon * 19349663) ^ (dkey * 83492791)) % self.capacity
+        return [(home + i) % self.capacity for i in range(min(_MAX_PROBES, self.capacity))]
+
+    def get(self, key):
+        """Return a copy of the stored vector for key, or None"""
+        self._lock.acquire(exclusive=False)
+        try:
+            for slot in self._slots(key):
+                row = self.keys[slot]
+                if row[3] == 0:
+                    return None
+                if row[0] == key[0] and row[1] == key[1] and row[2] == key[2]:
+                    return np.array(self.vectors[slot])
+            return None
+        finally:
+            self._lock.release()
+
+    def put(self, key, vector):
+        """Store vector under key, overwriting the home slot if the probe run is full"""
+        self._lock.acquire(exclusive=True)
+        try:
+            slots = self._slots(key)
+            target = slots[0]
+            for slot in slots:
+                row = self.keys[slot]
+                if row[3] == 0 or (row[0] == key[0] and row[1] == key[1] and row[2] == key[2]):
+                    target = slot
+                    break
+            # Invalidate, write the vector, then publish the key
+            self.keys[target, 3] = 0
+            self.vectors[target] = vector
+            self.keys[target, :3] = key
+            self.keys[target, 3] = 1
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self.keys.flush()
+        self.vectors.flush()
+
+
+class EmbeddingCache:
+    """
+    Drop-in replacement for AlphaEarthService that caches its results
+
+    Lookups are keyed by lat/lon quantized to `precision` decimal places plus
+    the requested date. Misses are fetched at the quantized coordinates so a
+    cached value only ever depends on its key. Fallback stand-ins (the mock
+    answering while the API is down) are returned but never cached.
+    """
+
+    def __init__(self, service, maxsize=4096, disk_dir=None, disk_capacity=65536, precision=4):
+        self.service = service
+        self.maxsize = int(maxsize)
+        self.scale = 10 ** int(precision)
+        self.disk = DiskEmbeddingStore(disk_dir, disk_capacity) if disk_dir else None
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.lru_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self._flights = SingleFlight('embeddings')
+
+    def _key(self, lat, lon, date):
+        return (
+            int(round(float(lat) * self.scale)),
+            int(round(float(lon) * self.scale)),
+            date_key(date),
+        )
+
+    def _lru_get(self, key):
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.lru_hits += 1
+            return vector
+
+    def _lru_put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+        return vector
+
+    def _lookup(self, key):
+        """Check LRU then disk; returns the vector or None"""
+        vector = self._lru_get(key)
+        if vector is not None:
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                return self._lru_put(key, vector)
+        return None
+
+    def _store(self, key, vector):
+        vector = self._lru_put(key, vector)
+        if self.disk is not None:
+            self.disk.put(key, vector)
+        return vector
+
+    def get_embeddings(self, lat, lon, date=None):
+        """Cached equivalent of AlphaEarthService.get_embeddings (read-only float32 array)"""
+        key = self._key(lat, lon, date)
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector
+
+        # Concurrent misses for the same key share one upstream fetch
+        vector, shared = self._flights.do(key, lambda: self._fetch(key, date))
+        if shared:
+            with self._lock:
+                self.coalesced += 1
+        return vector
+
+    def _fetch(self, key, date):
+        # Another thread may have filled the key between our lookup and taking the flight
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector
+        with self._lock:
+            self.misses += 1
+        vector, stand_in = self.service.fetch(key[0] / self.scale, key[1] / self.scale, date)
+        if stand_in:
+            with self._lock:
+                self.fallbacks += 1
+            return np.asarray(vector, dtype=np.float32)
+        return self._store(key, vector)
+
+    def batch_get_embeddings(self, locations, date=None):
+        """Cached equivalent of batch_get_embeddings; misses are fetched in one batch"""
+        keys = [self._key(lat, lon, date) for lat, lon in locations]
+        result = np.empty((len(keys), EMBEDDING_DIM), dtype=np.float32)
+
+        missing = {}
+        for i, key in enumerate(keys):
+            vector = self._lookup(key)
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                result[i] = vector
+
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            miss_keys = list(missing)
+            fetched, stand_ins = self.service.batch_fetch(
+                [(k[0] / self.scale, k[1] / self.scale) for k in miss_keys], date
+            )
+            if stand_ins.any():
+                with self._lock:
+                    self.fallbacks += int(stand_ins.sum())
+            for key, vector, stand_in in zip(miss_keys, fetched, stand_ins):
+                if not stand_in:
+                    vector = self._store(key, vector)
+                result[missing[key]] = vector
+
+        return result
+
+    def stats(self):
+        """Hit/miss counters for /health and monitoring"""
+        with self._lock:
+            lookups = self.lru_hits + self.disk_hits + self.misses
+            return {
+                'lru_hits': self.lru_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'coalesced': self.coalesced,
+                'fallbacks': self.fallbacks,
+                'lru_size': len(self._lru),
+                'lru_maxsize': self.maxsize,
+                'hit_rate': (self.lru_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'disk_enabled': self.disk is not None,
+            }
+
+    def __getattr__(self, name):
+        # Anything not cached (api_key, base_url, ...) goes straight to the service
+        return getattr(self.service, name)
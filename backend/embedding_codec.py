@@ -0,0 +1,166 @@
+"""
+Compact wire formats for embeddings
+
+Embeddings normally travel as JSON lists of floats. Clients can instead ask
+for (with ?encoding=, "encoding" in the body, or Accept:
+application/octet-stream) and send:
+
+    json        list of floats (default)
+    f32         raw little-endian float32 body; shape in X-Embedding-Shape
+    f32-base64  JSON object {"dtype": "float32", "shape": [...], "data": base64}
+    i8          raw body: one float32 scale per vector, then int8 values
+    i8-base64   JSON object {"dtype": "int8", "shape", "scale": [...], "data"}
+
+int8 vectors are quantized per vector: value ~= q * scale, q in [-127, 127].
+Encoded objects are decoded with np.frombuffer straight over the decoded
+bytes (float32 needs no copy at all).
+"""
+
+import base64
+
+import numpy as np
+
+ENCODINGS = ('json', 'f32', 'f32-base64', 'i8', 'i8-base64')
+BINARY_ENCODINGS = ('f32', 'i8')
+OCTET_STREAM = 'application/octet-stream'
+
+_DTYPES = {'float32': np.dtype('<f4'), 'int8': np.dtype('i1')}
+
+
+class EmbeddingDecodeError(ValueError):
+    """An encoded embedding payload is malformed"""
+
+
+def negotiate_encoding(args, body=None, accept=''):
+    """
+    Encoding requested by a client
+
+    Explicit ?encoding= or body "encoding" wins; an Accept header asking for
+    octet-stream selects f32. Unknown names fall back to json.
+    """
+    encoding = args.get('encoding') or (body or {}).get('encoding')
+    if not encoding and OCTET_STREAM in (accept or ''):
+        encoding = 'f32'
+    return encoding if encoding in ENCODINGS else 'json'
+
+
+def quantize_int8(matrix):
+    """
+    Per-vector symmetric int8 quantization
+
+    Returns:
+        (int8 array, float32 scale per vector)
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    rows = matrix.reshape(-1, matrix.shape[-1])
+    scale = np.abs(rows).max(axis=1) / 127
+    scale[scale == 0] = 1.0
+    quantized = np.clip(np.rint(rows / scale[:, None]), -127, 127).astype(np.int8)
+    return quantized.reshape(matrix.shape), scale.astype(np.float32)
+
+
+def dequantize_int8(quantized, scale):
+    quantized = np.asarray(quantized, dtype=np.int8)
+    rows = quantized.reshape(-1, quantized.shape[-1]).astype(np.float32)
+    rows *= np.asarray(scale, dtype=np.float32).reshape(-1, 1)
+    return rows.reshape(quantized.shape)
+
+
+def encode_json(matrix, encoding='json'):
+    """Embedding(s) as a JSON-ready value in the given (non-binary) encoding"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if encoding == 'f32-base64':
+        return {
+            'dtype': 'float32',
+            'shape': list(matrix.shape),
+            'data': base64.b64encode(matrix.astype('<f4', copy=False).tobytes()).decode('ascii')
+        }
+    if encoding == 'i8-base64':
+        quantized, scale = quantize_int8(matrix)
+        return {
+            'dtype': 'int8',
+            'shape': list(matrix.shape),
+            'scale': [float(s) for s in scale],
+            'data': base64.b64encode(quantized.tobytes()).decode('ascii')
+        }
+    return matrix.tolist()
+
+
+def encode_binary(matrix, encoding='f32'):
+    """
+    Embedding(s) as a raw body
+
+    Returns:
+        (bytes, headers dict)
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    headers = {'X-Embedding-Shape': ','.join(str(n) for n in matrix.shape)}
+    if encoding == 'i8':
+        quantized, scale = quantize_int8(matrix)
+        headers['X-Embedding-Dtype'] = 'int8'
+        return scale.astype('<f4').tobytes() + quantized.tobytes(), headers
+    headers['X-Embedding-Dtype'] = 'float32'
+    return matrix.astype('<f4', copy=False).tobytes(), headers
+
+
+def is_encoded(value):
+    return isinstance(value, dict) and 'data' in value and 'dtype' in value
+
+
+def decode_embeddings(value):
+    """
+    Embedding(s) from a list or an encoded object
+
+    Lists are returned unchanged; encoded objects become float32 arrays.
+    Raises EmbeddingDecodeError on malformed payloads.
+    """
+    if not is_encoded(value):
+        return value
+    dtype = _DTYPES.get(value['dtype'])
+    if dtype is None:
+        raise EmbeddingDecodeError(f"Unsupported embedding dtype {value['dtype']!r}")
+    try:
+        raw = base64.b64decode(value['data'], validate=True)
+        array = np.frombuffer(raw, dtype=dtype)
+        shape = tuple(int(n) for n in value.get('shape') or array.shape)
+        array = array.reshape(shape)
+    except (ValueError, TypeError) as e:
+        raise EmbeddingDecodeError(f'Malformed embedding payload: {e}') from e
+
+    if dtype == _DTYPES['int8']:
+        scale = np.asarray(value.get('scale', []), dtype=np.float32)
+        rows = int(np.prod(shape[:-1])) if len(shape) > 1 else 1
+        if scale.size != rows:
+            raise EmbeddingDecodeError('int8 embeddings need one scale per vector')
+        return dequantize_int8(array, scale)
+    return array
+
+
+def decode_request_embeddings(data):
+    """
+    Decode encoded embeddings in an analysis request body, in place
+
+    Handles "embeddings" (one vector), each site's "embeddings", and
+    "siteEmbeddings": one (N, 64) matrix whose row i belongs to sites[i].
+    """
+    if not isinstance(data, dict):
+        return data
+    if 'embeddings' in data:
+        data['embeddings'] = decode_embeddings(data['embeddings'])
+    sites = data.get('sites')
+    if isinstance(sites, list):
+        if data.get('siteEmbeddings') is not None:
+            matrix = np.asarray(decode_embeddings(data.pop('siteEmbeddings')), dtype=np.float32)
+            if matrix.ndim != 2 or len(matrix) != len(sites):
+                raise EmbeddingDecodeError('siteEmbeddings must have one row per site')
+            data['sites'] = sites = [{**site, 'embeddings': matrix[i]} for i, site in enumerate(sites)]
+        for site in sites:
+            if isinstance(site, dict) and 'embeddings' in site:
+                site['embeddings'] = decode_embeddings(site['embeddings'])
+    return data
+
+
+def embedding_preview(embedding, count, decimals=4):
+    """First `count` values as rounded floats (for prompts)"""
+    return [round(float(x), decimals) for x in list(embedding)[:count]]
+
@@ -0,0 +1,501 @@
+"""
+Columnar store of real AlphaEarth embedding exports
+
+Large CSV/NPZ/Parquet exports are ingested once, in chunks, into a directory
+holding:
+
+    embeddings.npy   (N, 64) float32, rows in Morton (Z-order) order
+    coords.npy       (N, 2) float64 lat/lon, same order
+    codes.npy        (N,) uint64 Morton codes, sorted
+    meta.json        source, row count, cell level, max lookup distance
+
+All three arrays are memory-mapped read-only on load, so startup never
+re-parses the source and the dataset is not held in RAM. A nearest-point
+lookup bins the query into a cell of the store's cell level, whose points
+(and those of the 8 neighbouring cells) are contiguous runs of the sorted
+codes: 9 binary searches, then a distance check over a handful of rows.
+Points with no stored neighbour within max_distance degrees are reported
+as not covered.
+
+Ingest with:
+    python embedding_store.py ingest exports/pacific.parquet --name pacific
+    python embedding_store.py ingest exports/grid.csv --max-distance 0.05
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from alphaearth_service import EMBEDDING_DIM
+
+# Rows parsed and written per ingestion step
+CHUNK_ROWS = 65536
+
+# Quantization bits per axis in the Morton code (two axes -> 64-bit codes)
+_AXIS_BITS = 32
+_MAX_CELL_LEVEL = 24
+
+_LAT_COLUMNS = ('lat', 'latitude')
+_LON_COLUMNS = ('lon', 'lng', 'long', 'longitude')
+_ID_COLUMNS = ('id', 'name', 'date', 'time', 'timestamp')
+
+_MORTON_MASKS = (
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+)
+
+
+def _spread_bits(values):
+    """Spread the low 32 bits of each value over the even bits of a uint64"""
+    x = np.asarray(values, dtype=np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in _MORTON_MASKS:
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+
+def _quantize(lats, lons, bits):
+    """Integer grid coordinates of points at `bits` bits per axis"""
+    scale = float(1 << bits)
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -90.0, 90.0)
+    lons = np.clip(np.asarray(lons, dtype=np.float64), -180.0, 180.0)
+    rows = np.minimum(np.floor((lats + 90.0) / 180.0 * scale), scale - 1).astype(np.uint64)
+    cols = np.minimum(np.floor((lons + 180.0) / 360.0 * scale), scale - 1).astype(np.uint64)
+    return rows, cols
+
+
+def morton_codes(lats, lons):
+    """64-bit Z-order codes: latitude bits interleaved with longitude bits"""
+    rows, cols = _quantize(lats, lons, _AXIS_BITS)
+    return (_spread_bits(rows) << np.uint64(1)) | _spread_bits(cols)
+
+
+def cell_level_for(max_distance):
+    """Deepest cell level whose cells are at least max_distance degrees tall"""
+    level = int(np.floor(np.log2(180.0 / max(float(max_distance), 1e-9))))
+    return int(np.clip(level, 1, _MAX_CELL_LEVEL))
+
+
+# ----------------------------------------------------------------------------
+# Source readers: each yields (lats, lons, (n, 64) float32) chunks
+# ----------------------------------------------------------------------------
+
+def _split_columns(names):
+    lower = [name.strip().lower() for name in names]
+    lat = next((i for i, name in enumerate(lower) if name in _LAT_COLUMNS), None)
+    lon = next((i for i, name in enumerate(lower) if name in _LON_COLUMNS), None)
+    if lat is None or lon is None:
+        raise ValueError(f'No lat/lon columns among {list(names)}')
+    embedding = [i for i, name in enumerate(lower) if i not in (lat, lon) and name not in _ID_COLUMNS]
+    if len(embedding) != EMBEDDING_DIM:
+        raise ValueError(f'Expected {EMBEDDING_DIM} embedding columns, found {len(embedding)}')
+    return lat, lon, embedding
+
+
+def read_csv_chunks(path, chunk_rows=CHUNK_ROWS):
+    """CSV with a header: lat, lon and 64 embedding columns (id-like columns are ignored)"""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        lat, lon, embedding = _split_columns(next(reader))
+        columns = [lat, lon] + embedding
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            rows.append([row[i] for i in columns])
+            if len(rows) == chunk_rows:
+                block = np.asarray(rows, dtype=np.float64)
+                yield block[:, 0], block[:, 1], block[:, 2:].astype(np.float32)
+                rows = []
+        if rows:
+            block = np.asarray(rows, dtype=np.float64)
+            yield block[:, 0], block[:, 1], block[:, 2:].astype(np.float32)
+
+
+def _npz_member(archive, names):
+    available = {Path(name).stem: name for name in archive.namelist()}
+    for name in names:
+        if name in available:
+            return available[name]
+    return None
+
+
+def _npy_chunks(archive, member, chunk_rows):
+    """Stream rows of one .npy member of a zip archive without loading it whole"""
+    with archive.open(member) as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        if fortran_order:
+            raise ValueError(f'{member}: Fortran-ordered arrays are not supported')
+        row_shape = shape[1:]
+        row_bytes = dtype.itemsize * int(np.prod(row_shape, dtype=np.int64))
+        for start in range(0, shape[0], chunk_rows):
+            count = min(chunk_rows, shape[0] - start)
+            buffer = f.read(count * row_bytes)
+            yield np.frombuffer(buffer, dtype=dtype).reshape((count,) + row_shape)
+
+
+def read_npz_chunks(path, chunk_rows=CHUNK_ROWS):
+    """NPZ with 'embeddings' (N, 64) and 'lats'/'lons' (or 'coords' (N, 2))"""
+    with zipfile.ZipFile(path) as archive:
+        embeddings = _npz_member(archive, ('embeddings', 'embedding', 'vectors'))
+        coords = _npz_member(archive, ('coords', 'coordinates', 'latlon'))
+        lats = _npz_member(archive, ('lats', 'lat', 'latitude'))
+        lons = _npz_member(archive, ('lons', 'lon', 'longitude'))
+        if embeddings is None or (coords is None and (lats is None or lons is None)):
+            raise ValueError("NPZ needs 'embeddings' and 'lats'/'lons' (or 'coords')")
+
+        vectors = _npy_chunks(archive, embeddings, chunk_rows)
+        if coords is not None:
+            for block, chunk in zip(_npy_chunks(archive, coords, chunk_rows), vectors):
+                yield block[:, 0].astype(np.float64), block[:, 1].astype(np.float64), chunk.astype(np.float32)
+        else:
+            for lat_chunk, lon_chunk, chunk in zip(
+                _npy_chunks(archive, lats, chunk_rows), _npy_chunks(archive, lons, chunk_rows), vectors
+            ):
+                yield lat_chunk.astype(np.float64), lon_chunk.astype(np.float64), chunk.astype(np.float32)
+
+
+def read_parquet_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Parquet with lat, lon and 64 embedding columns, or one list column of 64 floats"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError('Parquet ingestion needs pyarrow: pip install pyarrow') from e
+
+    source = pq.ParquetFile(path)
+    names = source.schema_arrow.names
+    lower = [name.lower() for name in names]
+    list_column = next(
+        (name for name, low in zip(names, lower) if low in ('embedding', 'embeddings', 'vector')), None
+    )
+    if list_column is not None:
+        lat = names[next(i for i, name in enumerate(lower) if name in _LAT_COLUMNS)]
+        lon = names[next(i for i, name in enumerate(lower) if name in _LON_COLUMNS)]
+        for batch in source.iter_batches(batch_size=chunk_rows, columns=[lat, lon, list_column]):
+            values = batch.column(2).flatten().to_numpy(zero_copy_only=False)
+            yield (
+                batch.column(0).to_numpy(zero_copy_only=False).astype(np.float64),
+                batch.column(1).to_numpy(zero_copy_only=False).astype(np.float64),
+                values.astype(np.float32).reshape(-1, EMBEDDING_DIM)
+            )
+        return
+
+    lat, lon, embedding = _split_columns(names)
+    columns = [names[lat], names[lon]] + [names[i] for i in embedding]
+    for batch in source.iter_batches(batch_size=chunk_rows, columns=columns):
+        arrays = [batch.column(i).to_numpy(zero_copy_only=False) for i in range(batch.num_columns)]
+        yield (
+            arrays[0].astype(np.float64),
+            arrays[1].astype(np.float64),
+            np.column_stack(arrays[2:]).astype(np.float32)
+        )
+
+
+READERS = {
+    'csv': read_csv_chunks,
+    'npz': read_npz_chunks,
+    'parquet': read_parquet_chunks,
+}
+
+
+def detect_format(path):
+    suffix = Path(path).suffix.lower().lstrip('.')
+    if suffix in ('pq', 'parquet'):
+        return 'parquet'
+    if suffix in READERS:
+        return suffix
+    raise ValueError(f'Cannot tell the format of {path}; pass --format')
+
+
+# ----------------------------------------------------------------------------
+# Ingestion
+# ----------------------------------------------------------------------------
+
+def ingest(source, out_dir, name=None, fmt=None, chunk_rows=CHUNK_ROWS, max_distance=None):
+    """
+    Build a store from an export file
+
+    Chunks are appended to scratch files as they are parsed, then rows are
+    written out in Morton order; only the codes and the sort order (16 bytes
+    per row) are held in memory.
+
+    Args:
+        source: CSV, NPZ or Parquet file
+        out_dir: Directory that holds stores (the store is out_dir/<name>)
+        name: Store name (defaults to the source file stem)
+        fmt: 'csv', 'npz' or 'parquet' (defaults to the file suffix)
+        chunk_rows: Rows per parsing/writing step
+        max_distance: Lookup radius in degrees (defaults to twice the mean
+            point spacing)
+
+    Returns:
+        Path to the store directory
+    """
+    source = Path(source)
+    fmt = fmt or detect_format(source)
+    name = name or source.stem
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    store_dir = out_dir / name
+
+    print(f"📥 Ingesting {source} ({fmt}) into embedding store '{name}'")
+    scratch = Path(tempfile.mkdtemp(prefix=f'.{name}.', dir=out_dir))
+    try:
+        rows = 0
+        bounds = [np.inf, -np.inf, np.inf, -np.inf]
+        with open(scratch / 'vectors.f32', 'wb') as vectors, open(scratch / 'coords.f64', 'wb') as coords, \
+                open(scratch / 'codes.u64', 'wb') as codes:
+            for lats, lons, chunk in READERS[fmt](source, chunk_rows):
+                keep = np.isfinite(lats) & np.isfinite(lons) & np.isfinite(chunk).all(axis=1)
+                lats, lons, chunk = lats[keep], lons[keep], chunk[keep]
+                if not len(lats):
+                    continue
+                vectors.write(np.ascontiguousarray(chunk, dtype='<f4').tobytes())
+                coords.write(np.column_stack([lats, lons]).astype('<f8').tobytes())
+                codes.write(morton_codes(lats, lons).astype('<u8').tobytes())
+                bounds = [
+                    min(bounds[0], lats.min()), max(bounds[1], lats.max()),
+                    min(bounds[2], lons.min()), max(bounds[3], lons.max())
+                ]
+                rows += len(lats)
+                print(f"   {rows} rows")
+        if not rows:
+            raise ValueError(f'No usable rows in {source}')
+
+        codes = np.fromfile(scratch / 'codes.u64', dtype='<u8')
+        order = np.argsort(codes, kind='stable')
+        raw_vectors = np.memmap(scratch / 'vectors.f32', dtype='<f4', mode='r', shape=(rows, EMBEDDING_DIM))
+        raw_coords = np.memmap(scratch / 'coords.f64', dtype='<f8', mode='r', shape=(rows, 2))
+
+        build = scratch / 'store'
+        build.mkdir()
+        np.save(build / 'codes.npy', codes[order])
+        del codes
+        out_vectors = np.lib.format.open_memmap(
+            build / 'embeddings.npy', mode='w+', dtype=np.float32, shape=(rows, EMBEDDING_DIM)
+        )
+        out_coords = np.lib.format.open_memmap(build / 'coords.npy', mode='w+', dtype=np.float64, shape=(rows, 2))
+        for start in range(0, rows, chunk_rows):
+            indices = order[start:start + chunk_rows]
+            out_vectors[start:start + len(indices)] = raw_vectors[indices]
+            out_coords[start:start + len(indices)] = raw_coords[indices]
+        out_vectors.flush()
+        out_coords.flush()
+        del out_vectors, out_coords, raw_vectors, raw_coords
+
+        if max_distance is None:
+            # Mean spacing of points spread over their bounding box
+            area = max(bounds[1] - bounds[0], 1e-6) * max(bounds[3] - bounds[2], 1e-6)
+            max_distance = 2.0 * float(np.sqrt(area / rows))
+        meta = {
+            'name': name,
+            'source': str(source),
+            'format': fmt,
+            'rows': int(rows),
+            'bbox': [float(b) for b in bounds],
+            'cell_level': cell_level_for(max_distance),
+            'max_distance': float(max_distance),
+            'dtype': 'float32',
+        }
+        with open(build / 'meta.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        if store_dir.exists():
+            shutil.rmtree(store_dir)
+        os.replace(build, store_dir)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(f"✅ Embedding store written to {store_dir} ({rows} rows)")
+    return store_dir
+
+
+# ----------------------------------------------------------------------------
+# Lookup
+# ----------------------------------------------------------------------------
+
+class EmbeddingStore:
+    """Read-only memory-mapped store built by ingest()"""
+
+    def __init__(self, directory):
+        directory = Path(directory)
+        with open(directory / 'meta.json') as f:
+            meta = json.load(f)
+        self.name = meta['name']
+        self.meta = meta
+        self.cell_level = int(meta['cell_level'])
+        self.max_distance = float(meta['max_distance'])
+        self.codes = np.load(directory / 'codes.npy', mmap_mode='r')
+        self.coords = np.load(directory / 'coords.npy', mmap_mode='r')
+        self.embeddings = np.load(directory / 'embeddings.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def nearest(self, lats, lons):
+        """
+        Index of the nearest stored point within max_distance of each query
+
+        Returns:
+            (indices with -1 where nothing is close enough, distances in degrees)
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        count = len(lats)
+        indices = np.full(count, -1, dtype=np.int64)
+        distances = np.full(count, np.inf)
+        if not count or not len(self):
+            return indices, distances
+
+        # The query's cell and its 8 neighbours, as code ranges of the sorted array
+        level = self.cell_level
+        rows, cols = _quantize(lats, lons, level)
+        last = (1 << level) - 1
+        offsets = np.array([(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)], dtype=np.int64)
+        cell_rows = rows.astype(np.int64)[:, None] + offsets[:, 0]
+        cell_cols = cols.astype(np.int64)[:, None] + offsets[:, 1]
+        valid = (cell_rows >= 0) & (cell_rows <= last) & (cell_cols >= 0) & (cell_cols <= last)
+        cells = (_spread_bits(np.clip(cell_rows, 0, last)) << np.uint64(1)) | _spread_bits(np.clip(cell_cols, 0, last))
+        shift = np.uint64(2 * (_AXIS_BITS - level))
+        # Unsigned wrap-around makes the last cell's upper bound 2**64 - 1
+        low = np.searchsorted(self.codes, (cells << shift).ravel(), side='left')
+        high = np.searchsorted(self.codes, (((cells + np.uint64(1)) << shift) - np.uint64(1)).ravel(), side='right')
+        counts = np.where(valid.ravel(), high - low, 0)
+
+        total = int(counts.sum())
+        if not total:
+            return indices, distances
+        query = np.repeat(np.repeat(np.arange(count), len(offsets)), counts)
+        run_start = np.repeat(low - (np.cumsum(counts) - counts), counts)
+        candidates = run_start + np.arange(total)
+
+        points = self.coords[candidates]
+        candidate_distances = np.hypot(points[:, 0] - lats[query], points[:, 1] - lons[query])
+
+        # Candidates are grouped by query: take each group's minimum
+        per_query = np.bincount(query, minlength=count)
+        queried = np.flatnonzero(per_query)
+        starts = np.cumsum(per_query) - per_query
+        minimum = np.minimum.reduceat(candidate_distances, starts[queried])
+        is_min = candidate_distances == np.repeat(minimum, per_query[queried])
+        first = np.flatnonzero(is_min)
+        first = first[np.unique(query[first], return_index=True)[1]]
+
+        close = candidate_distances[first] <= self.max_distance
+        hits = query[first][close]
+        indices[hits] = candidates[first][close]
+        distances[hits] = candidate_distances[first][close]
+        return indices, distances
+
+    def lookup(self, lats, lons):
+        """
+        Embeddings of the nearest stored points
+
+        Returns:
+            (covered_mask, (M, 64) array for the covered points in order)
+        """
+        indices, _ = self.nearest(lats, lons)
+        covered = indices >= 0
+        return covered, np.array(self.embeddings[indices[covered]], dtype=np.float32)
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'rows': len(self),
+            'bbox': self.meta.get('bbox'),
+            'max_distance': self.max_distance,
+            'source': self.meta.get('source'),
+        }
+
+
+class EmbeddingStoreSet:
+    """All stores found in a directory, queried in load order"""
+
+    def __init__(self, directory):
+        self.stores = {}
+        directory = Path(directory)
+        if directory.is_dir():
+            for meta_path in sorted(directory.glob('*/meta.json')):
+                try:
+                    store = EmbeddingStore(meta_path.parent)
+                except Exception as e:
+                    print(f"⚠️ Skipping embedding store {meta_path.parent}: {e}")
+                    continue
+                self.stores[store.name] = store
+        if self.stores:
+            rows = sum(len(store) for store in self.stores.values())
+            print(f"🗄️  Loaded {len(self.stores)} embedding store(s) with {rows} points: {', '.join(self.stores)}")
+
+    def __bool__(self):
+        return bool(self.stores)
+
+    def lookup(self, lats, lons):
+        """
+        Embeddings for every point with a stored neighbour in some store
+
+        Returns:
+            (covered_mask, (M, 64) array for the covered points in order)
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        result = np.empty((len(lats), EMBEDDING_DIM), dtype=np.float32)
+        covered = np.zeros(len(lats), dtype=bool)
+        for store in self.stores.values():
+            pending = ~covered
+            if not pending.any():
+                break
+            found, vectors = store.lookup(lats[pending], lons[pending])
+            targets = np.flatnonzero(pending)[found]
+            result[targets] = vectors
+            covered[targets] = True
+        return covered, result[covered]
+
+    def fingerprint(self):
+        """Short id of the loaded stores (names, sizes, sources), '' when empty"""
+        if not self.stores:
+            return ''
+        described = json.dumps(self.describe(), sort_keys=True)
+        return hashlib.sha256(described.encode('utf-8')).hexdigest()[:12]
+
+    def describe(self):
+        return [store.describe() for store in self.stores.values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest AlphaEarth embedding exports')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = sub.add_parser('ingest', help='Build a store from a CSV, NPZ or Parquet export')
+    ingest_parser.add_argument('source')
+    ingest_parser.add_argument('--name', help='Store name (defaults to the file stem)')
+    ingest_parser.add_argument('--format', choices=sorted(READERS), help='Defaults to the file suffix')
+    ingest_parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    ingest_parser.add_argument('--max-distance', type=float, help='Lookup radius in degrees')
+    ingest_parser.add_argument('--out-dir', default=os.environ.get('EMBEDDING_STORE_DIR', 'data/embedding_store'))
+
+    info_parser = sub.add_parser('info', help='List the stores in a directory')
+    info_parser.add_argument('--out-dir', default=os.environ.get('EMBEDDING_STORE_DIR', 'data/embedding_store'))
+
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        print(json.dumps(EmbeddingStoreSet(args.out_dir).describe(), indent=2))
+        return
+    ingest(args.source, args.out_dir, name=args.name, fmt=args.format,
+           chunk_rows=args.chunk_rows, max_distance=args.max_distance)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Suitability heatmap tiles
+
+Scores a dense grid over a bounding box so the map can show suitability
+everywhere, not just at the handful of preset sites. The grid follows the
+standard web map tiling (Web Mercator z/x/y, as used by Leaflet): each tile
+is `tile_size` x `tile_size` cells sampled at the cell centres, rows running
+north to south.
+
+Missing tiles of a request are scored together: their cell centres go to
+the embedding service as one batched array and through scoring.py's
+vectorized score_embeddings, which scores every project type at once. Each
+tile is stored per project type as uint8 (score * 255 / 100) in an LRU, so
+panning or zooming back over a region, or switching project type, costs no
+scoring at all. Tiles being scored by another request are waited for
+rather than scored twice.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from scoring import PROJECT_TYPES, project_index, score_embeddings
+
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.0511287798
+
+# uint8 value -> score
+SCORE_SCALE = 100.0 / 255
+
+
+def lat_to_tile_y(lat, zoom):
+    """Fractional tile row of a latitude"""
+    lat = math.radians(min(max(float(lat), -MAX_LATITUDE), MAX_LATITUDE))
+    return (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * (1 << zoom)
+
+
+def lon_to_tile_x(lon, zoom):
+    """Fractional tile column of a longitude"""
+    return (float(lon) + 180.0) / 360.0 * (1 << zoom)
+
+
+def tile_y_to_lat(y, zoom):
+    """Latitude of fractional tile row(s)"""
+    return np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y, dtype=np.float64) / (1 << zoom)))))
+
+
+def tile_x_to_lon(x, zoom):
+    """Longitude of fractional tile column(s)"""
+    return np.asarray(x, dtype=np.float64) / (1 << zoom) * 360.0 - 180.0
+
+
+def tile_bounds(zoom, x, y):
+    """(south, west, north, east) of a tile"""
+    return (
+        float(tile_y_to_lat(y + 1, zoom)), float(tile_x_to_lon(x, zoom)),
+        float(tile_y_to_lat(y, zoom)), float(tile_x_to_lon(x + 1, zoom)),
+    )
+
+
+def tiles_for_bbox(bbox, zoom):
+    """
+    Tiles covering a bounding box at one zoom level
+
+    Args:
+        bbox: (min_lat, max_lat, min_lon, max_lon)
+
+    Returns:
+        List of (zoom, x, y), row by row from the north-west
+    """
+    min_lat, max_lat, min_lon, max_lon = bbox
+    last = (1 << zoom) - 1
+    x0 = min(max(int(lon_to_tile_x(min_lon, zoom)), 0), last)
+    x1 = min(max(int(lon_to_tile_x(max_lon, zoom)), 0), last)
+    y0 = min(max(int(lat_to_tile_y(max_lat, zoom)), 0), last)
+    y1 = min(max(int(lat_to_tile_y(min_lat, zoom)), 0), last)
+    return [(zoom, x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+def tile_points(zoom, x, y, size):
+    """(size * size, 2) lat/lon of a tile's cell centres, row-major from the north-west"""
+    offsets = (np.arange(size) + 0.5) / size
+    lats = tile_y_to_lat(y + offsets, zoom)
+    lons = tile_x_to_lon(x + offsets, zoom)
+    grid_lat, grid_lon = np.meshgrid(lats, lons, indexing='ij')
+    return np.column_stack([grid_lat.ravel(), grid_lon.ravel()])
+
+
+def quantize_scores(scores):
+    """Scores 0-100 -> uint8 0-255"""
+    return np.clip(np.rint(np.asarray(scores) / SCORE_SCALE), 0, 255).astype(np.uint8)
+
+
+class HeatmapTiles:
+    """
+    LRU of quantized suitability tiles keyed by (zoom, x, y, project type)
+
+    Args:
+        service: Anything with batch_fetch(locations) (an AlphaEarthService);
+            tiles with fallback stand-in cells are served but not kept
+        tile_size: Cells per tile side
+        max_tiles: Tiles kept (one per project type and position)
+        batch_tiles: Tiles scored per embedding batch (bounds peak memory)
+    """
+
+    def __init__(self, service, tile_size=64, max_tiles=4096, batch_tiles=16):
+        self.service = service
+        self.tile_size = int(tile_size)
+        self.max_tiles = int(max_tiles)
+        self.batch_tiles = max(1, int(batch_tiles))
+
+        self._tiles = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.cells_scored = 0
+
+    def get_tiles(self, tiles, project_type):
+        """
+        uint8 score tiles for one project type
+
+        Args:
+            tiles: List of (zoom, x, y)
+            project_type: Project type name (unknown types use the default)
+
+        Returns:
+            ({(zoom, x, y): (tile_size, tile_size) uint8 array}, stats dict)
+        """
+        project_type = PROJECT_TYPES[project_index(project_type)]
+        found = {}
+        claimed = []
+        waiting = []
+
+        with self._lock:
+            for position in dict.fromkeys(tiles):
+                tile = self._tiles.get((*position, project_type))
+                if tile is not None:
+                    self._tiles.move_to_end((*position, project_type))
+                    found[position] = tile
+                    self.hits += 1
+                elif position in self._pending:
+                    waiting.append((position, self._pending[position]))
+                    self.waits += 1
+                else:
+                    self._pending[position] = threading.Event()
+                    claimed.append(position)
+                    self.misses += 1
+
+        try:
+            for start in range(0, len(claimed), self.batch_tiles):
+                batch = claimed[start:start + self.batch_tiles]
+                scored = self._score(batch)
+                for position in batch:
+                    found[position] = scored[position][project_index(project_type)]
+        finally:
+            with self._lock:
+                for position in claimed:
+                    self._pending.pop(position).set()
+
+        for position, done in waiting:
+            done.wait()
+            with self._lock:
+                tile = self._tiles.get((*position, project_type))
+            if tile is None:
+                # The other request failed (or the tile was evicted already)
+                tile, _ = self.get_tiles([position], project_type)
+                tile = tile[position]
+            found[position] = tile
+
+        stats = {'tiles': len(found), 'cached': len(found) - len(claimed) - len(waiting),
+                 'scored': len(claimed), 'shared': len(waiting)}
+        return found, stats
+
+    def _score(self, positions):
+        """Score tiles in one batch and store them for every project type"""
+        size = self.tile_size
+        points = np.concatenate([tile_points(*position, size) for position in positions])
+        embeddings, stand_ins = self.service.batch_fetch(points)
+        scores, _, _ = score_embeddings(embeddings)
+        tiles = quantize_scores(scores).T.reshape(len(PROJECT_TYPES), len(positions), size, size)
+        stand_in_tiles = stand_ins.reshape(len(positions), size * size).any(axis=1)
+
+        scored = {}
+        with self._lock:
+            self.cells_scored += len(points)
+            for i, position in enumerate(positions):
+                scored[position] = []
+                for column, project_type in enumerate(PROJECT_TYPES):
+                    tile = np.ascontiguousarray(tiles[column, i])
+                    tile.flags.writeable = False
+                    scored[position].append(tile)
+                    if stand_in_tiles[i]:
+                        continue
+                    self._tiles[(*position, project_type)] = tile
+                    self._tiles.move_to_end((*position, project_type))
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+                self.evictions += 1
+        return scored
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tile_size': self.tile_size,
+                'tiles': len(self._tiles),
+                'max_tiles': self.max_tiles,
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'evictions': self.evictions,
+                'cells_scored': self.cells_scored,
+            }
@@ -0,0 +1,337 @@
+"""
+Background job queue for long-running Sphinx analyses
+
+Submitting a job returns immediately with an id; a fixed pool of worker
+threads runs the jobs. Clients poll the job or subscribe to its state
+changes. The queue is bounded by the jobs still waiting (cancelled ones free
+their slot at once): when it is full, submit raises QueueFull with a
+retry-after estimate so the HTTP layer can answer 429.
+"""
+
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+TERMINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+def kill_process_tree(process):
+    """
+    Kill a subprocess and anything it spawned
+
+    Processes started with start_new_session=True lead their own process
+    group, so the whole group is signalled; otherwise just the process.
+    """
+    try:
+        if hasattr(os, 'killpg') and os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when the queue is at its depth limit"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Job queue is full, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """Raised inside a task when its job has been cancelled"""
+
+
+class DeadlineExceeded(JobCancelled):
+    """Raised inside a task when its deadline has passed"""
+
+
+class CancelToken:
+    """
+    Cooperative cancellation handle passed to tasks
+
+    Tasks that start a subprocess attach it, so cancelling the job kills the
+    process instead of waiting for it to finish. An optional deadline
+    (time.monotonic() value) bounds how long the task may run; remaining()
+    tells blocking calls how long they may wait.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self, default=None):
+        """Seconds left before the deadline, capped at `default` (None: no limit)"""
+        if self.deadline is None:
+            return default
+        left = max(0.0, self.deadline - time.monotonic())
+        return left if default is None else min(default, left)
+
+    def attach(self, process):
+        """Register a running subprocess; kills it at once if already cancelled"""
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled:
+            self._kill()
+
+    def detach(self, process=None):
+        """Forget one subprocess (or all of them)"""
+        with self._lock:
+            if process is None:
+                self._processes.clear()
+            else:
+                self._processes.discard(process)
+
+    def cancel(self, reason='cancelled'):
+        """Cancel and kill attached subprocesses; reason is e.g. 'superseded' or 'disconnected'"""
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+        self._kill()
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled (DeadlineExceeded past its deadline)"""
+        if self.cancelled:
+            raise JobCancelled(self.reason)
+        if self.expired:
+            raise DeadlineExceeded('deadline exceeded')
+
+    def _kill(self):
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                kill_process_tree(process)
+
+
+def _cancel_error(reason):
+    """Job error text for a cancellation other than an explicit DELETE"""
+    return None if reason in (None, 'cancelled') else f'Cancelled ({reason})'
+
+
+class Job:
+    """A unit of work plus its observable state"""
+
+    def __init__(self, kind, task, deadline=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.task = task
+        self.token = CancelToken(deadline)
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._changed = threading.Condition()
+        self._callbacks = []
+        self._release = None  # set by JobQueue: frees the job's queue slot
+
+    def _set(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+            callbacks = self._callbacks if self.done else []
+            if callbacks:
+                self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call callback(job) once the job is finished (at once if it already is)"""
+        with self._changed:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait_for_change(self, since_version, timeout):
+        """Block until the job's version moves past since_version (or timeout)"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > since_version, timeout)
+            return self.version
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATES
+
+    def cancel(self, reason='cancelled'):
+        """Cancel the job (kills its running subprocesses); no-op once it is done"""
+        if self.done:
+            return
+        self.token.cancel(reason)
+        if self.status == QUEUED:
+            # The worker skips it when dequeued; its slot is free from now on
+            if self._release is not None:
+                self._release(self)
+            self._set(status=CANCELLED, error=_cancel_error(reason), finished_at=time.time())
+
+    def to_dict(self, include_result=True):
+        data = {
+            'jobId': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+        if include_result and self.status == SUCCEEDED:
+            data['result'] = self.result
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    Bounded FIFO of jobs served by a fixed worker pool
+
+    Finished jobs are kept for `retention` seconds so clients can collect
+    their results.
+    """
+
+    def __init__(self, workers=4, max_depth=32, retention=3600):
+        self.workers = int(workers)
+        self.max_depth = int(max_depth)
+        self.retention = retention
+
+        self._queue = queue.Queue()
+        self._waiting = set()  # ids of queued jobs holding a slot
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._running = 0
+        # Rolling average runtime, used for the Retry-After estimate
+        self._avg_runtime = 30.0
+
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True).start()
+
+    def submit(self, kind, task, deadline=None):
+        """
+        Queue task(token) and return its Job without waiting
+
+        deadline (a time.monotonic() value) is carried by the job's token.
+
+        Raises:
+            QueueFull: if max_depth jobs are already waiting
+        """
+        self._prune()
+        job = Job(kind, task, deadline)
+        job._release = self._release
+        with self._lock:
+            full = len(self._waiting) >= self.max_depth
+            if not full:
+                self._jobs[job.id] = job
+                self._waiting.add(job.id)
+        if full:
+            raise QueueFull(self.retry_after())
+        self._queue.put_nowait(job)
+        return job
+
+    def _release(self, job):
+        """Free a job's queue slot (idempotent)"""
+        with self._lock:
+            self._waiting.discard(job.id)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job or None if unknown"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        return job
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up"""
+        with self._lock:
+            backlog = len(self._waiting) + 1
+        return max(1, int(self._avg_runtime * backlog / max(1, self.workers)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': len(self._waiting),
+                'max_depth': self.max_depth,
+                'tracked_jobs': len(self._jobs),
+                'avg_runtime_s': round(self._avg_runtime, 2),
+            }
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            self._release(job)
+            try:
+                if job.status == CANCELLED or job.token.cancelled:
+                    continue
+                if job.token.expired:
+                    job._set(status=FAILED, error='Deadline exceeded before the job started', finished_at=time.time())
+                    continue
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        with self._lock:
+            self._running += 1
+        started = time.time()
+        job._set(status=RUNNING, started_at=started)
+        print(f"⚙️  Job {job.id[:8]} ({job.kind}) started")
+        try:
+            result = job.task(job.token)
+            if job.token.cancelled:
+                raise JobCancelled(job.token.reason)
+            job._set(status=SUCCEEDED, result=result, finished_at=time.time())
+        except DeadlineExceeded:
+            job._set(status=FAILED, error='Deadline exceeded', finished_at=time.time())
+        except JobCancelled:
+            job._set(status=CANCELLED, error=_cancel_error(job.token.reason), finished_at=time.time())
+        except Exception as e:
+            print(f"❌ Job {job.id[:8]} failed: {e}")
+            status = CANCELLED if job.token.cancelled else FAILED
+            job._set(status=status, error=str(e), finished_at=time.time())
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                self._running -= 1
+                self._avg_runtime = 0.8 * self._avg_runtime + 0.2 * elapsed
+            print(f"⚙️  Job {job.id[:8]} {job.status} in {elapsed:.1f}s")
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.done and job.finished_at and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
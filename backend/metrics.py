@@ -0,0 +1,246 @@
+"""
+Prometheus-style metrics and per-stage request timing
+
+A small, dependency-free registry of counters, gauges and histograms
+rendered in the Prometheus text exposition format for GET /metrics.
+Existing stats() dictionaries (caches, job queue) are exported through
+callbacks, so they are read at scrape time instead of being duplicated.
+
+stage(name) times one step of a request (embedding fetch, notebook write,
+sphinx-cli spawn/run, output parse, Claude call) into the stage histogram,
+and into the current request's timings for the Server-Timing header.
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds: sub-millisecond local work up to sphinx-cli's timeout
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f'{self.name}{_labels_text(self.labelnames, key)} {_format_value(value)}' for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series['counts']))) for key, series in self._series.items())
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _labels_text(self.labelnames, key, {'le': _format_value(bound)})
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(round(series["sum"], 6))}')
+            lines.append(f'{self.name}_count{labels} {series["count"]}')
+        return lines
+
+
+class _Callback(_Metric):
+    """Metric read from a function at scrape time"""
+
+    def __init__(self, name, help, kind, fn, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def render(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = self.header()
+        for key, value in sorted(values.items()):
+            if value is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f'{self.name}{_labels_text(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    """Named collection of metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, kind='gauge', labelnames=()):
+        """
+        Export values computed at scrape time
+
+        fn returns a number, or {label value(s): number}.
+        """
+        return self._register(_Callback(name, help, kind, fn, labelnames))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'oceancarbon_stage_seconds',
+    'Time spent in each stage of a request',
+    ('stage',)
+)
+
+# Timings of the request being handled in this thread/task (None outside a request)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request_timing():
+    """Begin collecting stage timings for the current request"""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def request_timings():
+    return _request_timings.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def server_timing_header(timings, total=None):
+    """Server-Timing value, e.g. 'embeddings;dur=1.2, sphinx_run;dur=2400.0'"""
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
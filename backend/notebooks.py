@@ -0,0 +1,270 @@
+"""
+Compact, content-addressed Jupyter notebooks for Sphinx runs
+
+Embeddings go into float32 .npy sidecars that the notebook loads with
+np.load(mmap_mode='r'), instead of being pasted into the .ipynb as list
+literals. Files are named by a hash of their inputs: identical analyses
+reuse one notebook, and concurrent runs with different inputs can never
+overwrite each other. The directory can live on tmpfs (/dev/shm) and is
+garbage-collected by age and file count; notebooks leased to a running
+Sphinx session are never collected.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from alphaearth_service import EMBEDDING_DIM
+
+_KERNELSPEC = {
+    "kernelspec": {
+        "display_name": "Python 3",
+        "language": "python",
+        "name": "python3"
+    }
+}
+
+
+def _default_tmpfs_dir():
+    shm = Path('/dev/shm')
+    base = shm if shm.is_dir() and os.access(shm, os.W_OK) else Path(tempfile.gettempdir())
+    return base / 'oceancarbon-notebooks'
+
+
+def _code_cell(lines):
+    return {
+        "cell_type": "code",
+        "execution_count": None,
+        "metadata": {},
+        "outputs": [],
+        "source": lines
+    }
+
+
+def _markdown_cell(lines):
+    return {
+        "cell_type": "markdown",
+        "metadata": {},
+        "source": lines
+    }
+
+
+class NotebookStore:
+    """
+    Writes analysis notebooks and their array sidecars
+
+    Args:
+        directory: Where notebooks live (None with backend='tmpfs' uses /dev/shm)
+        backend: 'disk' or 'tmpfs'
+        max_age: Seconds since last use before a notebook is collected
+        max_files: Notebooks kept at most (oldest collected first)
+        gc_every: Run garbage collection every this many writes
+    """
+
+    def __init__(self, directory='notebooks', backend='disk', max_age=24 * 3600, max_files=500, gc_every=50):
+        if backend == 'tmpfs' and not directory:
+            directory = _default_tmpfs_dir()
+        self.directory = Path(directory).resolve()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.backend = backend
+        self.max_age = max_age
+        self.max_files = int(max_files)
+        self.gc_every = int(gc_every)
+
+        self._lock = threading.Lock()
+        self._leases = {}
+        self._writes = 0
+        self.reused = 0
+        self.written = 0
+        self.collected = 0
+
+    def _digest(self, kind, payload, embeddings):
+        h = hashlib.sha256()
+        h.update(kind.encode('utf-8'))
+        h.update(json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8'))
+        h.update(embeddings.tobytes())
+        return h.hexdigest()[:20]
+
+    def _write_atomic(self, path, write):
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _materialize(self, kind, payload, embeddings, build_cells):
+        """
+        Write (or reuse) notebook + sidecar for these inputs
+
+        Returns the notebook path, leased: garbage collection skips it until
+        the caller hands it back with release().
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype='<f4')
+        digest = self._digest(kind, payload, embeddings)
+        notebook_path = self.directory / f'{kind}_{digest}.ipynb'
+
+        # Lease before touching the files, so a concurrent sweep can't
+        # delete them between the existence check and the caller's run
+        with self._lock:
+            self._leases[notebook_path] = self._leases.get(notebook_path, 0) + 1
+        try:
+            return self._write_or_reuse(notebook_path, embeddings, build_cells)
+        except BaseException:
+            self.release(notebook_path)
+            raise
+
+    def _write_or_reuse(self, notebook_path, embeddings, build_cells):
+        array_path = notebook_path.with_suffix('.npy')
+
+        if notebook_path.exists() and array_path.exists():
+            # Refresh mtime so garbage collection treats it as recently used
+            os.utime(notebook_path)
+            os.utime(array_path)
+            with self._lock:
+                self.reused += 1
+            return str(notebook_path)
+
+        def write_array(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, embeddings)
+
+        def write_notebook(tmp_path):
+            content = {
+                "cells": build_cells(str(array_path)),
+                "metadata": _KERNELSPEC,
+                "nbformat": 4,
+                "nbformat_minor": 4
+            }
+            with open(tmp_path, 'w') as f:
+                json.dump(content, f, separators=(',', ':'))
+
+        # Sidecar first, so a notebook never points at a missing array
+        self._write_atomic(array_path, write_array)
+        self._write_atomic(notebook_path, write_notebook)
+
+        with self._lock:
+            self.written += 1
+            self._writes += 1
+            run_gc = self._writes % self.gc_every == 0
+        if run_gc:
+            self.collect_garbage()
+        return str(notebook_path)
+
+    def release(self, notebook_path):
+        """Hand back a notebook returned by site_analysis()/ranking()"""
+        notebook_path = Path(notebook_path)
+        with self._lock:
+            count = self._leases.get(notebook_path, 0) - 1
+            if count > 0:
+                self._leases[notebook_path] = count
+            else:
+                self._leases.pop(notebook_path, None)
+
+    def site_analysis(self, embeddings, location, project_type):
+        """Notebook for a single-site analysis"""
+        location = {'lat': location['lat'], 'lon': location['lon']}
+        payload = {'location': location, 'projectType': project_type}
+
+        def cells(array_path):
+            return [
+                _code_cell([
+                    "import numpy as np\n",
+                    "import pandas as pd\n",
+                    "import json\n",
+                    "\n",
+                    "# Site Analysis\n",
+                    f"embeddings = np.load({array_path!r}, mmap_mode='r')\n",
+                    f"location = {json.dumps(location)}\n",
+                    f"project_type = {json.dumps(project_type)}\n",
+                    "\n",
+                    "print(f'Analyzing site at {location}')\n",
+                    "print(f'Embeddings shape: {embeddings.shape}')\n",
+                    "print(f'Project type: {project_type}')\n"
+                ]),
+                _markdown_cell([
+                    "# Ocean Site Analysis\n",
+                    "Sphinx AI will analyze this data and provide ocean metrics..."
+                ])
+            ]
+
+        return self._materialize('site_analysis', payload, np.asarray(embeddings, dtype=np.float32), cells)
+
+    def ranking(self, sites, project_type, kind='ranking'):
+        """Notebook for ranking/comparing sites; embeddings row i belongs to sites[i]"""
+        meta = [{k: v for k, v in site.items() if k != 'embeddings'} for site in sites]
+        embeddings = np.full((len(sites), EMBEDDING_DIM), np.nan, dtype=np.float32)
+        for i, site in enumerate(sites):
+            if site.get('embeddings') is not None:
+                embeddings[i] = site['embeddings']
+        payload = {'sites': meta, 'projectType': project_type}
+
+        def cells(array_path):
+            return [
+                _code_cell([
+                    "import numpy as np\n",
+                    "import pandas as pd\n",
+                    "import json\n",
+                    "\n",
+                    "# Multi-site Ranking Analysis\n",
+                    f"project_type = {json.dumps(project_type)}\n",
+                    f"num_sites = {len(sites)}\n",
+                    "\n",
+                    "# Sites data loaded (embeddings row i belongs to sites[i])\n",
+                    f"sites = pd.DataFrame(json.loads({json.dumps(meta, separators=(',', ':'), default=str)!r}))\n",
+                    f"embeddings = np.load({array_path!r}, mmap_mode='r')\n",
+                    "\n",
+                    "print(f'Ranking {num_sites} sites for {project_type}')\n"
+                ])
+            ]
+
+        return self._materialize(kind, payload, embeddings, cells)
+
+    def collect_garbage(self):
+        """
+        Remove notebooks (and sidecars) unused for max_age, then the oldest
+        past max_files; leased notebooks are skipped
+        """
+        now = time.time()
+        notebooks = []
+        for path in self.directory.glob('*.ipynb'):
+            try:
+                notebooks.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        notebooks.sort()
+
+        excess = max(0, len(notebooks) - self.max_files)
+        removed = 0
+        # Under the lock, so no lease can be taken on a notebook mid-delete
+        with self._lock:
+            for position, (mtime, path) in enumerate(notebooks):
+                if position >= excess and now - mtime <= self.max_age:
+                    break
+                if path in self._leases:
+                    continue
+                for victim in (path, path.with_suffix('.npy')):
+                    try:
+                        victim.unlink()
+                    except FileNotFoundError:
+                        pass
+                removed += 1
+            self.collected += removed
+
+        if removed:
+            print(f"🧹 Collected {removed} old notebooks")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': str(self.directory),
+                'backend': self.backend,
+                'written': self.written,
+                'reused': self.reused,
+                'collected': self.collected,
+                'leased': len(self._leases),
+            }
@@ -0,0 +1,302 @@
+"""
+Incremental ranking sessions
+
+An analyst edits a candidate list over and over; re-ranking everything (and
+re-running Sphinx) after each edit is wasted work. A session keeps each
+site's local score, metrics and embedding plus the ranking order. An edit
+scores only the sites it adds or changes (scoring.score_sites_local) and
+bisects them into the order, so unchanged sites are never rescored and a
+read is served straight from the session.
+
+The order is a sorted list of (-score, seq, key): seq is the site's
+insertion number, so equal scores keep list order like rank_sites_local.
+Finding a position is O(log n); the list insert/delete itself is a memmove.
+"""
+
+import bisect
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from scoring import score_sites_local
+
+
+class SessionError(ValueError):
+    """An edit that cannot be applied (unknown or duplicate site id, ...)"""
+
+
+def check_sites(sites, field='sites'):
+    """Raise SessionError unless `sites` is a list of site objects"""
+    if not isinstance(sites, (list, tuple)) or not all(isinstance(site, dict) for site in sites):
+        raise SessionError(f'"{field}" must be a list of site objects')
+    return sites
+
+
+def check_ids(ids, field='remove'):
+    """Raise SessionError unless `ids` is a list of site ids"""
+    if not isinstance(ids, (list, tuple)) or not all(isinstance(key, (str, int)) for key in ids):
+        raise SessionError(f'"{field}" must be a list of site ids')
+    return ids
+
+
+def site_key(site, fallback):
+    """A site's id in its session: "id", else "name", else `fallback`"""
+    for field in ('id', 'name'):
+        if site.get(field) is not None:
+            return str(site[field])
+    return str(fallback)
+
+
+class RankingSession:
+    """
+    One candidate list and its ranking for a project type
+
+    Args:
+        project_type: Project type name
+        embed_fn: Callable(list of sites) -> (N, 64) embeddings (fetches the
+                  sites sent without "embeddings")
+    """
+
+    def __init__(self, project_type, embed_fn):
+        self.id = uuid.uuid4().hex
+        self.project_type = project_type
+        self.embed_fn = embed_fn
+        self.version = 0
+        self.rescored = 0
+        self.lock = threading.Lock()
+        self.touched = time.time()
+        self.narrative = None
+        self.narrative_signature = None
+
+        self._entries = {}
+        self._order = []
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _score(self, keyed_sites):
+        """Score [(key, site)] and return their entries"""
+        if not keyed_sites:
+            return []
+        sites = [site for _, site in keyed_sites]
+        embeddings = np.asarray(self.embed_fn(sites), dtype=np.float32)
+        scored = score_sites_local(sites, embeddings, self.project_type)
+        self.rescored += len(scored)
+        return [
+            (key, {**scored[i], 'site': {k: v for k, v in site.items() if k != 'embeddings'},
+                   'embeddings': embeddings[i]})
+            for i, (key, site) in enumerate(keyed_sites)
+        ]
+
+    def _insert(self, key, entry, seq):
+        entry['seq'] = seq
+        self._entries[key] = entry
+        bisect.insort(self._order, (-entry['score'], seq, key))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        position = bisect.bisect_left(self._order, (-entry['score'], entry['seq'], key))
+        del self._order[position]
+        return entry
+
+    def rank_of(self, key):
+        """1-based rank of a site, found by bisection"""
+        entry = self._entries[key]
+        return bisect.bisect_left(self._order, (-entry['score'], entry['seq'], key)) + 1
+
+    def apply(self, add=(), remove=(), update=(), project_type=None):
+        """
+        Apply one edit
+
+        Args:
+            add: New sites (need lat/lon or embeddings; keyed by site_key)
+            remove: Ids of sites to drop
+            update: Sites whose id exists; only fields given are changed, and
+                    the site is rescored only if its location or embeddings
+                    changed
+            project_type: New project type (rescores every site)
+
+        Returns:
+            {'added', 'removed', 'updated', 'rescored'} counts, plus 'ranks':
+            {id: new rank} for every added or updated site
+
+        Raises:
+            SessionError: malformed lists, unknown/duplicate ids; nothing is
+                          changed then
+        """
+        check_sites(add, 'add')
+        check_sites(update, 'update')
+        remove = [str(key) for key in check_ids(remove)]
+        missing = [key for key in remove if key not in self._entries]
+        if missing:
+            raise SessionError(f"Unknown site ids: {', '.join(missing[:5])}")
+
+        added = [(site_key(site, f'site-{next(self._ids)}'), site) for site in add]
+        taken = set(self._entries) - set(remove)
+        new_keys = [key for key, _ in added]
+        if len(set(new_keys)) != len(new_keys) or taken.intersection(new_keys):
+            raise SessionError('Added sites need ids not already in the session')
+
+        updated = []
+        for site in update:
+            key = site_key(site, None)
+            if key not in self._entries or key in remove:
+                raise SessionError(f'Unknown site id: {key}')
+            updated.append((key, site))
+
+        before = self.rescored
+        changed = {}
+        relabelled = []
+        for key, site in updated:
+            entry = self._entries[key]
+            merged = {**entry['site'], **{k: v for k, v in site.items() if k != 'embeddings'}}
+            moved = 'embeddings' in site or any(
+                field in site and site[field] != entry['site'].get(field) for field in ('lat', 'lon')
+            )
+            if moved:
+                changed[key] = {**merged, 'embeddings': site['embeddings']} if 'embeddings' in site else merged
+            else:
+                relabelled.append((entry, merged))  # metadata only: same score, same place
+
+        previous_type = self.project_type
+        if project_type is not None and project_type != self.project_type:
+            self.project_type = project_type
+            for key, entry in self._entries.items():
+                if key not in changed and key not in remove:
+                    changed[key] = {**entry['site'], 'embeddings': entry['embeddings']}
+
+        # Score before touching the order, so a failed fetch leaves the session intact
+        try:
+            rescored = self._score(list(changed.items()))
+            fresh = self._score(added)
+        except Exception:
+            self.project_type = previous_type
+            raise
+
+        for key in remove:
+            self._remove(key)
+        for key, entry in rescored:
+            seq = self._remove(key)['seq']
+            self._insert(key, entry, seq)
+        for key, entry in fresh:
+            self._insert(key, entry, next(self._seq))
+        for entry, merged in relabelled:
+            entry['site'] = merged
+            entry.update({field: merged.get(field) for field in ('name', 'lat', 'lon')})
+
+        self.version += 1
+        self.touched = time.time()
+        return {
+            'added': len(added),
+            'removed': len(remove),
+            'updated': len(updated),
+            'rescored': self.rescored - before,
+            'ranks': {key: self.rank_of(key) for key, _ in updated + added},
+        }
+
+    def ranking(self, offset=0, limit=None):
+        """Ranked sites from session state, shaped like rank_sites_local's output"""
+        stop = len(self._order) if limit is None else offset + limit
+        return [
+            {'rank': offset + i + 1, 'id': key, **self._public(self._entries[key])}
+            for i, (_, _, key) in enumerate(self._order[offset:stop])
+        ]
+
+    def top_sites(self, k):
+        """The top k sites with their embeddings (for a Sphinx narrative)"""
+        return [
+            {**self._entries[key]['site'], 'id': key, 'embeddings': self._entries[key]['embeddings']}
+            for _, _, key in self._order[:k]
+        ]
+
+    def top_signature(self, k):
+        """Identity of the top k (ids and scores): the narrative is reused while it holds"""
+        return (self.project_type, tuple((key, -negative) for negative, _, key in self._order[:k]))
+
+    @staticmethod
+    def _public(entry):
+        return {field: entry[field] for field in ('name', 'lat', 'lon', 'score', 'metrics', 'analysis')}
+
+    def describe(self):
+        return {
+            'sessionId': self.id,
+            'projectType': self.project_type,
+            'sites': len(self._entries),
+            'version': self.version,
+            'rescored': self.rescored,
+        }
+
+
+class RankingSessions:
+    """
+    Live ranking sessions by id, least recently used evicted first
+
+    Sessions idle for `ttl` seconds expire.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=24 * 3600):
+        self.max_sessions = int(max_sessions)
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+
+    def create(self, project_type, embed_fn, sites):
+        """
+        New session holding `sites`, ranked
+
+        Raises:
+            SessionError: duplicate site ids
+        """
+        session = RankingSession(project_type, embed_fn)
+        session.apply(add=sites)
+        with self._lock:
+            self._sessions[session.id] = session
+            self.created += 1
+            self._prune()
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session.touched > self.ttl:
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            session.touched = time.time()
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for session_id in [sid for sid, session in self._sessions.items() if session.touched < cutoff]:
+            del self._sessions[session_id]
+            self.expired += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            'sessions': len(sessions),
+            'max_sessions': self.max_sessions,
+            'created': self.created,
+            'expired': self.expired,
+            'sites': sum(len(session) for session in sessions),
+            'rescored': sum(session.rescored for session in sessions),
+        }
@@ -0,0 +1,301 @@
+"""
+Precomputed regional embedding rasters
+
+A raster is an (H, W, 64) float32 .npy file covering a lat/lon bounding box on
+a regular grid, plus a small JSON sidecar with its geometry. Rasters are
+memory-mapped read-only, so point lookups are index arithmetic and region
+scans are array slices.
+
+Build one with:
+    python region_rasters.py build --preset monterey
+    python region_rasters.py build --name custom --bbox 36.2 37.0 -122.2 -121.6 --resolution 0.01
+
+Rasters are built through the AlphaEarth API when ALPHAEARTH_URL is set
+(the mock otherwise), and the sidecar records which one. A server with an
+API configured only loads rasters built from that API, so mock vectors
+never shadow real ones.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+
+from alphaearth_service import EMBEDDING_DIM, HTTPProvider, MockProvider
+
+# Regions the UI scans (see REGION_SITE_COORDS in OceanCarbonAI.jsx)
+PRESETS = {
+    'monterey': {'bbox': (36.2, 37.0, -122.2, -121.6), 'resolution': 0.01},
+    'south_florida': {'bbox': (24.4, 26.0, -82.0, -79.9), 'resolution': 0.02},
+    'brazil_coast': {'bbox': (-24.5, -3.5, -47.0, -32.0), 'resolution': 0.05},
+}
+
+# Rows written per batch call while building
+_BUILD_CHUNK_ROWS = 64
+
+
+def build_region_raster(service, name, bbox, resolution, out_dir, source='mock'):
+    """
+    Compute the embedding field for a bounding box and write it to disk
+
+    Args:
+        service: Anything with batch_get_embeddings(locations)
+        name: Raster name (file stem)
+        bbox: (min_lat, max_lat, min_lon, max_lon)
+        resolution: Grid spacing in degrees
+        out_dir: Directory for <name>.npy and <name>.json
+        source: Where the vectors come from: 'mock' or the API base URL
+
+    Returns:
+        Path to the .npy file
+    """
+    min_lat, max_lat, min_lon, max_lon = (float(v) for v in bbox)
+    if min_lat >= max_lat or min_lon >= max_lon:
+        raise ValueError('bbox must be (min_lat, max_lat, min_lon, max_lon)')
+
+    height = int(round((max_lat - min_lat) / resolution)) + 1
+    width = int(round((max_lon - min_lon) / resolution)) + 1
+    lats = min_lat + np.arange(height) * resolution
+    lons = min_lon + np.arange(width) * resolution
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    npy_path = out_dir / f'{name}.npy'
+    tmp_path = out_dir / f'{name}.{os.getpid()}.tmp.npy'
+
+    print(f"🗺️  Building raster '{name}': {height}x{width} cells at {resolution}°")
+    raster = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=np.float32, shape=(height, width, EMBEDDING_DIM)
+    )
+    for row in range(0, height, _BUILD_CHUNK_ROWS):
+        chunk_lats = lats[row:row + _BUILD_CHUNK_ROWS]
+        grid_lat, grid_lon = np.meshgrid(chunk_lats, lons, indexing='ij')
+        locations = np.column_stack([grid_lat.ravel(), grid_lon.ravel()])
+        chunk = np.asarray(service.batch_get_embeddings(locations), dtype=np.float32)
+        raster[row:row + len(chunk_lats)] = chunk.reshape(len(chunk_lats), width, EMBEDDING_DIM)
+    raster.flush()
+    del raster
+    os.replace(tmp_path, npy_path)
+
+    meta = {
+        'name': name,
+        'bbox': [min_lat, max_lat, min_lon, max_lon],
+        'resolution': resolution,
+        'shape': [height, width, EMBEDDING_DIM],
+        'dtype': 'float32',
+        'source': source,
+    }
+    with open(out_dir / f'{name}.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"✅ Raster written to {npy_path}")
+    return npy_path
+
+
+class RegionRaster:
+    """
+    Read-only memory-mapped embedding raster
+
+    Row i is latitude min_lat + i * resolution, column j is longitude
+    min_lon + j * resolution.
+    """
+
+    def __init__(self, npy_path):
+        npy_path = Path(npy_path)
+        with open(npy_path.with_suffix('.json')) as f:
+            meta = json.load(f)
+        self.name = meta['name']
+        self.min_lat, self.max_lat, self.min_lon, self.max_lon = meta['bbox']
+        self.resolution = float(meta['resolution'])
+        # Rasters from before sources were recorded were built with the mock
+        self.source = meta.get('source', 'mock')
+        self.data = np.load(npy_path, mmap_mode='r')
+        self.height, self.width = self.data.shape[:2]
+        stat = npy_path.stat()
+        self.built = (stat.st_size, stat.st_mtime_ns)
+
+    def contains(self, lats, lons):
+        """Boolean mask of points inside the raster's bounding box"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        return (
+            (lats >= self.min_lat) & (lats <= self.max_lat)
+            & (lons >= self.min_lon) & (lons <= self.max_lon)
+        )
+
+    def _fractional_index(self, lats, lons):
+        rows = (np.asarray(lats, dtype=np.float64) - self.min_lat) / self.resolution
+        cols = (np.asarray(lons, dtype=np.float64) - self.min_lon) / self.resolution
+        return (
+            np.clip(rows, 0, self.height - 1),
+            np.clip(cols, 0, self.width - 1),
+        )
+
+    def lookup(self, lats, lons, method='bilinear'):
+        """
+        Embeddings for points inside the raster
+
+        Args:
+            lats, lons: Array-likes of N coordinates (must be inside the bbox)
+            method: 'bilinear' or 'nearest'
+
+        Returns:
+            (N, 64) float32 array
+        """
+        rows, cols = self._fractional_index(np.atleast_1d(lats), np.atleast_1d(lons))
+
+        if method == 'nearest':
+            return np.array(self.data[np.rint(rows).astype(np.intp), np.rint(cols).astype(np.intp)])
+
+        r0 = np.floor(rows).astype(np.intp)
+        c0 = np.floor(cols).astype(np.intp)
+        r1 = np.minimum(r0 + 1, self.height - 1)
+        c1 = np.minimum(c0 + 1, self.width - 1)
+        dr = (rows - r0)[:, None].astype(np.float32)
+        dc = (cols - c0)[:, None].astype(np.float32)
+
+        top = self.data[r0, c0] * (1 - dc) + self.data[r0, c1] * dc
+        bottom = self.data[r1, c0] * (1 - dc) + self.data[r1, c1] * dc
+        return (top * (1 - dr) + bottom * dr).astype(np.float32)
+
+    def window_bounds(self, min_lat, max_lat, min_lon, max_lon):
+        """Row/column slice bounds of the cells inside a sub-box (clipped to the raster)"""
+        r0 = max(0, math.ceil((min_lat - self.min_lat) / self.resolution - 1e-9))
+        r1 = min(self.height, math.floor((max_lat - self.min_lat) / self.resolution + 1e-9) + 1)
+        c0 = max(0, math.ceil((min_lon - self.min_lon) / self.resolution - 1e-9))
+        c1 = min(self.width, math.floor((max_lon - self.min_lon) / self.resolution + 1e-9) + 1)
+        return r0, max(r0, r1), c0, max(c0, c1)
+
+    def window(self, min_lat, max_lat, min_lon, max_lon):
+        """Zero-copy (h, w, 64) view of the cells inside a sub-box"""
+        r0, r1, c0, c1 = self.window_bounds(min_lat, max_lat, min_lon, max_lon)
+        return self.data[r0:r1, c0:c1]
+
+    def window_geometry(self, min_lat, max_lat, min_lon, max_lon):
+        """Actual bbox and shape of the window returned for a requested sub-box"""
+        r0, r1, c0, c1 = self.window_bounds(min_lat, max_lat, min_lon, max_lon)
+        return {
+            'bbox': [
+                self.min_lat + r0 * self.resolution,
+                self.min_lat + (r1 - 1) * self.resolution,
+                self.min_lon + c0 * self.resolution,
+                self.min_lon + (c1 - 1) * self.resolution,
+            ],
+            'shape': [r1 - r0, c1 - c0, EMBEDDING_DIM],
+            'resolution': self.resolution,
+        }
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'bbox': [self.min_lat, self.max_lat, self.min_lon, self.max_lon],
+            'resolution': self.resolution,
+            'shape': list(self.data.shape),
+            'source': self.source,
+        }
+
+
+class RegionRasterSet:
+    """
+    All rasters found in a directory, queried in load order
+
+    With `upstream` (the AlphaEarth API base URL) set, rasters built from
+    anything else (the mock, another API) are skipped.
+    """
+
+    def __init__(self, directory, upstream=None):
+        self.rasters = {}
+        upstream = upstream.rstrip('/') if upstream else None
+        directory = Path(directory)
+        if directory.is_dir():
+            for npy_path in sorted(directory.glob('*.npy')):
+                if not npy_path.with_suffix('.json').exists():
+                    continue
+                try:
+                    raster = RegionRaster(npy_path)
+                except Exception as e:
+                    print(f"⚠️ Skipping raster {npy_path}: {e}")
+                    continue
+                if upstream and raster.source != upstream:
+                    print(f"⚠️ Skipping raster {npy_path}: built from {raster.source}, not {upstream}")
+                    continue
+                self.rasters[raster.name] = raster
+        if self.rasters:
+            print(f"🗺️  Loaded {len(self.rasters)} embedding raster(s): {', '.join(self.rasters)}")
+
+    def __bool__(self):
+        return bool(self.rasters)
+
+    def get(self, name):
+        return self.rasters.get(name)
+
+    def lookup(self, lats, lons, method='bilinear'):
+        """
+        Embeddings for every point covered by some raster
+
+        Returns:
+            (covered_mask, (M, 64) array for the covered points in order)
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        result = np.empty((len(lats), EMBEDDING_DIM), dtype=np.float32)
+        covered = np.zeros(len(lats), dtype=bool)
+        for raster in self.rasters.values():
+            mask = raster.contains(lats, lons) & ~covered
+            if mask.any():
+                result[mask] = raster.lookup(lats[mask], lons[mask], method)
+                covered |= mask
+        return covered, result[covered]
+
+    def fingerprint(self):
+        """Short id of the loaded rasters (geometry and file versions), '' when empty"""
+        if not self.rasters:
+            return ''
+        described = json.dumps(
+            [[raster.describe(), list(raster.built)] for raster in self.rasters.values()], sort_keys=True
+        )
+        return hashlib.sha256(described.encode('utf-8')).hexdigest()[:12]
+
+    def describe(self):
+        return [raster.describe() for raster in self.rasters.values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute AlphaEarth embedding rasters')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build = sub.add_parser('build', help='Build a raster for a bounding box')
+    build.add_argument('--preset', choices=sorted(PRESETS), help='Use a predefined region')
+    build.add_argument('--name', help='Raster name (defaults to the preset name)')
+    build.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LON', 'MAX_LON'))
+    build.add_argument('--resolution', type=float, help='Grid spacing in degrees')
+    build.add_argument('--out-dir', default=os.environ.get('EMBEDDING_RASTER_DIR', 'data/rasters'))
+
+    args = parser.parse_args()
+
+    preset = PRESETS.get(args.preset, {})
+    name = args.name or args.preset
+    bbox = args.bbox or preset.get('bbox')
+    resolution = args.resolution or preset.get('resolution')
+    if not (name and bbox and resolution):
+        parser.error('give --preset, or --name, --bbox and --resolution')
+
+    # Same provider the server answers uncovered points with (no mock fallback:
+    # a raster half filled with mock vectors would be worse than none)
+    url = os.environ.get('ALPHAEARTH_URL')
+    if url:
+        service = HTTPProvider(url, api_key=os.environ.get('ALPHAEARTH_API_KEY'), batch_window=0)
+        source = service.base_url
+    else:
+        print("⚠️ ALPHAEARTH_URL not set, building from mock embeddings")
+        service, source = MockProvider(), 'mock'
+
+    build_region_raster(service, name, bbox, resolution, args.out_dir, source)
+
+
+if __name__ == '__main__':
+    main()
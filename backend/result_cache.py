@@ -0,0 +1,147 @@
+"""
+Persistent, content-addressed cache of Sphinx analysis results
+
+Keys are SHA-256 hashes of the normalized analysis inputs (embeddings
+rounded to a tolerance, location, project type, prompt template version), so
+two users asking the same question share one sphinx-cli run. Entries live in
+a SQLite file, which makes the cache safe to share between worker processes,
+and expire after a TTL. When the table grows past max_entries the least
+recently used rows are evicted.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def _normalize(value, decimals):
+    """Round every float (including inside lists/arrays/dicts) to `decimals` places"""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v, decimals) for k, v in sorted(value.items())}
+    if isinstance(value, np.ndarray):
+        return np.round(value.astype(np.float64), decimals).tolist()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v, decimals) for v in value]
+    if isinstance(value, (float, np.floating)):
+        rounded = round(float(value), decimals)
+        return 0.0 if rounded == 0 else rounded  # fold -0.0 into 0.0
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+class ResultCache:
+    """
+    SQLite-backed analysis result cache
+
+    Args:
+        path: Database file (shared by all processes pointing at it)
+        ttl: Seconds an entry stays valid
+        max_entries: Row limit; least recently used rows are evicted past it
+        tolerance_decimals: Embedding/coordinate rounding used in keys
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=5000, tolerance_decimals=3):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = int(max_entries)
+        self.decimals = int(tolerance_decimals)
+
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT PRIMARY KEY,'
+                ' kind TEXT NOT NULL,'
+                ' value TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' accessed_at REAL NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)')
+
+    def _connect(self):
+        # One connection per thread; WAL lets readers in other processes proceed during writes
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def make_key(self, kind, template_version, inputs):
+        """Content address for an analysis: hash of kind, prompt version and normalized inputs"""
+        payload = json.dumps(
+            {'kind': kind, 'version': template_version, 'inputs': _normalize(inputs, self.decimals)},
+            sort_keys=True,
+            separators=(',', ':'),
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached result for key, or None if missing/expired"""
+        now = time.time()
+        db = self._connect()
+        row = db.execute(
+            'SELECT value, created_at FROM results WHERE key = ?', (key,)
+        ).fetchone()
+
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                with db:
+                    db.execute('DELETE FROM results WHERE key = ?', (key,))
+            with self._stats_lock:
+                self.misses += 1
+            return None
+
+        with db:
+            db.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+        with self._stats_lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, kind, result):
+        """Store result under key and evict past the size bound"""
+        now = time.time()
+        db = self._connect()
+        with db:
+            db.execute(
+                'INSERT OR REPLACE INTO results (key, kind, value, created_at, accessed_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (key, kind, json.dumps(result, separators=(',', ':')), now, now),
+            )
+            db.execute('DELETE FROM results WHERE created_at < ?', (now - self.ttl,))
+            db.execute(
+                'DELETE FROM results WHERE key IN ('
+                ' SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+
+    def record_bypass(self):
+        with self._stats_lock:
+            self.bypasses += 1
+
+    def stats(self):
+        entries = self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl_s': self.ttl,
+            }
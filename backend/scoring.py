@@ -0,0 +1,322 @@
+"""
+Local, deterministic suitability scoring from AlphaEarth embeddings
+
+Maps an (N, 64) embedding matrix to the oceanographic metrics the Sphinx
+prompts ask for (temperature, chlorophyll, wave energy, depth, nutrients,
+pH) and scores every site for every project type in one batched pass. Used
+by /api/rank-sites?mode=fast to order thousands of sites without an LLM call,
+and by /api/compare-sites to precompute the side-by-side comparison.
+
+The embedding layout follows the AlphaEarth mock: each metric is read from
+one block of dimensions (0-10 temperature, 10-20 productivity, 20-30 depth,
+30-40 wave energy, 40-50 nutrients, 50-64 carbonate chemistry).
+"""
+
+import numpy as np
+
+from alphaearth_service import EMBEDDING_DIM
+
+METRIC_NAMES = ['temperature', 'chlorophyll', 'wave_energy', 'depth', 'nutrients', 'ph']
+
+_BLOCKS = [(0, 10), (10, 20), (30, 40), (20, 30), (40, 50), (50, 64)]
+
+# Block-averaging projection: (64, 6), one column per metric in METRIC_NAMES order
+_PROJECTION = np.zeros((EMBEDDING_DIM, len(_BLOCKS)), dtype=np.float32)
+for _col, (_start, _stop) in enumerate(_BLOCKS):
+    _PROJECTION[_start:_stop, _col] = 1.0 / (_stop - _start)
+
+# Typical block mean and spread over ocean locations, used to standardize
+_CENTER = np.array([0.935, -0.034, -0.138, -0.442, -0.143, -0.128], dtype=np.float32)
+_SPREAD = np.array([0.31, 0.29, 0.28, 0.28, 0.27, 0.22], dtype=np.float32)
+
+# Scoring happens in "feature space": depth and chlorophyll on a log10 scale,
+# nutrients as a 0-1 index. Columns follow METRIC_NAMES.
+# Each project type: (optimum, tolerance, weight) per feature.
+PROJECT_PREFERENCES = {
+    'Ocean Alkalinity Enhancement': (
+        [15.0, 0.0, 6.0, 2.0, 0.5, 8.10],
+        [8.0, 1.0, 3.0, 1.0, 0.5, 0.15],
+        [1.0, 0.5, 1.5, 1.0, 0.5, 2.0],
+    ),
+    'Direct Ocean Capture': (
+        [15.0, 0.0, 5.0, 2.3, 0.5, 8.00],
+        [5.0, 1.5, 3.0, 1.0, 0.6, 0.20],
+        [2.0, 0.5, 1.0, 1.0, 0.3, 1.0],
+    ),
+    'Kelp Cultivation': (
+        [13.0, 0.3, 7.0, 1.4, 0.8, 8.10],
+        [4.0, 0.6, 2.5, 0.4, 0.3, 0.30],
+        [2.0, 1.0, 1.0, 1.5, 1.5, 0.3],
+    ),
+    'Seagrass Restoration': (
+        [20.0, -0.3, 2.0, 0.55, 0.4, 8.10],
+        [5.0, 0.6, 2.0, 0.4, 0.4, 0.30],
+        [1.5, 1.0, 2.0, 2.0, 0.5, 0.3],
+    ),
+    'Mangrove Restoration': (
+        [26.0, 0.0, 1.5, 0.2, 0.6, 8.00],
+        [4.0, 1.0, 2.0, 0.4, 0.4, 0.30],
+        [2.0, 0.5, 2.0, 2.0, 0.5, 0.3],
+    ),
+    'Microalgae Fertilization': (
+        [12.0, -0.5, 4.0, 3.1, 0.2, 8.10],
+        [8.0, 0.4, 3.0, 0.5, 0.3, 0.30],
+        [0.5, 2.0, 1.0, 2.0, 1.5, 0.3],
+    ),
+}
+
+DEFAULT_PROJECT_TYPE = 'Ocean Alkalinity Enhancement'
+PROJECT_TYPES = list(PROJECT_PREFERENCES)
+
+_OPTIMUM = np.array([p[0] for p in PROJECT_PREFERENCES.values()], dtype=np.float32)
+_TOLERANCE = np.array([p[1] for p in PROJECT_PREFERENCES.values()], dtype=np.float32)
+_WEIGHTS = np.array([p[2] for p in PROJECT_PREFERENCES.values()], dtype=np.float32)
+_WEIGHTS /= _WEIGHTS.sum(axis=1, keepdims=True)
+
+_METRIC_LABELS = {
+    'temperature': 'Water temperature',
+    'chlorophyll': 'Chlorophyll concentration',
+    'wave_energy': 'Wave energy',
+    'depth': 'Water depth',
+    'nutrients': 'Nutrient levels',
+    'ph': 'pH level',
+}
+
+
+def embedding_features(embeddings):
+    """
+    Standardized feature matrix in scoring space
+
+    Args:
+        embeddings: (N, 64) array-like
+
+    Returns:
+        (N, 6) float32 array: temperature °C, log10 chlorophyll, wave energy
+        0-10, log10 depth, nutrient index 0-1, pH
+    """
+    E = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    z = (E @ _PROJECTION - _CENTER) / _SPREAD
+
+    features = np.empty_like(z)
+    features[:, 0] = np.clip(15.0 + 7.0 * z[:, 0], -2.0, 32.0)
+    features[:, 1] = np.clip(0.5 * z[:, 1], -1.7, 1.5)
+    features[:, 2] = np.clip(5.0 + 2.0 * z[:, 2], 0.0, 10.0)
+    features[:, 3] = np.clip(2.0 - 0.8 * z[:, 3], 0.0, 3.8)
+    features[:, 4] = 1.0 / (1.0 + np.exp(-z[:, 4]))
+    features[:, 5] = np.clip(8.05 + 0.1 * z[:, 5], 7.7, 8.4)
+    return features
+
+
+def features_to_metrics(features):
+    """Convert scoring-space features to the metric units reported to clients"""
+    features = np.asarray(features, dtype=np.float64)
+    nutrient_index = features[:, 4]
+    return {
+        'temperature': np.round(features[:, 0], 1),
+        'chlorophyll': np.round(10.0 ** features[:, 1], 2),
+        'wave_energy': np.round(features[:, 2], 1),
+        'depth': np.round(10.0 ** features[:, 3], 0),
+        'nutrients': np.where(nutrient_index < 0.33, 'Low', np.where(nutrient_index < 0.66, 'Medium', 'High')),
+        'ph': np.round(features[:, 5], 2),
+    }
+
+
+def project_index(project_type):
+    """Column of a project type in the score matrix (unknown types use the default)"""
+    if project_type in PROJECT_PREFERENCES:
+        return PROJECT_TYPES.index(project_type)
+    return PROJECT_TYPES.index(DEFAULT_PROJECT_TYPE)
+
+
+def suitability_components(features):
+    """
+    Per-metric fit of every site to every project type
+
+    Returns:
+        (N, P, 6) array in [0, 1], P = len(PROJECT_TYPES)
+    """
+    deviation = (features[:, None, :] - _OPTIMUM[None, :, :]) / _TOLERANCE[None, :, :]
+    return np.exp(-0.5 * deviation ** 2)
+
+
+def score_embeddings(embeddings):
+    """
+    Suitability score (0-100) of every site for every project type
+
+    Returns:
+        (scores (N, P), components (N, P, 6), features (N, 6))
+    """
+    features = embedding_features(embeddings)
+    components = suitability_components(features)
+    scores = 100.0 * np.einsum('npk,pk->np', components, _WEIGHTS)
+    return scores, components, features
+
+
+def _site_analysis(components, metrics, i):
+    """Strengths and concerns for one site from its per-metric fit"""
+    order = np.argsort(components)[::-1]
+    strengths = []
+    for k in order[:3]:
+        if components[k] < 0.5:
+            break
+        name = METRIC_NAMES[k]
+        strengths.append(f"{_METRIC_LABELS[name]} ({metrics[name][i]}) is well suited")
+    concerns = [
+        f"{_METRIC_LABELS[METRIC_NAMES[k]]} ({metrics[METRIC_NAMES[k]][i]}) is outside the preferred range"
+        for k in order[::-1]
+        if components[k] < 0.4
+    ]
+    return strengths, concerns
+
+
+def score_sites_local(sites, embeddings, project_type):
+    """
+    Score sites in input order
+
+    Args:
+        sites: List of site dicts (name, lat, lon, ...), aligned with embeddings
+        embeddings: (N, 64) array-like
+        project_type: Project type name
+
+    Returns:
+        List of {name, lat, lon, score, metrics, analysis}, one per site
+    """
+    if len(sites) == 0:
+        return []
+
+    scores, components, features = score_embeddings(embeddings)
+    column = project_index(project_type)
+    site_scores = scores[:, column]
+    site_components = components[:, column, :]
+    metrics = features_to_metrics(features)
+
+    scored = []
+    for i, site in enumerate(sites):
+        strengths, concerns = _site_analysis(site_components[i], metrics, i)
+        scored.append({
+            'name': site.get('name'),
+            'lat': site.get('lat'),
+            'lon': site.get('lon'),
+            'score': round(float(site_scores[i]), 1),
+            'metrics': {name: metrics[name][i].item() for name in METRIC_NAMES},
+            'analysis': {
+                'strengths': strengths,
+                'concerns': concerns
+            }
+        })
+    return scored
+
+
+def rank_sites_local(sites, embeddings, project_type, limit=None):
+    """
+    Rank sites by local suitability score
+
+    Args:
+        sites: List of site dicts (name, lat, lon, ...), aligned with embeddings
+        embeddings: (N, 64) array-like
+        project_type: Project type name
+        limit: Optional number of top sites to return
+
+    Returns:
+        Ranked list shaped like the Sphinx rank-sites answer; 'index' is each
+        site's position in `sites` (names need not be unique)
+    """
+    scored = score_sites_local(sites, embeddings, project_type)
+    # Stable sort: equal scores keep input order
+    order = sorted(range(len(scored)), key=lambda i: -scored[i]['score'])
+    if limit is not None:
+        order = order[:limit]
+    return [{'rank': rank, 'index': i, **scored[i]} for rank, i in enumerate(order, start=1)]
+
+
+# Conditions for the comparison "best for" table: (label, feature column, pick max?)
+COMPARISON_CONDITIONS = [
+    ('Protected waters (lowest wave energy)', 2, False),
+    ('Warmest water', 0, True),
+    ('Coolest water', 0, False),
+    ('Highest productivity (chlorophyll)', 1, True),
+    ('Richest nutrients', 4, True),
+    ('Shallowest deployment', 3, False),
+    ('Deepest water', 3, True),
+    ('Highest pH', 5, True),
+]
+
+# Metrics with a numeric value to take deltas of (nutrients is categorical)
+_DELTA_METRICS = [name for name in METRIC_NAMES if name != 'nutrients']
+
+
+def _unique_labels(sites):
+    labels, seen = [], {}
+    for i, site in enumerate(sites):
+        label = str(site.get('name') or f'Site {i + 1}')
+        seen[label] = seen.get(label, 0) + 1
+        labels.append(label if seen[label] == 1 else f'{label} ({seen[label]})')
+    return labels
+
+
+def compare_sites_local(sites, embeddings, project_type):
+    """
+    Side-by-side comparison of a few sites in one vectorized pass
+
+    Args:
+        sites: List of site dicts (name, lat, lon, ...), aligned with embeddings
+        embeddings: (N, 64) array-like
+        project_type: Project type name
+
+    Returns:
+        Dict with comparison_table (metrics and score per site), metric_deltas
+        (relative to the top-scoring site), best_for (condition -> site),
+        best_by_project (project type -> site), similarity and distance
+        matrices between embeddings, and a recommendation
+    """
+    E = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    labels = _unique_labels(sites)
+    scores, _, features = score_embeddings(E)
+    site_scores = scores[:, project_index(project_type)]
+    metrics = features_to_metrics(features)
+
+    # Pairwise embedding geometry
+    norms = np.linalg.norm(E, axis=1, keepdims=True)
+    unit = E / np.where(norms == 0, 1.0, norms)
+    similarity = np.clip(unit @ unit.T, -1.0, 1.0)
+    squared = (E * E).sum(axis=1)
+    distance = np.sqrt(np.maximum(squared[:, None] + squared[None, :] - 2.0 * (E @ E.T), 0.0))
+
+    best = int(np.argmax(site_scores))
+    order = np.argsort(-site_scores, kind='stable')
+    numeric = np.stack([metrics[name].astype(np.float64) for name in _DELTA_METRICS], axis=1)
+    deltas = numeric - numeric[best]
+
+    best_for = {f'Overall for {project_type}': labels[best]}
+    for label, column, pick_max in COMPARISON_CONDITIONS:
+        values = features[:, column]
+        best_for[label] = labels[int(np.argmax(values) if pick_max else np.argmin(values))]
+
+    runner_up = int(order[1]) if len(order) > 1 else None
+    return {
+        'projectType': project_type,
+        'sites': labels,
+        'comparison_table': {
+            label: {
+                'score': round(float(site_scores[i]), 1),
+                **{name: metrics[name][i].item() for name in METRIC_NAMES}
+            }
+            for i, label in enumerate(labels)
+        },
+        'metric_deltas': {
+            label: {name: round(float(deltas[i, k]), 2) for k, name in enumerate(_DELTA_METRICS)}
+            for i, label in enumerate(labels)
+        },
+        'best_for': best_for,
+        'best_by_project': {
+            project: labels[int(np.argmax(scores[:, p]))] for p, project in enumerate(PROJECT_TYPES)
+        },
+        'similarity': np.round(similarity.astype(np.float64), 3).tolist(),
+        'distance': np.round(distance.astype(np.float64), 3).tolist(),
+        'recommendation': {
+            'site': labels[best],
+            'score': round(float(site_scores[best]), 1),
+            'runnerUp': labels[runner_up] if runner_up is not None else None,
+            'margin': round(float(site_scores[best] - site_scores[runner_up]), 1) if runner_up is not None else None,
+        },
+    }
@@ -3,15 +3,49 @@ OceanCarbon AI Backend Server
 Connects React frontend to Sphinx AI for ocean site analysis
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS  # ← Must import
 from dotenv import load_dotenv
 import subprocess
+import base64
+import codecs
+import hashlib
 import json
 import os
-from pathlib import Path
+import threading
+import time
 import numpy as np
 
+from alphaearth_service import EMBEDDING_DIM, MOCK_VERSION, AlphaEarthError, AlphaEarthService, HTTPProvider
+from batch_analysis import analyze_batch, batch_keys
+from cancellation import (
+    DisconnectMonitor, SupersedeRegistry, cancelled_payload, cancelled_status, client_socket, requested_deadline,
+    requested_session
+)
+from chat_context import SUMMARY_PROMPT, ConversationContext, compact_analysis_context, extractive_summary
+from claude_client import CLAUDE_SUMMARY_MODEL, ClaudeChat, system_blocks
+from embedding_cache import EmbeddingCache
+from embedding_store import EmbeddingStoreSet
+from heatmap import SCORE_SCALE, HeatmapTiles, tile_bounds, tiles_for_bbox
+from embedding_codec import (
+    BINARY_ENCODINGS, OCTET_STREAM, EmbeddingDecodeError, decode_request_embeddings, embedding_preview,
+    encode_binary, encode_json, negotiate_encoding
+)
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, record_stage, request_timings,
+    server_timing_header, stage, start_request_timing
+)
+from ranking_sessions import RankingSessions, SessionError, check_sites
+from region_rasters import PRESETS as RASTER_PRESETS, RegionRasterSet
+from notebooks import NotebookStore
+from result_cache import ResultCache
+from singleflight import SingleFlight
+from scoring import compare_sites_local, rank_sites_local, score_sites_local
+from sharded_ranking import sharded_rank
+from similarity import LazyIndex, build_index_from_grid, build_index_from_rasters
+from sphinx_output import JSONStreamExtractor, extract_result, final_result
+from jobs import CancelToken, DeadlineExceeded, JobCancelled, JobQueue, QueueFull, kill_process_tree
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -24,58 +58,321 @@ CLAUDE_API_KEY = os.environ.get('CLAUDE_API_KEY', '')
 # ALPHA EARTH EMBEDDINGS SERVICE
 # ============================================================================
 
-class AlphaEarthService:
-    """
-    Mock service for AlphaEarth embeddings
-    Replace with real API calls when available
-    """
-    
-    @staticmethod
-    def get_embeddings(lat, lon):
-        """
-        Generate 64-dimensional embeddings for a location
-        
-        TODO: Replace with real AlphaEarth API call:
-        response = requests.get(
-            'https://api.alphaearth.ai/v1/embeddings',
-            params={'lat': lat, 'lon': lon},
-            headers={'Authorization': f'Bearer {ALPHA_EARTH_KEY}'}
-        )
-        return np.array(response.json()['embeddings'])
-        """
-        
-        # Generate location-based mock embeddings
-        np.random.seed(int((lat + 90) * 1000 + (lon + 180) * 1000))
-        embeddings = np.random.randn(64)
-        
-        # Add realistic patterns based on location
-        # Embeddings 0-10: Temperature-related (latitude dependent)
-        embeddings[0:10] += (90 - abs(lat)) / 50
-        
-        # Embeddings 10-20: Productivity-related
-        if abs(lon) > 100:  # Pacific/Atlantic
-            embeddings[10:20] += np.random.rand(10) * 0.5
-        
-        # Embeddings 20-30: Depth-related
-        embeddings[20:30] -= abs(lat) / 90
-        
-        # Normalize
-        embeddings = (embeddings - embeddings.mean()) / embeddings.std()
-        
-        return embeddings.tolist()
+# Single implementation lives in alphaearth_service.py so the single-point and
+# batch endpoints share one vectorized, thread-safe generator.
+# Wrapped in a tiered cache: in-process LRU in front of a memory-mapped store
+# shared by every worker (set EMBEDDING_CACHE_DIR='' to disable the disk tier).
+# Precomputed regional rasters (built with `python region_rasters.py build`)
+# answer points inside their bounding boxes without generating/fetching.
+# With ALPHAEARTH_URL set, only rasters built from that API are loaded.
+ALPHAEARTH_URL = os.environ.get('ALPHAEARTH_URL')
+region_rasters = RegionRasterSet(os.environ.get('EMBEDDING_RASTER_DIR', 'data/rasters'), upstream=ALPHAEARTH_URL)
+
+# Ingested AlphaEarth exports (`python embedding_store.py ingest FILE`) answer
+# points near their samples with the real embedding; they take precedence
+embedding_stores = EmbeddingStoreSet(os.environ.get('EMBEDDING_STORE_DIR', 'data/embedding_store'))
+
+# The AlphaEarth API when ALPHAEARTH_URL is set (the mock otherwise): pooled
+# keep-alive connections, concurrent single lookups merged into batch calls
+# within ALPHAEARTH_BATCH_WINDOW_MS, jittered retries, capped concurrency
+alphaearth_api = HTTPProvider(
+    ALPHAEARTH_URL,
+    api_key=os.environ.get('ALPHAEARTH_API_KEY'),
+    max_concurrency=int(os.environ.get('ALPHAEARTH_MAX_CONCURRENCY', 8)),
+    batch_window=float(os.environ.get('ALPHAEARTH_BATCH_WINDOW_MS', 5)) / 1000,
+    max_batch=int(os.environ.get('ALPHAEARTH_MAX_BATCH', 256)),
+    retries=int(os.environ.get('ALPHAEARTH_RETRIES', 3)),
+    timeout=float(os.environ.get('ALPHAEARTH_TIMEOUT', 10)),
+) if ALPHAEARTH_URL else None
+
+# Cached vectors depend on where they came from, so each source (stores and
+# rasters loaded, which API or the mock) gets its own disk cache
+_embedding_cache_dir = os.environ.get('EMBEDDING_CACHE_DIR', 'cache/embeddings') or None
+if _embedding_cache_dir and embedding_stores:
+    _embedding_cache_dir = os.path.join(_embedding_cache_dir, f'store-{embedding_stores.fingerprint()}')
+if _embedding_cache_dir and region_rasters:
+    _embedding_cache_dir = os.path.join(_embedding_cache_dir, f'rasters-{region_rasters.fingerprint()}')
+if _embedding_cache_dir and alphaearth_api:
+    _api_id = hashlib.sha256(alphaearth_api.base_url.encode('utf-8')).hexdigest()[:12]
+    _embedding_cache_dir = os.path.join(_embedding_cache_dir, f'api-{_api_id}')
+elif _embedding_cache_dir:
+    _embedding_cache_dir = os.path.join(_embedding_cache_dir, f'mock-v{MOCK_VERSION}')
+
+alphaearth = EmbeddingCache(
+    AlphaEarthService(rasters=region_rasters, store=embedding_stores, provider=alphaearth_api),
+    maxsize=int(os.environ.get('EMBEDDING_CACHE_SIZE', 4096)),
+    disk_dir=_embedding_cache_dir,
+    disk_capacity=int(os.environ.get('EMBEDDING_CACHE_DISK_CAPACITY', 65536)),
+)
+
+# Upper bound on locations accepted by /api/get-embeddings-batch
+MAX_BATCH_LOCATIONS = 5000
+
+# Rankings longer than this are split into shards ranked in parallel
+RANK_SHARD_SIZE = int(os.environ.get('RANK_SHARD_SIZE', 10))
+
+# Concurrent sphinx-cli runs per sharded ranking
+SPHINX_MAX_PARALLEL = int(os.environ.get('SPHINX_MAX_PARALLEL', 4))
+
+# Sites per Sphinx session in /api/analyze-sites-batch, and the request cap
+ANALYZE_BATCH_SIZE = int(os.environ.get('ANALYZE_BATCH_SIZE', 25))
+MAX_ANALYZE_BATCH_SITES = 500
+
+# Extra rounds for batch sites whose answer was missing or malformed
+ANALYZE_BATCH_RETRIES = int(os.environ.get('ANALYZE_BATCH_RETRIES', 1))
+
+# Sites scored per step when streaming a ranking
+STREAM_CHUNK_SIZE = 25
+
+# Upper bound on k for /api/similar-sites
+MAX_SIMILAR_SITES = 100
+
+# Suitability heatmap tiles (/api/heatmap): cells per tile side and tiles kept
+# in the LRU (each is tile_size^2 bytes per project type). Cells go straight
+# to the embedding service, bypassing the per-point embedding cache.
+heatmap_tiles = HeatmapTiles(
+    alphaearth.service,
+    tile_size=int(os.environ.get('HEATMAP_TILE_SIZE', 64)),
+    max_tiles=int(os.environ.get('HEATMAP_CACHE_TILES', 4096)),
+)
+
+# Incremental ranking sessions (/api/rank-sessions): sessions kept, idle expiry
+ranking_sessions = RankingSessions(
+    max_sessions=int(os.environ.get('RANK_SESSION_MAX', 1000)),
+    ttl=float(os.environ.get('RANK_SESSION_TTL', 24 * 3600)),
+)
+
+# Tiles per /api/heatmap request, and the deepest zoom served
+MAX_HEATMAP_TILES = 256
+MAX_HEATMAP_ZOOM = 16
+
+
+def _build_similarity_index():
+    if region_rasters:
+        return build_index_from_rasters(region_rasters)
+    # No precomputed rasters: index a coarser grid over the same preset regions,
+    # straight from the service so the embedding cache is not flooded
+    regions = {
+        name: {'bbox': spec['bbox'], 'resolution': spec['resolution'] * 2}
+        for name, spec in RASTER_PRESETS.items()
+    }
+    return build_index_from_grid(alphaearth.service, regions)
+
+
+# Nearest-neighbour index for /api/similar-sites, built on first use
+similarity_index = LazyIndex(_build_similarity_index)
+
+# Bounded worker pool for async analyses ({"async": true} on analyze/rank/compare)
+job_queue = JobQueue(
+    workers=int(os.environ.get('ANALYSIS_WORKERS', 4)),
+    max_depth=int(os.environ.get('ANALYSIS_QUEUE_DEPTH', 32)),
+)
 
 
-alphaearth = AlphaEarthService()
+# Notebooks handed to sphinx-cli: content-addressed, embeddings in .npy
+# sidecars. NOTEBOOK_BACKEND=tmpfs keeps them in /dev/shm.
+notebook_store = NotebookStore(
+    os.environ.get('NOTEBOOK_DIR') or (None if os.environ.get('NOTEBOOK_BACKEND') == 'tmpfs' else 'notebooks'),
+    backend=os.environ.get('NOTEBOOK_BACKEND', 'disk'),
+    max_age=float(os.environ.get('NOTEBOOK_MAX_AGE', 24 * 3600)),
+    max_files=int(os.environ.get('NOTEBOOK_MAX_FILES', 500)),
+)
+
+# Shared Claude client (connection pool reused across requests)
+claude_chat = ClaudeChat(CLAUDE_API_KEY, base_url=os.environ.get('CLAUDE_BASE_URL') or None)
+
+# Content-addressed cache of Sphinx results, shared by all worker processes
+result_cache = ResultCache(
+    os.environ.get('RESULT_CACHE_PATH', 'cache/results.sqlite3'),
+    ttl=float(os.environ.get('RESULT_CACHE_TTL', 7 * 24 * 3600)),
+    max_entries=int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 5000)),
+)
+
+# Coalesces identical concurrent Sphinx runs (keyed by the result-cache key)
+sphinx_flights = SingleFlight('sphinx')
+
+# Client deadlines (X-Request-Timeout-Ms header or "timeoutMs") are capped at
+# REQUEST_DEADLINE_CAP seconds, which also applies when none is sent (0: no cap)
+REQUEST_DEADLINE_CAP = float(os.environ.get('REQUEST_DEADLINE_CAP', 600))
+
+# Latest request per (session, kind): a new one cancels the one it supersedes
+request_sessions = SupersedeRegistry()
+
+# Cancels a request's Sphinx runs as soon as its client hangs up
+disconnect_monitor = DisconnectMonitor()
+
+# Bump whenever the analyze/rank/compare prompt templates change, so cached
+# results produced by the old wording are no longer served
+PROMPT_TEMPLATE_VERSION = 3
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+# SERVER_TIMING=1 adds a Server-Timing header with per-stage durations
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'oceancarbon_http_request_seconds', 'HTTP request latency', ('endpoint', 'method', 'status')
+)
+SPHINX_RUNS = REGISTRY.counter(
+    'oceancarbon_sphinx_runs_total', 'sphinx-cli runs by outcome (ok, error, timeout, deadline, cancelled, mock)', ('outcome',)
+)
+SPHINX_PARSE_FALLBACKS = REGISTRY.counter(
+    'oceancarbon_sphinx_parse_fallbacks_total', 'Sphinx answers returned as raw_output (no JSON found)', ('kind',)
+)
+RESULT_CACHE_LOOKUPS = REGISTRY.counter(
+    'oceancarbon_result_cache_lookups_total', 'Sphinx result cache lookups', ('kind', 'result')
+)
+
+REGISTRY.callback(
+    'oceancarbon_embedding_cache_lookups_total', 'Embedding lookups by tier',
+    lambda: {(tier,): alphaearth.stats()[field] for tier, field in
+             (('lru', 'lru_hits'), ('disk', 'disk_hits'), ('miss', 'misses'))},
+    kind='counter', labelnames=('result',)
+)
+if alphaearth_api:
+    REGISTRY.callback(
+        'oceancarbon_alphaearth_calls_total', 'AlphaEarth API calls, retries and failures',
+        lambda: {(field,): alphaearth_api.stats()[field] for field in ('calls', 'batch_calls', 'retries', 'errors')},
+        kind='counter', labelnames=('event',)
+    )
+    REGISTRY.callback(
+        'oceancarbon_alphaearth_in_flight', 'AlphaEarth API calls in flight',
+        lambda: alphaearth_api.stats()['in_flight']
+    )
+REGISTRY.callback(
+    'oceancarbon_heatmap_tile_lookups_total', 'Heatmap tile lookups (hit: cached, shared: scored by another request)',
+    lambda: {(result,): heatmap_tiles.stats()[field] for result, field in
+             (('hit', 'hits'), ('miss', 'misses'), ('shared', 'waits'))},
+    kind='counter', labelnames=('result',)
+)
+REGISTRY.callback(
+    'oceancarbon_analysis_jobs', 'Async analysis jobs by state',
+    lambda: {(state,): job_queue.stats()[state] for state in ('running', 'queued')},
+    labelnames=('state',)
+)
+REGISTRY.callback(
+    'oceancarbon_analysis_queue_capacity', 'Async analysis queue depth limit',
+    lambda: job_queue.stats()['max_depth']
+)
+REGISTRY.callback(
+    'oceancarbon_sphinx_in_flight', 'Distinct Sphinx runs in flight',
+    lambda: sphinx_flights.stats()['in_flight']
+)
+REGISTRY.callback(
+    'oceancarbon_sphinx_coalesced_total', 'Requests served by joining an identical in-flight run',
+    lambda: sphinx_flights.stats()['coalesced'], kind='counter'
+)
+REGISTRY.callback(
+    'oceancarbon_requests_cancelled_total', 'Requests cancelled before finishing, by reason',
+    lambda: {('superseded',): request_sessions.superseded, ('disconnected',): disconnect_monitor.disconnects},
+    kind='counter', labelnames=('reason',)
+)
+REGISTRY.callback(
+    'oceancarbon_notebooks_total', 'Analysis notebooks written or reused',
+    lambda: {(field,): notebook_store.stats()[field] for field in ('written', 'reused')},
+    kind='counter', labelnames=('result',)
+)
+
+
+@app.before_request
+def start_timing():
+    g.request_started = time.perf_counter()
+    start_request_timing()
+
+
+@app.after_request
+def record_timing(response):
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = server_timing_header(request_timings() or [], elapsed)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of the backend's metrics"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 
+def request_body():
+    """JSON body with any encoded embeddings decoded (see embedding_codec.py)"""
+    return decode_request_embeddings(request.json)
+
+
+@app.errorhandler(EmbeddingDecodeError)
+def embedding_decode_error(e):
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(AlphaEarthError)
+def alphaearth_error(e):
+    # Only outages fall back to the mock; a rejected lookup is reported
+    return jsonify({'error': str(e)}), 502
+
+
+def open_request_scope(kind, data):
+    """
+    Cancellation for one request: a CancelToken carrying its deadline, that is
+    cancelled when the client disconnects or the same session sends a newer
+    request of this kind
+    
+    Returns:
+        (token, close); call close() once the request is finished
+    """
+    token = CancelToken(requested_deadline(request.headers, data, REQUEST_DEADLINE_CAP))
+    session = requested_session(request.headers, data)
+    sock = client_socket(request.environ)
+    request_sessions.begin(session, kind, token)
+    if sock is not None:
+        disconnect_monitor.watch(sock, token)
+    
+    def close():
+        if sock is not None:
+            disconnect_monitor.unwatch(sock)
+        request_sessions.end(session, kind, token)
+    
+    return token, close
+
+
+def run_in_request_scope(kind, data, task):
+    """
+    jsonify(task(data, token)) under open_request_scope
+    
+    A stopped request answers 504 (deadline), 409 (superseded) or 499
+    (client gone, so nobody reads it).
+    """
+    token, close = open_request_scope(kind, data)
+    try:
+        return jsonify(task(data, token))
+    except JobCancelled:
+        return jsonify(cancelled_payload(token.reason)), cancelled_status(token.reason)
+    finally:
+        close()
+
+
+def embeddings_response(embeddings, encoding, **fields):
+    """Embeddings in the negotiated encoding: a raw body for f32/i8, else JSON with `fields`"""
+    if encoding in BINARY_ENCODINGS:
+        body, headers = encode_binary(embeddings, encoding)
+        return Response(body, mimetype=OCTET_STREAM, headers=headers)
+    return jsonify({'embeddings': encode_json(embeddings, encoding), **fields})
+
+
 @app.route('/api/get-embeddings', methods=['POST'])
 def get_embeddings():
     """
     Fetch AlphaEarth embeddings for a location
+    Send ?encoding= (or "encoding") f32, f32-base64, i8 or i8-base64 for a
+    compact format (see embedding_codec.py)
     """
     data = request.json
     lat = data.get('lat')
@@ -85,36 +382,223 @@ def get_embeddings():
         return jsonify({'error': 'Missing lat or lon'}), 400
     
     print(f"📡 Fetching embeddings for {lat}, {lon}")
-    embeddings = alphaearth.get_embeddings(lat, lon)
+    with stage('embeddings'):
+        embeddings = alphaearth.get_embeddings(lat, lon)
+    
+    encoding = negotiate_encoding(request.args, data, request.headers.get('Accept'))
+    return embeddings_response(embeddings, encoding, location={'lat': lat, 'lon': lon})
+
+
+@app.route('/api/get-embeddings-batch', methods=['POST'])
+def get_embeddings_batch():
+    """
+    Fetch AlphaEarth embeddings for many locations in one request
+
+    Body: {"locations": [{"lat": ..., "lon": ...}, ...]}, optional "encoding"
+    (raw f32/i8 bodies hold one row per location, in request order)
+    """
+    data = request.json or {}
+    locations = data.get('locations', [])
+    
+    if not isinstance(locations, list) or not locations:
+        return jsonify({'error': 'Missing locations'}), 400
+    if len(locations) > MAX_BATCH_LOCATIONS:
+        return jsonify({'error': f'At most {MAX_BATCH_LOCATIONS} locations per batch'}), 400
+    
+    try:
+        coords = [(float(loc['lat']), float(loc['lon'])) for loc in locations]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each location needs numeric lat and lon'}), 400
+    
+    print(f"📡 Fetching embeddings for {len(coords)} locations")
+    with stage('embeddings'):
+        embeddings = alphaearth.batch_get_embeddings(coords)
+    
+    encoding = negotiate_encoding(request.args, data, request.headers.get('Accept'))
+    return embeddings_response(
+        embeddings, encoding, locations=[{'lat': lat, 'lon': lon} for lat, lon in coords]
+    )
+
+
+@app.route('/api/region-embeddings', methods=['GET'])
+def region_embeddings():
+    """
+    Return a sub-window of a precomputed embedding raster
+
+    Query: region=<name>[&min_lat=&max_lat=&min_lon=&max_lon=][&format=json]
+    Default response is raw little-endian float32 (h, w, 64) streamed straight
+    from the memory map; geometry is in the X-Raster-* headers.
+    """
+    name = request.args.get('region')
+    raster = region_rasters.get(name) if name else None
+    if raster is None:
+        return jsonify({
+            'error': f'Unknown region: {name}',
+            'available': region_rasters.describe()
+        }), 404
+    
+    try:
+        bounds = (
+            float(request.args.get('min_lat', raster.min_lat)),
+            float(request.args.get('max_lat', raster.max_lat)),
+            float(request.args.get('min_lon', raster.min_lon)),
+            float(request.args.get('max_lon', raster.max_lon)),
+        )
+    except ValueError:
+        return jsonify({'error': 'Bounds must be numeric'}), 400
+    if bounds[0] > bounds[1] or bounds[2] > bounds[3]:
+        return jsonify({'error': 'min_lat/min_lon must not exceed max_lat/max_lon'}), 400
+    
+    r0, r1, c0, c1 = raster.window_bounds(*bounds)
+    if r0 == r1 or c0 == c1:
+        return jsonify({
+            'error': f'Bounds contain no cells of region {name}',
+            'region': raster.describe()
+        }), 404
+    
+    window = raster.window(*bounds)
+    geometry = raster.window_geometry(*bounds)
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'region': name, **geometry, 'embeddings': window.tolist()})
+    
+    def stream_rows():
+        # Each row of the window is one contiguous run of the memory map
+        for row in window:
+            yield memoryview(row)
+    
+    headers = {
+        'X-Raster-Shape': ','.join(str(v) for v in geometry['shape']),
+        'X-Raster-Bbox': ','.join(str(v) for v in geometry['bbox']),
+        'X-Raster-Resolution': str(geometry['resolution']),
+        'X-Raster-Dtype': '<f4',
+        'Access-Control-Expose-Headers': 'X-Raster-Shape, X-Raster-Bbox, X-Raster-Resolution, X-Raster-Dtype',
+    }
+    return Response(stream_rows(), mimetype='application/octet-stream', headers=headers)
+
+
+def heatmap_bbox(args):
+    """
+    (min_lat, max_lat, min_lon, max_lon) from ?region= (a raster preset or
+    loaded raster) or ?min_lat=&max_lat=&min_lon=&max_lon=
+    
+    Raises:
+        KeyError for an unknown region or missing bounds, ValueError for bad bounds
+    """
+    name = args.get('region')
+    if name:
+        if name in RASTER_PRESETS:
+            return tuple(RASTER_PRESETS[name]['bbox'])
+        raster = region_rasters.get(name)
+        if raster is None:
+            raise KeyError(name)
+        return raster.min_lat, raster.max_lat, raster.min_lon, raster.max_lon
+    
+    try:
+        bbox = tuple(float(args[field]) for field in ('min_lat', 'max_lat', 'min_lon', 'max_lon'))
+    except ValueError:
+        raise ValueError('Bounds must be numeric') from None
+    if not (-90 <= bbox[0] < bbox[1] <= 90 and -180 <= bbox[2] < bbox[3] <= 180):
+        raise ValueError('bbox must be min_lat < max_lat, min_lon < max_lon in degrees')
+    return bbox
+
+
+@app.route('/api/heatmap', methods=['GET'])
+def heatmap():
+    """
+    Suitability heatmap over a region as uint8-quantized web map tiles
+    
+    Query: region=<name> or min_lat=&max_lat=&min_lon=&max_lon=,
+           zoom=<z>[,<z>...], projectType=<name>
+    Each tile is tileSize x tileSize cells (rows north to south) encoded as
+    base64 uint8; score = value * scale. Tiles follow Leaflet's z/x/y scheme
+    and are cached per project type, so panning and zooming over a region
+    only scores cells not seen before.
+    """
+    project_type = request.args.get('projectType')
+    try:
+        bbox = heatmap_bbox(request.args)
+    except KeyError:
+        if not request.args.get('region'):
+            return jsonify({'error': 'Send region or min_lat, max_lat, min_lon and max_lon'}), 400
+        return jsonify({
+            'error': f"Unknown region: {request.args.get('region')}",
+            'available': sorted(set(RASTER_PRESETS) | set(region_rasters.rasters))
+        }), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        zooms = sorted({int(z) for z in request.args.get('zoom', '').split(',') if z.strip()})
+    except ValueError:
+        zooms = None
+    if not zooms or zooms[0] < 0 or zooms[-1] > MAX_HEATMAP_ZOOM:
+        return jsonify({'error': f'zoom must list levels between 0 and {MAX_HEATMAP_ZOOM}'}), 400
+    
+    positions = [tile for zoom in zooms for tile in tiles_for_bbox(bbox, zoom)]
+    if len(positions) > MAX_HEATMAP_TILES:
+        return jsonify({
+            'error': f'{len(positions)} tiles requested; at most {MAX_HEATMAP_TILES} per request (lower the zoom)'
+        }), 400
+    
+    with stage('heatmap'):
+        tiles, stats = heatmap_tiles.get_tiles(positions, project_type)
+    print(f"🗺️  Heatmap: {stats['tiles']} tiles ({stats['scored']} scored, {stats['cached']} cached)")
     
     return jsonify({
-        'embeddings': embeddings,
-        'location': {'lat': lat, 'lon': lon}
+        'projectType': project_type,
+        'bbox': list(bbox),
+        'zooms': zooms,
+        'tileSize': heatmap_tiles.tile_size,
+        'encoding': 'u8-base64',
+        'scale': SCORE_SCALE,
+        'tiles': [
+            {
+                'z': z, 'x': x, 'y': y,
+                'bounds': tile_bounds(z, x, y),
+                'data': base64.b64encode(tiles[(z, x, y)].tobytes()).decode('ascii')
+            }
+            for z, x, y in positions
+        ],
+        'stats': stats
     })
 
 
-@app.route('/api/analyze-site', methods=['POST'])
-def analyze_site():
+@app.route('/api/heatmap/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def heatmap_tile(z, x, y):
     """
-    Analyze a single site using Sphinx AI
+    One heatmap tile as raw uint8 bytes (tileSize^2, rows north to south),
+    for a map layer that fetches tiles itself. Query: projectType=<name>
     """
-    data = request.json
+    if not 0 <= z <= MAX_HEATMAP_ZOOM or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+        return jsonify({'error': 'No such tile'}), 404
     
+    tiles, _ = heatmap_tiles.get_tiles([(z, x, y)], request.args.get('projectType'))
+    headers = {
+        'X-Tile-Size': str(heatmap_tiles.tile_size),
+        'X-Score-Scale': repr(SCORE_SCALE),
+        'Cache-Control': 'public, max-age=3600',
+        'Access-Control-Expose-Headers': 'X-Tile-Size, X-Score-Scale',
+    }
+    return Response(tiles[(z, x, y)].tobytes(), mimetype='application/octet-stream', headers=headers)
+
+
+def analyze_site_request(data):
+    """
+    Analysis kind, cache inputs, notebook factory and prompt for a single site
+    """
     embeddings = data.get('embeddings')
     location = data.get('location')
     project_type = data.get('projectType')
     
     print(f"🤖 Analyzing site: {location} for {project_type}")
     
-    # Create notebook with data
-    notebook_path = create_analysis_notebook(embeddings, location, project_type)
-    
     # Create Sphinx prompt
     prompt = f"""
 Analyze this ocean site for {project_type}:
 
 Location: {location['lat']}, {location['lon']}
-AlphaEarth Embeddings: 64-dimensional vector (first 10 values: {embeddings[:10]})
+AlphaEarth Embeddings: 64-dimensional vector (first 10 values: {embedding_preview(embeddings, 10)})
 
 Tasks:
 1. Interpret what these embeddings likely represent in terms of ocean conditions
@@ -148,32 +632,191 @@ Return results as JSON:
 IMPORTANT: Return ONLY valid JSON, no additional text.
 """
     
-    # Run Sphinx analysis
-    result = run_sphinx_analysis(notebook_path, prompt)
+    # Notebook is only written on a cache miss
+    return (
+        'analyze-site',
+        {'embeddings': embeddings, 'location': location, 'projectType': project_type},
+        lambda: create_analysis_notebook(embeddings, location, project_type),
+        prompt
+    )
+
+
+def analyze_site_task(data, token=None):
+    """
+    Analyze a single site using Sphinx AI
+    """
+    return cached_sphinx_analysis(*analyze_site_request(data), data, token)
+
+
+def analyze_sites_batch_request(sites, keys, project_type):
+    """
+    Analysis kind, coalescing inputs, notebook factory and prompt for one
+    keyed batch of single-site analyses
+    
+    sites must carry embeddings; keys[i] is the key of sites[i].
+    """
+    rows = [
+        {'key': key, 'name': site.get('name'), 'lat': site['lat'], 'lon': site['lon']}
+        for key, site in zip(keys, sites)
+    ]
+    prompt_rows = [
+        {**row, 'embeddings': embedding_preview(site['embeddings'], 5)}
+        for row, site in zip(rows, sites)
+    ]
+    
+    print(f"🤖 Analyzing {len(sites)} sites in one batch for {project_type}")
     
-    return jsonify(result)
+    prompt = f"""
+Analyze each of these {len(sites)} ocean sites for {project_type}.
 
+Each site has a key; row i of the notebook's embeddings array belongs to
+row i of its sites table. First embedding values per site:
 
-@app.route('/api/rank-sites', methods=['POST'])
-def rank_sites():
+{json.dumps(prompt_rows, separators=(',', ':'))}
+
+For every site:
+1. Interpret what its embeddings likely represent in terms of ocean conditions
+2. Map them to oceanographic metrics: water temperature (°C), chlorophyll
+   concentration (mg/m³), wave energy index (0-10), water depth (m), nutrient
+   levels (Low/Medium/High) and pH
+3. Calculate a suitability score (0-100) for {project_type}
+4. Identify the top 3 strengths and any concerns
+5. Provide a deployment recommendation
+
+Return ONE JSON object with an entry for every site key:
+{{
+    "<key>": {{
+        "score": <number 0-100>,
+        "metrics": {{
+            "temperature": <value>,
+            "chlorophyll": <value>,
+            "wave_energy": <value>,
+            "depth": <value>,
+            "nutrients": <string>,
+            "ph": <value>
+        }},
+        "strengths": [<list of 3 strings>],
+        "concerns": [<list of strings>],
+        "recommendation": <string>
+    }},
+    ...
+}}
+
+IMPORTANT: Return ONLY valid JSON, no additional text.
+"""
+    
+    notebook_sites = [{**row, 'embeddings': site['embeddings']} for row, site in zip(rows, sites)]
+    return (
+        'analyze-sites-batch',
+        {'sites': site_cache_inputs(notebook_sites), 'keys': keys, 'projectType': project_type},
+        lambda: create_batch_analysis_notebook(notebook_sites, project_type),
+        prompt
+    )
+
+
+def sphinx_batch_session(kind, inputs, create_notebook, prompt, token=None):
+    """One Sphinx session for a batch request (coalesced, not cached as a whole)"""
+    def run():
+        with stage('notebook'):
+            notebook_path = create_notebook()
+        try:
+            return run_sphinx_analysis(notebook_path, prompt, token, kind)
+        finally:
+            notebook_store.release(notebook_path)
+    
+    result, _ = coalesced_sphinx_run(result_cache.make_key(kind, PROMPT_TEMPLATE_VERSION, inputs), kind, run, token)
+    return result
+
+
+def analyze_sites_batch_task(data, token=None, run_session=None):
     """
-    Rank multiple sites using Sphinx AI
+    Analyze many sites through keyed batch Sphinx sessions
+    
+    Each site is looked up (and stored) under the same result-cache key as
+    a single /api/analyze-site call, so only uncached sites reach Sphinx.
+    run_session(kind, inputs, create_notebook, prompt) runs one session
+    (default: sphinx_batch_session).
     """
-    data = request.json
+    run_session = run_session or (lambda *batch_request: sphinx_batch_session(*batch_request, token))
     sites = data.get('sites', [])
     project_type = data.get('projectType')
+    keys = batch_keys(sites)
+    embeddings = site_embedding_matrix(sites)
+    by_key = {}
+    for i, key in enumerate(keys):
+        location = {'lat': float(sites[i]['lat']), 'lon': float(sites[i]['lon'])}
+        inputs = {'embeddings': embeddings[i], 'location': location, 'projectType': project_type}
+        by_key[key] = {
+            'site': {**sites[i], 'embeddings': embeddings[i].tolist()},
+            'location': location,
+            'cacheKey': result_cache.make_key('analyze-site', PROMPT_TEMPLATE_VERSION, inputs)
+        }
     
-    print(f"🚀 Ranking {len(sites)} sites for {project_type}")
+    results = {}
+    if data.get('bypassCache'):
+        result_cache.record_bypass()
+    else:
+        for key, entry in by_key.items():
+            cached = result_cache.get(entry['cacheKey'])
+            RESULT_CACHE_LOOKUPS.inc(kind='analyze-sites-batch', result='hit' if cached is not None else 'miss')
+            if cached is not None:
+                results[key] = {**cached, 'cached': True}
+    
+    def run_batch(chunk_keys):
+        if not SPHINX_API_KEY:
+            mock = mock_sphinx_result()
+            return {'success': True, 'data': {key: mock['data'] for key in chunk_keys}}
+        return run_session(*analyze_sites_batch_request(
+            [by_key[key]['site'] for key in chunk_keys], chunk_keys, project_type
+        ))
+    
+    pending = [key for key in keys if key not in results]
+    answers, errors, stats = analyze_batch(
+        pending,
+        run_batch,
+        batch_size=max(1, int(data.get('batchSize') or ANALYZE_BATCH_SIZE)),
+        max_parallel=SPHINX_MAX_PARALLEL,
+        retries=ANALYZE_BATCH_RETRIES,
+        token=token
+    )
+    for key, answer in answers.items():
+        result = {'success': True, 'data': answer}
+        if SPHINX_API_KEY:
+            result_cache.put(by_key[key]['cacheKey'], 'analyze-site', result)
+        else:
+            result['mock'] = True  # stand-in answers are never cached
+        results[key] = {**result, 'cached': False}
+    for key, error in errors.items():
+        results[key] = {'success': False, 'error': error}
+    
+    print(f"✅ Batch of {len(sites)} sites: {len(sites) - len(pending)} cached, "
+          f"{stats['sphinxRuns']} Sphinx runs, {stats['failed']} failed")
+    return {
+        'success': True,
+        'projectType': project_type,
+        'results': [
+            {'key': key, 'name': by_key[key]['site'].get('name'), 'location': by_key[key]['location'], **results[key]}
+            for key in keys
+        ],
+        'stats': {'sites': len(sites), 'cached': len(sites) - len(pending), **stats}
+    }
+
+
+def rank_sites_request(data):
+    """
+    Analysis kind, cache inputs, notebook factory and prompt for a ranking
+    """
+    sites = data.get('sites', [])
+    project_type = data.get('projectType')
     
-    # Create notebook for ranking
-    notebook_path = create_ranking_notebook(sites, project_type)
+    print(f"🚀 Ranking {len(sites)} sites for {project_type}")
     
     # Create Sphinx prompt
     prompt = f"""
 Rank these {len(sites)} ocean sites for {project_type} deployment.
 
 Sites with embeddings:
-{json.dumps([{{'name': s['name'], 'lat': s['lat'], 'lon': s['lon'], 'embeddings_preview': s['embeddings'][:5]}} for s in sites], indent=2)}
+{json.dumps([{'name': s['name'], 'lat': s['lat'], 'lon': s['lon'], 'embeddings_preview': embedding_preview(s['embeddings'], 5)} for s in sites], indent=2)}
 
 For each site:
 1. Analyze its AlphaEarth embeddings to extract ocean metrics
@@ -199,34 +842,114 @@ Return a ranked list (best to worst) as JSON array:
 IMPORTANT: Return ONLY valid JSON array, no additional text.
 """
     
-    # Run Sphinx analysis
-    result = run_sphinx_analysis(notebook_path, prompt)
-    
-    return jsonify(result)
+    # Notebook is only written on a cache miss
+    return (
+        'rank-sites',
+        {'sites': site_cache_inputs(sites), 'projectType': project_type},
+        lambda: create_ranking_notebook(sites, project_type),
+        prompt
+    )
 
 
-@app.route('/api/compare-sites', methods=['POST'])
-def compare_sites():
+def rank_sites_task(data, token=None):
     """
-    Compare 2-5 sites side-by-side
+    Rank multiple sites using Sphinx AI
+    """
+    return cached_sphinx_analysis(*rank_sites_request(data), data, token)
+
+
+def rank_sites_sharded_task(data, token=None):
+    """
+    Rank a large site list as parallel Sphinx shards merged into one order
+    
+    Optional body fields: shardSize, topK (cut-off protected by the
+    tie-break pass), tieMargin.
     """
-    data = request.json
     sites = data.get('sites', [])
     project_type = data.get('projectType')
+    shard_size = max(2, int(data.get('shardSize') or RANK_SHARD_SIZE))
     
-    if len(sites) < 2 or len(sites) > 5:
-        return jsonify({'error': 'Can only compare 2-5 sites'}), 400
+    embeddings = site_embedding_matrix(sites)
+    sites = [{**site, 'embeddings': embeddings[i].tolist()} for i, site in enumerate(sites)]
+    prescores = [site['score'] for site in score_sites_local(sites, embeddings, project_type)]
     
-    print(f"🔄 Comparing {len(sites)} sites")
+    def rank_shard(shard_sites):
+        # Each shard goes through the result cache and single-flight like any ranking
+        return rank_sites_task({**data, 'sites': shard_sites}, token)
+    
+    return sharded_rank(
+        sites,
+        rank_shard,
+        prescores,
+        shard_size=shard_size,
+        max_parallel=SPHINX_MAX_PARALLEL,
+        top_k=int(data.get('topK') or 10),
+        tie_margin=float(data.get('tieMargin') or 2.0),
+        token=token
+    )
+
+
+def rank_task_for(data):
+    """Single-prompt ranking for short lists, sharded ranking past RANK_SHARD_SIZE sites"""
+    sites = data.get('sites', [])
+    if len(sites) > RANK_SHARD_SIZE and not data.get('noShard'):
+        return rank_sites_sharded_task
+    return rank_sites_task
+
+
+def compare_sites_prepare(data):
+    """
+    Sites with embeddings attached, and the local comparison (scoring.py)
+    
+    Sites sent without embeddings are fetched in one batch.
+    """
+    sites = data.get('sites', [])
+    embeddings = site_embedding_matrix(sites)
+    sites = [{**site, 'embeddings': embeddings[i].tolist()} for i, site in enumerate(sites)]
+    return sites, compare_sites_local(sites, embeddings, data.get('projectType'))
+
+
+def comparison_prompt_summary(sites, local):
+    """Compact JSON of the local comparison for the prompt (no raw embeddings)"""
+    summary = {
+        'sites': [
+            {
+                'name': label,
+                'lat': round(float(site['lat']), 4) if site.get('lat') is not None else None,
+                'lon': round(float(site['lon']), 4) if site.get('lon') is not None else None,
+                **local['comparison_table'][label]
+            }
+            for site, label in zip(sites, local['sites'])
+        ],
+        'metric_deltas': local['metric_deltas'],
+        'best_for': local['best_for'],
+        'similarity': local['similarity'],
+    }
+    return json.dumps(summary, separators=(',', ':'))
+
+
+def compare_sites_request(data, prepared=None):
+    """
+    Analysis kind, cache inputs, notebook factory and prompt for a comparison
+    
+    The prompt carries the precomputed comparison instead of the raw sites
+    and embeddings; the notebook still has the full data.
+    """
+    sites, local = prepared or compare_sites_prepare(data)
+    project_type = data.get('projectType')
     
-    notebook_path = create_comparison_notebook(sites, project_type)
+    print(f"🔄 Comparing {len(sites)} sites")
     
     prompt = f"""
-Compare these {len(sites)} ocean sites for {project_type}:
+Compare these {len(sites)} ocean sites for {project_type}.
 
-{json.dumps(sites, indent=2)}
+Local pre-analysis from the AlphaEarth embeddings (scores are 0-100 for
+{project_type}; metric_deltas are relative to the top-scoring site;
+similarity is the cosine similarity between site embeddings, in site order):
 
-Provide:
+{comparison_prompt_summary(sites, local)}
+
+Verify these figures against the notebook data, then provide:
 1. Side-by-side metric comparison
 2. Best site for specific conditions (e.g., "Best for protected waters")
 3. Trade-offs between sites
@@ -247,38 +970,658 @@ Return as JSON:
 IMPORTANT: Return ONLY valid JSON, no additional text.
 """
     
-    result = run_sphinx_analysis(notebook_path, prompt)
+    return (
+        'compare-sites',
+        {'sites': site_cache_inputs(sites), 'projectType': project_type},
+        lambda: create_comparison_notebook(sites, project_type),
+        prompt
+    )
+
+
+def compare_sites_task(data, token=None, prepared=None):
+    """
+    Compare 2-5 sites side-by-side
     
-    return jsonify(result)
+    The Sphinx result carries the local comparison under 'local'.
+    """
+    prepared = prepared or compare_sites_prepare(data)
+    result = cached_sphinx_analysis(*compare_sites_request(data, prepared), data, token)
+    return {**result, 'local': prepared[1]}
 
 
-@app.route('/api/chat', methods=['POST'])
-def chat_with_claude():
+@app.route('/api/similar-sites', methods=['POST'])
+def similar_sites():
     """
-    Chat endpoint using Claude API for ocean site questions
+    Find the k ocean locations whose embeddings are closest to a site
+    
+    Body: {"lat": ..., "lon": ...} or {"embeddings": [...]}, optional "k" (default 10)
     """
-    data = request.json
-    messages = data.get('messages', [])
-    context = data.get('context', {})
+    data = request_body() or {}
+    k = min(int(data.get('k', 10)), MAX_SIMILAR_SITES)
+    lat, lon = data.get('lat'), data.get('lon')
     
-    if not CLAUDE_API_KEY:
-        return jsonify({
-            'success': False,
-            'message': 'Claude API key not configured. Please add CLAUDE_API_KEY to your .env file.'
-        }), 500
+    if data.get('embeddings') is not None:
+        embedding = np.asarray(data['embeddings'], dtype=np.float32)
+        if embedding.shape != (EMBEDDING_DIM,):
+            return jsonify({'error': f'embeddings must have {EMBEDDING_DIM} values'}), 400
+    elif lat is not None and lon is not None:
+        embedding = alphaearth.get_embeddings(float(lat), float(lon))
+    else:
+        return jsonify({'error': 'Provide lat and lon, or embeddings'}), 400
+    
+    if not similarity_index.ready:
+        print("🧭 Building similarity index...")
+    index = similarity_index.get()
+    
+    exclude = (float(lat), float(lon)) if lat is not None and lon is not None else None
+    matches = index.query(embedding, k=k, exclude_coord=exclude)
+    print(f"🧭 Found {len(matches)} sites similar to {exclude or 'embedding'}")
+    
+    return jsonify({
+        'query': {'lat': lat, 'lon': lon},
+        'k': k,
+        'results': matches
+    })
+
+
+@app.route('/api/analyze-site', methods=['POST'])
+def analyze_site():
+    """
+    Analyze a single site using Sphinx AI
+    Send {"async": true} to get a job id back instead of waiting
+    """
+    data = request_body()
     
+    if data.get('async'):
+        return submit_job('analyze-site', analyze_site_task, data)
+    return run_in_request_scope('analyze-site', data, analyze_site_task)
+
+
+def validate_batch_sites(sites):
+    """Error message for an unusable batch, or None"""
+    if not sites:
+        return 'No sites provided'
+    if len(sites) > MAX_ANALYZE_BATCH_SITES:
+        return f'At most {MAX_ANALYZE_BATCH_SITES} sites per batch'
     try:
-        import anthropic
-        
-        client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
-        
-        # Build system prompt with context
-        system_prompt = f"""You are an expert ocean scientist and AI assistant for OceanCarbon AI, a tool that helps scientists find optimal sites for ocean carbon removal projects.
+        for site in sites:
+            float(site['lat']), float(site['lon'])
+    except (KeyError, TypeError, ValueError):
+        return 'Each site needs numeric lat and lon'
+    try:
+        batch_keys(sites)
+    except ValueError as e:
+        return str(e)
+    return None
 
-Current Context:
-- Region: {context.get('region', 'Not selected')}
-- Project Type: {context.get('projectType', 'Not selected')}
-- Analysis Status: {'Completed' if context.get('analysisResults') else 'Not run yet'}
+
+@app.route('/api/analyze-sites-batch', methods=['POST'])
+def analyze_sites_batch():
+    """
+    Analyze many sites in shared Sphinx sessions
+    
+    Body: {"sites": [{"id"?, "name"?, "lat", "lon", "embeddings"?}], "projectType"}
+    Results come back in site order, each keyed by the site's id (or its
+    position) and shaped like an /api/analyze-site response.
+    Send {"async": true} to get a job id back instead of waiting
+    """
+    data = request_body()
+    error = validate_batch_sites(data.get('sites', []))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    if data.get('async'):
+        return submit_job('analyze-sites-batch', analyze_sites_batch_task, data)
+    return run_in_request_scope('analyze-sites-batch', data, analyze_sites_batch_task)
+
+
+@app.route('/api/rank-sites', methods=['POST'])
+def rank_sites():
+    """
+    Rank multiple sites using Sphinx AI
+    Send {"async": true} to get a job id back instead of waiting
+    Send {"mode": "fast"} (or ?mode=fast) to rank locally without Sphinx
+    Send {"stream": "ndjson" | "sse"} (or ?stream=) for incremental results
+    Embeddings may be encoded objects, or one "siteEmbeddings" matrix (row i
+    for sites[i]); see embedding_codec.py
+    """
+    data = request_body()
+    
+    stream_format = requested_stream_format(data)
+    if stream_format:
+        return rank_sites_streaming(data, stream_format, request.args.get('mode') or data.get('mode'))
+    
+    if (request.args.get('mode') or data.get('mode')) == 'fast':
+        return rank_sites_fast(data)
+    
+    if data.get('async'):
+        return submit_job('rank-sites', rank_task_for(data), data)
+    return run_in_request_scope('rank-sites', data, rank_task_for(data))
+
+
+@app.route('/api/compare-sites', methods=['POST'])
+def compare_sites():
+    """
+    Compare 2-5 sites side-by-side
+    
+    The comparison table, metric deltas, "best for" table and embedding
+    similarities are computed locally first and returned under 'local'.
+    Send {"async": true} to get them at once with a job id for the narrative
+    Send {"mode": "fast"} (or ?mode=fast) for the local comparison only
+    Send {"stream": "ndjson" | "sse"} (or ?stream=) for a 'local' event
+    followed by the Sphinx 'final' event
+    """
+    data = request_body()
+    sites = data.get('sites', [])
+    
+    if len(sites) < 2 or len(sites) > 5:
+        return jsonify({'error': 'Can only compare 2-5 sites'}), 400
+    
+    try:
+        prepared = compare_sites_prepare(data)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each site needs embeddings or numeric lat and lon'}), 400
+    local = prepared[1]
+    
+    stream_format = requested_stream_format(data)
+    if stream_format:
+        return compare_sites_streaming(data, prepared, stream_format)
+    
+    if (request.args.get('mode') or data.get('mode')) == 'fast':
+        return jsonify({'success': True, 'mode': 'fast', 'data': local})
+    
+    if data.get('async'):
+        return submit_job(
+            'compare-sites',
+            lambda body, token=None: compare_sites_task(body, token, prepared),
+            data,
+            local=local
+        )
+    return run_in_request_scope(
+        'compare-sites', data, lambda body, token: compare_sites_task(body, token, prepared)
+    )
+
+
+def compare_sites_streaming(data, prepared, stream_format):
+    """
+    Stream a comparison as NDJSON lines or server-sent events
+    
+    Events, in order:
+      local  the local comparison (scoring.compare_sites_local)
+      final  the Sphinx comparison
+      done
+    """
+    token, close = open_request_scope('compare-sites', data)
+    
+    def generate():
+        yield stream_event(stream_format, 'local', {'source': 'local', 'data': prepared[1]})
+        try:
+            result = compare_sites_task(data, token, prepared)
+            yield stream_event(stream_format, 'final', {'source': 'sphinx', 'result': result})
+        except JobCancelled:
+            yield stream_event(stream_format, 'error', cancelled_payload(token.reason))
+        except Exception as e:
+            print(f"❌ Streaming comparison failed: {e}")
+            yield stream_event(stream_format, 'error', {'error': str(e)})
+        yield stream_event(stream_format, 'done', {})
+    
+    response = stream_response(generate(), stream_format)
+    response.call_on_close(close)
+    return response
+
+
+def site_embedding_matrix(sites):
+    """(N, 64) embeddings for sites, fetching any that were sent without them"""
+    matrix = np.empty((len(sites), EMBEDDING_DIM), dtype=np.float32)
+    missing = []
+    for i, site in enumerate(sites):
+        if site.get('embeddings') is not None:
+            matrix[i] = site['embeddings']
+        else:
+            missing.append(i)
+    if missing:
+        with stage('embeddings'):
+            matrix[missing] = alphaearth.batch_get_embeddings(
+                [(float(sites[i]['lat']), float(sites[i]['lon'])) for i in missing]
+            )
+    return matrix
+
+
+def fast_rank_options(data):
+    """
+    (limit or None, narrativeTopK) for a fast ranking
+    
+    Raises:
+        ValueError, TypeError: unless both are non-negative integers
+    """
+    limit = data.get('limit')
+    limit = int(limit) if limit not in (None, '') else None
+    top_k = int(data.get('narrativeTopK') or 0)
+    if (limit is not None and limit < 0) or top_k < 0:
+        raise ValueError('negative limit or narrativeTopK')
+    return limit, top_k
+
+
+def narrative_sites(sites, embeddings, ranked, top_k):
+    """The top K ranked sites with their embeddings, picked by input index"""
+    return [
+        {**sites[site['index']], 'embeddings': embeddings[site['index']].tolist()}
+        for site in ranked[:top_k]
+    ]
+
+
+def rank_sites_fast(data):
+    """
+    Rank sites with the local scoring engine (scoring.py)
+    
+    Sites may omit embeddings; they are fetched in one batch. Optional
+    "narrativeTopK": K sends only the top K sites to Sphinx for a written
+    analysis (returned under 'narrative', or as 'narrativeJob' with async).
+    """
+    sites = data.get('sites', [])
+    project_type = data.get('projectType')
+    
+    try:
+        limit, top_k = fast_rank_options(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit and narrativeTopK must be non-negative integers'}), 400
+    
+    try:
+        embeddings = site_embedding_matrix(sites)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each site needs embeddings or numeric lat and lon'}), 400
+    
+    ranked = rank_sites_local(sites, embeddings, project_type, limit=limit)
+    print(f"⚡ Fast-ranked {len(sites)} sites for {project_type}")
+    
+    response = {'success': True, 'mode': 'fast', 'data': ranked}
+    
+    if top_k > 0 and ranked:
+        narrative_request = {**data, 'sites': narrative_sites(sites, embeddings, ranked, top_k)}
+        if data.get('async'):
+            try:
+                job = job_queue.submit('rank-sites', lambda token: rank_sites_task(narrative_request, token))
+                response['narrativeJob'] = job.to_dict()
+            except QueueFull as e:
+                response['narrativeJob'] = {'error': 'Analysis queue is full', 'retryAfter': e.retry_after}
+        else:
+            response['narrative'] = rank_sites_task(narrative_request)
+    
+    return jsonify(response)
+
+
+def rank_sites_streaming(data, stream_format, mode=None):
+    """
+    Stream a ranking as NDJSON lines or server-sent events
+    
+    Events, in order:
+      start    {total, projectType}
+      site     one per site as soon as it is scored locally (index, name, score, metrics)
+      ranking  the local ordering of all sites
+      final    the Sphinx ranking (skipped with mode=fast, where 'ranking' is final)
+      done
+    """
+    sites = data.get('sites', [])
+    project_type = data.get('projectType')
+    token, close = open_request_scope('rank-sites', data)
+    
+    def encode(event_type, payload):
+        return stream_event(stream_format, event_type, payload)
+    
+    def generate():
+        yield encode('start', {'total': len(sites), 'projectType': project_type})
+        
+        try:
+            embeddings = np.empty((len(sites), EMBEDDING_DIM), dtype=np.float32)
+            # Score in chunks so the first sites reach the client before the rest are fetched
+            for start in range(0, len(sites), STREAM_CHUNK_SIZE):
+                chunk = sites[start:start + STREAM_CHUNK_SIZE]
+                embeddings[start:start + len(chunk)] = site_embedding_matrix(chunk)
+                scored = score_sites_local(chunk, embeddings[start:start + len(chunk)], project_type)
+                for offset, site in enumerate(scored):
+                    yield encode('site', {'index': start + offset, **site})
+            
+            ranked = rank_sites_local(sites, embeddings, project_type)
+            yield encode('ranking', {'source': 'local', 'data': ranked})
+            
+            if mode != 'fast' and sites:
+                sites_with_embeddings = [
+                    {**site, 'embeddings': embeddings[i].tolist()} for i, site in enumerate(sites)
+                ]
+                final_request = {**data, 'sites': sites_with_embeddings}
+                result = rank_task_for(final_request)(final_request, token)
+                yield encode('final', {'source': 'sphinx', 'result': result})
+        except JobCancelled:
+            yield encode('error', cancelled_payload(token.reason))
+        except Exception as e:
+            print(f"❌ Streaming ranking failed: {e}")
+            yield encode('error', {'error': str(e)})
+        
+        yield encode('done', {})
+    
+    response = stream_response(generate(), stream_format)
+    response.call_on_close(close)
+    return response
+
+
+def requested_stream_format(data):
+    """'ndjson', 'sse' or None from ?stream= / body "stream" (true picks by Accept)"""
+    stream_format = request.args.get('stream') or data.get('stream')
+    if stream_format is True:
+        stream_format = 'sse' if 'text/event-stream' in request.headers.get('Accept', '') else 'ndjson'
+    return stream_format or None
+
+
+def stream_event(stream_format, event_type, payload):
+    """One NDJSON line or server-sent event"""
+    body = json.dumps({'type': event_type, **payload})
+    if stream_format == 'sse':
+        return f"event: {event_type}\ndata: {body}\n\n"
+    return body + '\n'
+
+
+def stream_response(events, stream_format):
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    # X-Accel-Buffering stops nginx-style proxies from holding the stream back
+    return Response(events, mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# ============================================================================
+# RANKING SESSIONS
+# ============================================================================
+
+def session_view(data):
+    """(offset, limit, narrativeTopK) from the body or query string"""
+    def value(name):
+        return data.get(name, request.args.get(name))
+    limit = value('limit')
+    return int(value('offset') or 0), (int(limit) if limit not in (None, '') else None), int(value('narrativeTopK') or 0)
+
+
+def session_narrative(session, top_k, token=None):
+    """
+    Sphinx write-up of the session's top K sites
+    
+    Reused from the session while the top K (ids and scores) is unchanged;
+    otherwise ranked through the result cache like any rank-sites request.
+    """
+    with session.lock:
+        signature = session.top_signature(top_k)
+        if session.narrative_signature == signature:
+            return {**session.narrative, 'fromSession': True}
+        top_sites = [{**site, 'embeddings': site['embeddings'].tolist()} for site in session.top_sites(top_k)]
+    
+    result = rank_sites_task({'sites': top_sites, 'projectType': signature[0]}, token)
+    if is_cacheable_result(result):
+        with session.lock:
+            if session.top_signature(top_k) == signature:
+                session.narrative, session.narrative_signature = result, signature
+    return {**result, 'fromSession': False}
+
+
+def ranking_session_response(session, data, changes=None, status=200):
+    """
+    The session's ranking (a window of it with offset/limit), served from
+    session state; narrativeTopK adds the Sphinx write-up of the top K
+    """
+    try:
+        offset, limit, top_k = session_view(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'offset, limit and narrativeTopK must be integers'}), 400
+    
+    with session.lock:
+        body = {
+            'success': True,
+            **session.describe(),
+            'offset': offset,
+            'data': session.ranking(offset, limit)
+        }
+        if changes is not None:
+            body['changes'] = changes
+    
+    if top_k <= 0 or not body['sites']:
+        return jsonify(body), status
+    response = run_in_request_scope(
+        'rank-sessions', data, lambda _, token: {**body, 'narrative': session_narrative(session, top_k, token)}
+    )
+    return response if isinstance(response, tuple) else (response, status)
+
+
+@app.route('/api/rank-sessions', methods=['POST'])
+def create_ranking_session():
+    """
+    Start an incremental ranking session
+    
+    Body: {"sites": [{"id"?, "name", "lat", "lon", "embeddings"?}], "projectType",
+           "siteEmbeddings"?, "offset"?, "limit"?, "narrativeTopK"?}
+    Sites are keyed by id (else name). Sites are scored locally once; later
+    edits (PATCH) rescore only the sites they touch.
+    """
+    data = request.json or {}
+    try:
+        check_sites(data.get('sites', []))
+        data = decode_request_embeddings(data)
+        with stage('rank_session'):
+            session = ranking_sessions.create(data.get('projectType'), site_embedding_matrix, data.get('sites', []))
+    except SessionError as e:
+        return jsonify({'error': str(e)}), 400
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each site needs embeddings or numeric lat and lon'}), 400
+    
+    print(f"📋 Ranking session {session.id[:8]} started with {len(session)} sites")
+    response, status = ranking_session_response(session, data, status=201)
+    if status == 201:
+        response.headers['Location'] = f'/api/rank-sessions/{session.id}'
+    return response, status
+
+
+@app.route('/api/rank-sessions/<session_id>', methods=['GET'])
+def get_ranking_session(session_id):
+    """The current ranking, straight from session state (?offset=&limit=&narrativeTopK=)"""
+    session = ranking_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired ranking session'}), 404
+    return ranking_session_response(session, {})
+
+
+@app.route('/api/rank-sessions/<session_id>', methods=['PATCH'])
+def edit_ranking_session(session_id):
+    """
+    Edit a session's site list
+    
+    Body: {"add": [sites], "remove": [ids], "update": [{"id", ...changed fields}],
+           "projectType"?, "offset"?, "limit"?, "narrativeTopK"?}
+    Only added sites and updated sites whose location or embeddings changed
+    are scored (all sites if projectType changes); each is bisected into the
+    order. The response lists the new rank of every added or updated site.
+    """
+    session = ranking_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired ranking session'}), 404
+    
+    data = request.json or {}
+    add = decode_request_embeddings({'sites': data.get('add') or []})['sites']
+    update = decode_request_embeddings({'sites': data.get('update') or []})['sites']
+    try:
+        with session.lock, stage('rank_session'):
+            changes = session.apply(add, data.get('remove') or [], update, data.get('projectType'))
+    except SessionError as e:
+        return jsonify({'error': str(e)}), 400
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each site needs embeddings or numeric lat and lon'}), 400
+    
+    print(f"📋 Ranking session {session.id[:8]} v{session.version}: "
+          f"+{changes['added']} -{changes['removed']} ~{changes['updated']} ({changes['rescored']} rescored)")
+    return ranking_session_response(session, data, changes)
+
+
+@app.route('/api/rank-sessions/<session_id>', methods=['DELETE'])
+def delete_ranking_session(session_id):
+    """End a ranking session"""
+    if not ranking_sessions.delete(session_id):
+        return jsonify({'error': 'Unknown or expired ranking session'}), 404
+    return jsonify({'success': True})
+
+
+# ============================================================================
+# ANALYSIS RESULT CACHE
+# ============================================================================
+
+def site_cache_inputs(sites):
+    """The parts of each site that affect an analysis (ignores UI-only fields)"""
+    return [
+        {
+            'name': s.get('name'),
+            'lat': s.get('lat'),
+            'lon': s.get('lon'),
+            'embeddings': s.get('embeddings')
+        }
+        for s in sites
+    ]
+
+
+def is_cacheable_result(result):
+    """Only real, parsed answers are worth caching (never mock stand-ins)"""
+    return (
+        bool(result.get('success')) and not result.get('mock')
+        and 'raw_output' not in (result.get('data') or {})
+    )
+
+
+def cached_sphinx_analysis(kind, inputs, create_notebook, prompt, data, token=None):
+    """
+    run_sphinx_analysis behind the content-addressed result cache
+    
+    Send {"bypassCache": true} to force a fresh run (the new result is still stored).
+    The response carries 'cached': true/false and 'coalesced': true when it
+    was served by another request's identical in-flight run.
+    """
+    key = result_cache.make_key(kind, PROMPT_TEMPLATE_VERSION, inputs)
+    
+    if data.get('bypassCache'):
+        result_cache.record_bypass()
+        RESULT_CACHE_LOOKUPS.inc(kind=kind, result='bypass')
+    else:
+        cached = result_cache.get(key)
+        RESULT_CACHE_LOOKUPS.inc(kind=kind, result='hit' if cached is not None else 'miss')
+        if cached is not None:
+            print(f"💾 Cache hit for {kind} ({key[:12]})")
+            return {**cached, 'cached': True}
+    
+    def run():
+        with stage('notebook'):
+            notebook_path = create_notebook()
+        try:
+            result = run_sphinx_analysis(notebook_path, prompt, token, kind)
+        finally:
+            notebook_store.release(notebook_path)
+        
+        if is_cacheable_result(result):
+            result_cache.put(key, kind, result)
+        return result
+    
+    result, shared = coalesced_sphinx_run(key, kind, run, token)
+    return {**result, 'cached': False, 'coalesced': shared}
+
+
+def coalesced_sphinx_run(key, kind, run, token=None):
+    """
+    run() through the single-flight group: identical requests already in
+    flight join that run instead of spawning their own
+    
+    Returns:
+        (result, shared)
+    """
+    while True:
+        try:
+            result, shared = sphinx_flights.do(key, run, token)
+            break
+        except JobCancelled:
+            if token is not None and (token.cancelled or token.expired):
+                raise
+            # The run we joined belonged to a cancelled job; start our own
+            print(f"🔁 Shared {kind} run was cancelled, retrying")
+    
+    if shared:
+        print(f"🔗 Joined in-flight {kind} run ({key[:12]})")
+    return result, shared
+
+
+# ============================================================================
+# ANALYSIS JOBS
+# ============================================================================
+
+def submit_job(kind, task, data, **fields):
+    """
+    Queue task(data, token) and answer 202 with the job id (429 when full)
+    
+    Extra fields (e.g. results already computed locally) go into the response.
+    The request deadline applies to the job (queue wait included), and a job
+    from the same session and kind that is still pending is cancelled.
+    """
+    try:
+        job = job_queue.submit(
+            kind,
+            lambda token: task(data, token),
+            deadline=requested_deadline(request.headers, data, REQUEST_DEADLINE_CAP)
+        )
+    except QueueFull as e:
+        response = jsonify({'error': 'Analysis queue is full', 'retryAfter': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    session = requested_session(request.headers, data)
+    request_sessions.begin(session, kind, job)
+    job.add_done_callback(lambda finished: request_sessions.end(session, kind, finished))
+    print(f"📥 Queued {kind} job {job.id[:8]}")
+    response = jsonify({**job.to_dict(), **fields})
+    response.headers['Location'] = f'/api/jobs/{job.id}'
+    return response, 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll a job's status (and result once it has succeeded)"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job (kills its sphinx-cli process)"""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: one 'status' event per state change, ending when the job finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    def stream():
+        version = -1
+        while True:
+            current = job.wait_for_change(version, timeout=15)
+            if current == version:
+                # Keep intermediaries from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            version = current
+            yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+            if job.done:
+                return
+    
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+# Static part of the chat system prompt (sent with a prompt-cache breakpoint)
+CHAT_SYSTEM_PROMPT = """You are an expert ocean scientist and AI assistant for OceanCarbon AI, a tool that helps scientists find optimal sites for ocean carbon removal projects.
 
 Your role:
 - Answer questions about ocean carbon removal, site selection, and oceanographic metrics
@@ -290,37 +1633,127 @@ Your role:
 If analysis results are available, reference them in your answers. If not, guide the user to run an analysis first.
 """
 
-        # Add top sites to context if available
-        if context.get('analysisResults'):
-            top_sites = context['analysisResults'][:3]
-            system_prompt += f"\n\nTop ranked sites from recent analysis:\n{json.dumps(top_sites, indent=2)}"
+
+def summarize_chat_turns(previous, messages, timeout=None):
+    """Rolling summary of older chat turns (extractive, and not cached, if Claude fails or runs out of time)"""
+    transcript = '\n'.join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous:
+        transcript = f"Summary so far:\n{previous}\n\nNew turns:\n{transcript}"
+    try:
+        summary, _ = claude_chat.complete(
+            [{'type': 'text', 'text': SUMMARY_PROMPT}],
+            [{'role': 'user', 'content': transcript}],
+            max_tokens=300,
+            model=CLAUDE_SUMMARY_MODEL,
+            timeout=timeout
+        )
+        return summary.strip() or extractive_summary(previous, messages)
+    except Exception as e:
+        print(f"⚠️  Chat summary failed, using extractive summary: {e}")
+        return extractive_summary(previous, messages)
+
+
+# Keeps chat prompts within a token budget: recent turns verbatim, older
+# turns folded into cached rolling summaries
+chat_context = ConversationContext(
+    budget_tokens=int(os.environ.get('CHAT_CONTEXT_TOKENS', 3000)),
+    summarizer=summarize_chat_turns,
+)
+
+
+def build_chat_request(data, timeout=None):
+    """
+    System blocks, Claude-format messages and context info for a chat request
+    
+    May summarize older turns with a Claude call bounded by `timeout` seconds.
+    """
+    messages = data.get('messages', [])
+    context = data.get('context', {})
+    
+    current_context = f"""Current Context:
+- Region: {context.get('region', 'Not selected')}
+- Project Type: {context.get('projectType', 'Not selected')}
+- Analysis Status: {'Completed' if context.get('analysisResults') else 'Not run yet'}
+"""
+    
+    # Add top sites to context if available
+    analysis_context = compact_analysis_context(context.get('analysisResults'))
+    
+    # Convert messages to Claude format, then fit them into the token budget
+    claude_messages = []
+    for msg in messages:
+        if msg['role'] in ['user', 'assistant']:
+            claude_messages.append({
+                'role': msg['role'],
+                'content': msg['content']
+            })
+    summary, claude_messages, info = chat_context.fit(claude_messages, timeout=timeout)
+    
+    system = system_blocks(CHAT_SYSTEM_PROMPT, analysis_context, current_context, summary=summary)
+    return system, claude_messages, info
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat_with_claude():
+    """
+    Chat endpoint using Claude API for ocean site questions
+    Send {"stream": true} to receive tokens as server-sent events
+    ('delta' events with text, then 'done' with token usage)
+    The request deadline bounds the Claude calls (the rolling summary of older
+    turns included); a stream also stops when the client disconnects or the
+    session sends a newer chat message.
+    """
+    data = request.json
+    
+    if not CLAUDE_API_KEY:
+        return jsonify({
+            'success': False,
+            'message': 'Claude API key not configured. Please add CLAUDE_API_KEY to your .env file.'
+        }), 500
+    
+    try:
+        claude_chat.client()
         
-        # Convert messages to Claude format
-        claude_messages = []
-        for msg in messages:
-            if msg['role'] in ['user', 'assistant']:
-                claude_messages.append({
-                    'role': msg['role'],
-                    'content': msg['content']
-                })
+        token, close = open_request_scope('chat', data)
+        try:
+            with stage('chat_context'):
+                system, claude_messages, context_info = build_chat_request(data, token.remaining())
+            token.check()
+        except JobCancelled:
+            close()
+            return jsonify(cancelled_payload(token.reason)), cancelled_status(token.reason)
+        except Exception:
+            close()
+            raise
         
-        print(f"💬 Sending to Claude API... ({len(claude_messages)} messages)")
+        print(f"💬 Sending to Claude API... ({len(claude_messages)} messages, "
+              f"{context_info['summarized']} summarized, ~{context_info['estimated_tokens']} tokens)")
         
-        # Call Claude API
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1000,
-            system=system_prompt,
-            messages=claude_messages
-        )
+        if data.get('stream'):
+            response = Response(
+                stream_chat(system, claude_messages, token),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            response.call_on_close(close)
+            return response
         
-        assistant_message = response.content[0].text
+        # Call Claude API
+        try:
+            with stage('claude'):
+                assistant_message, usage = claude_chat.complete(
+                    system, claude_messages, max_tokens=1000, timeout=token.remaining()
+                )
+        finally:
+            close()
         
-        print(f"✅ Claude response received ({len(assistant_message)} chars)")
+        print(f"✅ Claude response received ({len(assistant_message)} chars, {usage.get('cache_read_input_tokens', 0)} cached tokens)")
         
         return jsonify({
             'success': True,
-            'message': assistant_message
+            'message': assistant_message,
+            'usage': usage,
+            'context': context_info
         })
         
     except ImportError:
@@ -336,6 +1769,36 @@ If analysis results are available, reference them in your answers. If not, guide
         }), 500
 
 
+def stream_chat(system, claude_messages, token=None):
+    """SSE generator relaying Claude's token stream (stopped early if token is cancelled or expires)"""
+    chars = 0
+    started = time.perf_counter()
+    items = claude_chat.stream(
+        system, claude_messages, max_tokens=1000, timeout=token.remaining() if token is not None else None
+    )
+    try:
+        for item in items:
+            if token is not None and (token.cancelled or token.expired):
+                print(f"🛑 Claude stream stopped ({token.reason or 'deadline'}) after {chars} chars")
+                yield f"event: error\ndata: {json.dumps(cancelled_payload(token.reason))}\n\n"
+                return
+            if isinstance(item, str):
+                if not chars:
+                    record_stage('claude_first_token', time.perf_counter() - started)
+                chars += len(item)
+                yield f"event: delta\ndata: {json.dumps({'text': item})}\n\n"
+            else:
+                record_stage('claude', time.perf_counter() - started)
+                print(f"✅ Claude stream finished ({chars} chars)")
+                yield f"event: done\ndata: {json.dumps({'success': True, **item})}\n\n"
+    except Exception as e:
+        print(f"❌ Claude API error: {e}")
+        error = {'success': False, 'message': f'Error communicating with Claude: {str(e)}'}
+        yield f"event: error\ndata: {json.dumps(error)}\n\n"
+    finally:
+        items.close()  # closes the HTTP stream if we stopped early
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Check backend health and Sphinx configuration"""
@@ -344,7 +1807,23 @@ def health_check():
         'sphinx_configured': bool(SPHINX_API_KEY),
         'sphinx_api_key_set': 'SPHINX_API_KEY' in os.environ,
         'claude_configured': bool(CLAUDE_API_KEY),
-        'claude_api_key_set': 'CLAUDE_API_KEY' in os.environ
+        'claude_api_key_set': 'CLAUDE_API_KEY' in os.environ,
+        'embedding_cache': alphaearth.stats(),
+        'alphaearth': alphaearth.service.describe(),
+        'embedding_rasters': region_rasters.describe(),
+        'embedding_stores': embedding_stores.describe(),
+        'heatmap_tiles': heatmap_tiles.stats(),
+        'ranking_sessions': ranking_sessions.stats(),
+        'analysis_jobs': job_queue.stats(),
+        'result_cache': result_cache.stats(),
+        'sphinx_coalescing': sphinx_flights.stats(),
+        'request_cancellation': {
+            'deadline_cap_s': REQUEST_DEADLINE_CAP,
+            'sessions': request_sessions.describe(),
+            'disconnects': disconnect_monitor.describe()
+        },
+        'notebooks': notebook_store.stats(),
+        'chat_context': chat_context.stats()
     })
 
 
@@ -354,160 +1833,150 @@ def health_check():
 
 def create_analysis_notebook(embeddings, location, project_type):
     """Create a Jupyter notebook with site data"""
-    notebook_dir = Path('notebooks')
-    notebook_dir.mkdir(exist_ok=True)
-    
-    notebook_path = notebook_dir / f'site_analysis_{location["lat"]}_{location["lon"]}.ipynb'
-    
-    notebook_content = {
-        "cells": [
-            {
-                "cell_type": "code",
-                "execution_count": None,
-                "metadata": {},
-                "outputs": [],
-                "source": [
-                    "import numpy as np\n",
-                    "import pandas as pd\n",
-                    "import json\n",
-                    "\n",
-                    f"# Site Analysis\n",
-                    f"embeddings = np.array({embeddings})\n",
-                    f"location = {location}\n",
-                    f"project_type = '{project_type}'\n",
-                    "\n",
-                    "print(f'Analyzing site at {location}')\n",
-                    "print(f'Embeddings shape: {embeddings.shape}')\n",
-                    "print(f'Project type: {project_type}')\n"
-                ]
-            },
-            {
-                "cell_type": "markdown",
-                "metadata": {},
-                "source": [
-                    "# Ocean Site Analysis\n",
-                    "Sphinx AI will analyze this data and provide ocean metrics..."
-                ]
-            }
-        ],
-        "metadata": {
-            "kernelspec": {
-                "display_name": "Python 3",
-                "language": "python",
-                "name": "python3"
-            }
-        },
-        "nbformat": 4,
-        "nbformat_minor": 4
-    }
-    
-    with open(notebook_path, 'w') as f:
-        json.dump(notebook_content, f, indent=2)
-    
-    return str(notebook_path)
+    return notebook_store.site_analysis(embeddings, location, project_type)
 
 
 def create_ranking_notebook(sites, project_type):
     """Create notebook for ranking multiple sites"""
-    notebook_dir = Path('notebooks')
-    notebook_dir.mkdir(exist_ok=True)
-    
-    notebook_path = notebook_dir / f'ranking_{project_type.replace(" ", "_")}.ipynb'
-    
-    notebook_content = {
-        "cells": [
-            {
-                "cell_type": "code",
-                "execution_count": None,
-                "metadata": {},
-                "outputs": [],
-                "source": [
-                    "import numpy as np\n",
-                    "import pandas as pd\n",
-                    "\n",
-                    f"# Multi-site Ranking Analysis\n",
-                    f"project_type = '{project_type}'\n",
-                    f"num_sites = {len(sites)}\n",
-                    "\n",
-                    "# Sites data loaded\n",
-                    f"sites = {json.dumps(sites, indent=2)}\n",
-                    "\n",
-                    "print(f'Ranking {num_sites} sites for {project_type}')\n"
-                ]
-            }
-        ],
-        "metadata": {
-            "kernelspec": {
-                "display_name": "Python 3",
-                "language": "python",
-                "name": "python3"
-            }
-        },
-        "nbformat": 4,
-        "nbformat_minor": 4
-    }
-    
-    with open(notebook_path, 'w') as f:
-        json.dump(notebook_content, f, indent=2)
-    
-    return str(notebook_path)
+    return notebook_store.ranking(sites, project_type)
 
 
 def create_comparison_notebook(sites, project_type):
     """Create notebook for site comparison"""
-    return create_ranking_notebook(sites, f"{project_type}_comparison")
+    return notebook_store.ranking(sites, project_type, kind='comparison')
+
+
+def create_batch_analysis_notebook(sites, project_type):
+    """Create notebook for a keyed batch of single-site analyses"""
+    return notebook_store.ranking(sites, project_type, kind='batch_analysis')
 
 
 # ============================================================================
 # SPHINX CLI EXECUTION
 # ============================================================================
 
-def run_sphinx_analysis(notebook_path, prompt):
+# Seconds before a sphinx-cli run is killed
+SPHINX_TIMEOUT = 120
+
+
+def mock_sphinx_result():
+    """Stand-in answer when SPHINX_API_KEY is not set"""
+    print("⚠️ WARNING: SPHINX_API_KEY not set. Using mock data.")
+    return {
+        'success': True,
+        'mock': True,
+        'data': {
+            'score': 85,
+            'metrics': {'temperature': 14.2, 'chlorophyll': 2.8},
+            'message': 'Mock data - set SPHINX_API_KEY for real analysis'
+        }
+    }
+
+
+def sphinx_command(notebook_path, prompt):
+    """(argv, env) for a sphinx-cli run"""
+    env = os.environ.copy()
+    env['SPHINX_API_KEY'] = SPHINX_API_KEY
+    
+    cmd = [
+        'sphinx-cli', 'chat',
+        '--notebook-filepath', notebook_path,
+        '--prompt', prompt
+    ]
+    return cmd, env
+
+
+def run_sphinx_analysis(notebook_path, prompt, token=None, kind=None):
     """
     Execute Sphinx CLI and parse results
+    
+    stdout is parsed incrementally while the process runs; `kind` selects the
+    expected answer schema (see sphinx_output.SCHEMAS).
+    If a jobs.CancelToken is given, cancelling it kills the running process
+    group, and its deadline (if any) shortens the wait below SPHINX_TIMEOUT.
     """
     if not SPHINX_API_KEY:
-        print("⚠️ WARNING: SPHINX_API_KEY not set. Using mock data.")
-        return {
-            'success': True,
-            'data': {
-                'score': 85,
-                'metrics': {'temperature': 14.2, 'chlorophyll': 2.8},
-                'message': 'Mock data - set SPHINX_API_KEY for real analysis'
-            }
-        }
+        SPHINX_RUNS.inc(outcome='mock')
+        return mock_sphinx_result()
     
     try:
-        env = os.environ.copy()
-        env['SPHINX_API_KEY'] = SPHINX_API_KEY
-        
-        cmd = [
-            'sphinx-cli', 'chat',
-            '--notebook-filepath', notebook_path,
-            '--prompt', prompt
-        ]
+        cmd, env = sphinx_command(notebook_path, prompt)
         
         print(f"🤖 Running Sphinx CLI...")
         print(f"📓 Notebook: {notebook_path}")
         
-        result = subprocess.run(
-            cmd,
-            env=env,
-            capture_output=True,
-            text=True,
-            timeout=120  # 2 minute timeout
-        )
+        if token is not None:
+            token.check()
         
-        if result.returncode != 0:
-            print(f"❌ Sphinx CLI error: {result.stderr}")
-            return {'success': False, 'error': result.stderr}
+        with stage('sphinx_spawn'):
+            process = subprocess.Popen(
+                cmd,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True  # own process group, so cancel/timeout kills its children too
+            )
+        run_started = time.perf_counter()
+        if token is not None:
+            token.attach(process)
         
-        # Parse Sphinx output
-        output = result.stdout
+        extractor = JSONStreamExtractor()
+        values = []
+        stderr_chunks = []
+        
+        def read_stdout():
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                chunk = process.stdout.read1(65536)
+                if not chunk:
+                    break
+                values.extend(extractor.feed(decoder.decode(chunk)))
+            values.extend(extractor.feed(decoder.decode(b'', final=True)))
+        
+        readers = [
+            threading.Thread(target=read_stdout, daemon=True),
+            threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+        
+        timeout = token.remaining(SPHINX_TIMEOUT) if token is not None else SPHINX_TIMEOUT
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(process)
+            process.wait()
+            if token is not None and token.expired:
+                raise DeadlineExceeded('deadline exceeded')
+            raise
+        finally:
+            for reader in readers:
+                reader.join()
+            if token is not None:
+                token.detach(process)
+            record_stage('sphinx_run', time.perf_counter() - run_started)
+        
+        if token is not None and token.cancelled:
+            raise JobCancelled(token.reason)
+        
+        stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+        if process.returncode != 0:
+            print(f"❌ Sphinx CLI error: {stderr}")
+            SPHINX_RUNS.inc(outcome='error')
+            return {'success': False, 'error': stderr}
+        
+        # Parse Sphinx output (already extracted while it streamed in)
+        output = extractor.output
         print(f"✅ Sphinx output received ({len(output)} chars)")
         
-        analysis_result = parse_sphinx_output(output)
+        with stage('parse'):
+            analysis_result = final_result(extractor, values, kind)
+        if analysis_result is None:
+            print(f"⚠️ Could not parse JSON from Sphinx output")
+            SPHINX_PARSE_FALLBACKS.inc(kind=kind or 'unknown')
+            analysis_result = {'raw_output': output}
         
+        SPHINX_RUNS.inc(outcome='ok')
         return {
             'success': True,
             'data': analysis_result
@@ -515,29 +1984,30 @@ def run_sphinx_analysis(notebook_path, prompt):
         
     except subprocess.TimeoutExpired:
         print("❌ Sphinx CLI timed out")
+        SPHINX_RUNS.inc(outcome='timeout')
         return {'success': False, 'error': 'Analysis timed out'}
+    except DeadlineExceeded:
+        print("⏱️ Sphinx run stopped at the request deadline")
+        SPHINX_RUNS.inc(outcome='deadline')
+        raise
+    except JobCancelled as e:
+        print(f"🛑 Sphinx run cancelled ({e or 'cancelled'})")
+        SPHINX_RUNS.inc(outcome='cancelled')
+        raise
     except Exception as e:
         print(f"❌ Error running Sphinx: {e}")
+        SPHINX_RUNS.inc(outcome='error')
         return {'success': False, 'error': str(e)}
 
 
-def parse_sphinx_output(output):
+def parse_sphinx_output(output, kind=None):
     """
     Parse Sphinx CLI output to extract JSON results
     """
     try:
-        # Remove markdown code blocks if present
-        output = output.replace('```json\n', '').replace('```\n', '').replace('```', '')
-        
-        # Try to find JSON in the output
-        lines = output.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line.startswith('{') or line.startswith('['):
-                try:
-                    return json.loads(line)
-                except json.JSONDecodeError:
-                    continue
+        result = extract_result(output, kind)
+        if result is not None:
+            return result
         
         # If no JSON found, return raw output
         print(f"⚠️ Could not parse JSON from Sphinx output")
@@ -0,0 +1,171 @@
+"""
+Sharded, parallel ranking of large site lists
+
+A single prompt holding hundreds of sites is slow, unreliable and runs into
+the sphinx-cli timeout. Instead the sites are dealt into shards of similar
+quality (round-robin over a local pre-score), shards are ranked in parallel
+under a concurrency cap, and the shard rankings are merged:
+
+1. Each shard's scores are standardized within the shard and mapped back to
+   the global score scale, so a lenient shard doesn't dominate.
+2. Sites whose merged score sits within `tie_margin` of the top-K cut-off
+   (the boundary candidates) are re-ranked together in one extra call, which
+   settles the order exactly where it matters.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def deal_shards(sites, prescores, shard_size):
+    """
+    Split sites into shards with a similar spread of quality
+
+    Sites are sorted by prescore and dealt round-robin, so every shard gets a
+    mix of strong and weak candidates.
+
+    Returns:
+        List of lists of indices into sites
+    """
+    shard_count = max(1, -(-len(sites) // shard_size))
+    order = np.argsort(-np.asarray(prescores, dtype=np.float64), kind='stable')
+    return [order[i::shard_count].tolist() for i in range(shard_count)]
+
+
+def _shard_scores(result, shard_sites, fallback_scores):
+    """
+    Extract {site_index: (score, entry)} from one shard's ranking
+
+    Sites missing from (or malformed in) the answer fall back to their local
+    score so they still take part in the merge.
+    """
+    data = result.get('data') if result.get('success') else None
+    entries = data if isinstance(data, list) else []
+    by_name = {}
+    for entry in entries:
+        if isinstance(entry, dict) and isinstance(entry.get('score'), (int, float)):
+            by_name.setdefault(entry.get('name'), entry)
+
+    scored = {}
+    for position, (index, site) in enumerate(shard_sites):
+        entry = by_name.get(site.get('name'))
+        if entry is not None:
+            scored[index] = (float(entry['score']), entry, 'sphinx')
+        else:
+            scored[index] = (float(fallback_scores[position]), {}, 'local')
+    return scored
+
+
+def merge_shard_rankings(shard_results):
+    """
+    Merge per-shard scores onto one global scale
+
+    Args:
+        shard_results: List of {site_index: (score, entry, source)}
+
+    Returns:
+        {site_index: (merged_score, raw_score, entry, source, shard)}
+    """
+    raw_all = np.array([score for shard in shard_results for score, _, _ in shard.values()], dtype=np.float64)
+    if raw_all.size == 0:
+        return {}
+    global_mean = raw_all.mean()
+    global_std = max(raw_all.std(), 1.0)
+
+    merged = {}
+    for shard_number, shard in enumerate(shard_results):
+        scores = np.array([score for score, _, _ in shard.values()], dtype=np.float64)
+        mean = scores.mean()
+        std = max(scores.std(), 1.0)
+        for index, (score, entry, source) in shard.items():
+            normalized = global_mean + (score - mean) / std * global_std
+            merged[index] = (float(normalized), score, entry, source, shard_number)
+    return merged
+
+
+def boundary_candidates(order, merged, top_k, tie_margin, limit):
+    """
+    Indices whose merged score is within tie_margin of the top-K cut-off
+
+    Only worth re-ranking when the candidates come from more than one shard.
+    """
+    if len(order) <= top_k or top_k <= 0:
+        return []
+    cutoff = merged[order[top_k - 1]][0]
+    candidates = [i for i in order if abs(merged[i][0] - cutoff) <= tie_margin][:limit]
+    shards = {merged[i][4] for i in candidates}
+    return candidates if len(candidates) > 1 and len(shards) > 1 else []
+
+
+def sharded_rank(sites, rank_fn, prescores, shard_size=10, max_parallel=4,
+                 top_k=10, tie_margin=2.0, token=None):
+    """
+    Rank a large site list through parallel shard rankings
+
+    Args:
+        sites: List of site dicts (with name)
+        rank_fn: Callable(list_of_sites) -> rank-sites style result dict
+        prescores: Local score per site, used to deal shards and as fallback
+        shard_size: Sites per shard
+        max_parallel: Concurrent shard rankings
+        top_k: Position of the cut-off the tie-break pass protects
+        tie_margin: Merged-score distance from the cut-off that counts as a tie
+        token: Optional jobs.CancelToken
+
+    Returns:
+        {'success', 'data': ranked list, 'shards', 'tieBreak'}
+    """
+    prescores = np.asarray(prescores, dtype=np.float64)
+    shards = deal_shards(sites, prescores, shard_size)
+    print(f"🧩 Ranking {len(sites)} sites in {len(shards)} shards ({max_parallel} at a time)")
+
+    def run_shard(indices):
+        if token is not None:
+            token.check()
+        shard_sites = [sites[i] for i in indices]
+        result = rank_fn(shard_sites)
+        return _shard_scores(result, list(zip(indices, shard_sites)), prescores[indices])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix='rank-shard') as pool:
+        shard_results = list(pool.map(run_shard, shards))
+
+    merged = merge_shard_rankings(shard_results)
+    order = sorted(merged, key=lambda i: (-merged[i][0], -prescores[i]))
+
+    # Tie-break pass: settle the order of cross-shard near-ties at the cut-off
+    tie_break = {'applied': False, 'candidates': 0}
+    candidates = boundary_candidates(order, merged, top_k, tie_margin, shard_size)
+    if candidates:
+        if token is not None:
+            token.check()
+        print(f"🧩 Tie-break over {len(candidates)} boundary sites")
+        result = rank_fn([sites[i] for i in candidates])
+        rescored = _shard_scores(result, [(i, sites[i]) for i in candidates], prescores[candidates])
+        if any(source == 'sphinx' for _, _, source in rescored.values()):
+            slots = sorted(order.index(i) for i in candidates)
+            settled = sorted(candidates, key=lambda i: (-rescored[i][0], -merged[i][0]))
+            for slot, index in zip(slots, settled):
+                order[slot] = index
+            tie_break = {'applied': True, 'candidates': len(candidates)}
+
+    ranked = []
+    for rank, index in enumerate(order, start=1):
+        score, raw_score, entry, source, shard_number = merged[index]
+        site = sites[index]
+        ranked.append({
+            **{k: v for k, v in entry.items() if k not in ('rank', 'score')},
+            'rank': rank,
+            'name': site.get('name'),
+            'score': round(score, 1),
+            'rawScore': raw_score,
+            'shard': shard_number,
+            'source': source
+        })
+
+    return {
+        'success': True,
+        'data': ranked,
+        'shards': len(shards),
+        'tieBreak': tie_break
+    }
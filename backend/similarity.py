@@ -0,0 +1,273 @@
+"""
+Nearest-neighbour search over AlphaEarth embeddings ("find sites like this one")
+
+Embeddings are projected onto their top principal components and indexed
+with a KD-tree. A query walks the tree best-bin-first to collect candidates
+in the reduced space, then re-ranks them by exact Euclidean distance in the
+full 64-dimensional space.
+"""
+
+import heapq
+import threading
+
+import numpy as np
+
+from alphaearth_service import EMBEDDING_DIM
+
+
+class PCAProjection:
+    """Mean-centred projection onto the top principal components"""
+
+    def __init__(self, vectors, components=16, sample_size=20000, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > sample_size:
+            rng = np.random.default_rng(seed)
+            sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        else:
+            sample = vectors
+        self.mean = sample.mean(axis=0)
+        _, singular, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+        components = min(components, vt.shape[0])
+        self.components = vt[:components].T.astype(np.float32)  # (64, c)
+        variance = singular ** 2
+        self.explained_variance = float(variance[:components].sum() / variance.sum()) if variance.sum() else 1.0
+
+    def transform(self, vectors):
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components
+
+
+class KDTree:
+    """
+    Static KD-tree over a point matrix
+
+    Points are reordered so every leaf is a contiguous slice of self.points.
+    Each internal node splits on its widest dimension at the median.
+    """
+
+    def __init__(self, points, leaf_size=32):
+        points = np.asarray(points, dtype=np.float32)
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(points))
+
+        # Node arrays: split dim (-1 for leaves), split value, children, leaf range
+        self.split_dim = []
+        self.split_value = []
+        self.left = []
+        self.right = []
+        self.start = []
+        self.end = []
+
+        stack = [(self._new_node(0, len(points)), 0, len(points))]
+        while stack:
+            node, start, end = stack.pop()
+            if end - start <= leaf_size:
+                continue
+            idx = self.order[start:end]
+            block = points[idx]
+            dim = int(np.argmax(block.max(axis=0) - block.min(axis=0)))
+            mid = (end - start) // 2
+            part = np.argpartition(block[:, dim], mid)
+            self.order[start:end] = idx[part]
+            split = float(points[self.order[start + mid], dim])
+
+            self.split_dim[node] = dim
+            self.split_value[node] = split
+            left = self._new_node(start, start + mid)
+            right = self._new_node(start + mid, end)
+            self.left[node] = left
+            self.right[node] = right
+            stack.append((left, start, start + mid))
+            stack.append((right, start + mid, end))
+
+        self.points = points[self.order]
+
+    def _new_node(self, start, end):
+        self.split_dim.append(-1)
+        self.split_value.append(0.0)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(start)
+        self.end.append(end)
+        return len(self.split_dim) - 1
+
+    def query(self, point, k, max_leaves=64):
+        """
+        Approximate k nearest neighbours (exact when max_leaves is large enough)
+
+        Returns:
+            (indices into the original point order, squared distances), nearest first
+        """
+        point = np.asarray(point, dtype=np.float32)
+        best = []  # max-heap of (-dist, index)
+        frontier = [(0.0, 0)]
+        leaves = 0
+
+        while frontier and leaves < max_leaves:
+            bound, node = heapq.heappop(frontier)
+            if len(best) == k and bound > -best[0][0]:
+                break
+
+            dim = self.split_dim[node]
+            if dim < 0:
+                leaves += 1
+                start, end = self.start[node], self.end[node]
+                dists = ((self.points[start:end] - point) ** 2).sum(axis=1)
+                for offset in np.argsort(dists)[:k]:
+                    entry = (-float(dists[offset]), start + int(offset))
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+                continue
+
+            diff = float(point[dim]) - self.split_value[node]
+            near, far = (self.left[node], self.right[node]) if diff < 0 else (self.right[node], self.left[node])
+            heapq.heappush(frontier, (bound, near))
+            heapq.heappush(frontier, (max(bound, diff * diff), far))
+
+        best.sort(reverse=True)
+        positions = np.array([i for _, i in best], dtype=np.intp)
+        return self.order[positions], np.array([-d for d, _ in best], dtype=np.float32)
+
+
+class SimilarityIndex:
+    """
+    k-NN index over located embeddings
+
+    Args:
+        vectors: (N, 64) embeddings (a memory-mapped raster view is fine)
+        coords: (N, 2) lat/lon of each vector
+        labels: Optional (N,) region label per vector
+        stand_in: Built from fallback stand-in embeddings (LazyIndex won't keep it)
+    """
+
+    def __init__(self, vectors, coords, labels=None, components=16, leaf_size=32, stand_in=False):
+        self.vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.labels = np.asarray(labels) if labels is not None else None
+        self.projection = PCAProjection(self.vectors, components)
+        self.tree = KDTree(self.projection.transform(self.vectors), leaf_size)
+        self._norms = np.linalg.norm(self.vectors, axis=1)
+        self.stand_in = stand_in
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def query(self, embedding, k=10, oversample=4, max_leaves=64, exclude_coord=None, exclude_radius=1e-6):
+        """
+        The k stored locations most similar to an embedding
+
+        Args:
+            embedding: 64-dim query vector
+            k: Number of results
+            oversample: Reduced-space candidates per result to re-rank exactly
+            max_leaves: Leaf budget for the tree walk (accuracy vs speed)
+            exclude_coord: Optional (lat, lon) to leave out (the query site itself)
+            exclude_radius: Degrees within which exclude_coord matches
+
+        Returns:
+            List of dicts with lat, lon, region, distance, similarity
+        """
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(EMBEDDING_DIM)
+        candidates, _ = self.tree.query(
+            self.projection.transform(embedding[None, :])[0],
+            min(len(self), (k + 1) * oversample),
+            max_leaves,
+        )
+
+        if exclude_coord is not None:
+            keep = np.abs(self.coords[candidates] - np.asarray(exclude_coord)).max(axis=1) > exclude_radius
+            candidates = candidates[keep]
+
+        distances = np.linalg.norm(self.vectors[candidates] - embedding, axis=1)
+        order = np.argsort(distances, kind='stable')[:k]
+        query_norm = float(np.linalg.norm(embedding)) or 1.0
+
+        results = []
+        for i in order:
+            index = candidates[i]
+            denom = query_norm * (float(self._norms[index]) or 1.0)
+            results.append({
+                'lat': round(float(self.coords[index, 0]), 6),
+                'lon': round(float(self.coords[index, 1]), 6),
+                'region': str(self.labels[index]) if self.labels is not None else None,
+                'distance': round(float(distances[i]), 4),
+                'similarity': round(float(self.vectors[index] @ embedding) / denom, 4),
+            })
+        return results
+
+    def describe(self):
+        return {
+            'points': len(self),
+            'components': int(self.projection.components.shape[1]),
+            'explained_variance': round(self.projection.explained_variance, 4),
+        }
+
+
+def grid_points(bbox, resolution):
+    """(M, 2) lat/lon grid over a bounding box, row-major from the south-west corner"""
+    min_lat, max_lat, min_lon, max_lon = bbox
+    lats = min_lat + np.arange(int(round((max_lat - min_lat) / resolution)) + 1) * resolution
+    lons = min_lon + np.arange(int(round((max_lon - min_lon) / resolution)) + 1) * resolution
+    grid_lat, grid_lon = np.meshgrid(lats, lons, indexing='ij')
+    return np.column_stack([grid_lat.ravel(), grid_lon.ravel()])
+
+
+def build_index_from_rasters(rasters):
+    """Index every cell of every loaded region raster (vectors stay memory-mapped until projected)"""
+    vectors, coords, labels = [], [], []
+    for raster in rasters.rasters.values():
+        bbox = (raster.min_lat, raster.min_lat + (raster.height - 1) * raster.resolution,
+                raster.min_lon, raster.min_lon + (raster.width - 1) * raster.resolution)
+        vectors.append(raster.data.reshape(-1, EMBEDDING_DIM))
+        coords.append(grid_points(bbox, raster.resolution))
+        labels.append(np.full(raster.height * raster.width, raster.name))
+    return SimilarityIndex(np.concatenate(vectors), np.concatenate(coords), np.concatenate(labels))
+
+
+def build_index_from_grid(service, regions):
+    """
+    Index a regular grid of points fetched from an embedding service
+
+    Args:
+        service: Anything with batch_fetch(locations) (an AlphaEarthService)
+        regions: {name: {'bbox': (...), 'resolution': deg}}
+    """
+    vectors, coords, labels = [], [], []
+    stand_in = False
+    for name, spec in regions.items():
+        points = grid_points(spec['bbox'], spec['resolution'])
+        fetched, stand_ins = service.batch_fetch(points)
+        vectors.append(np.asarray(fetched, dtype=np.float32))
+        stand_in = stand_in or bool(stand_ins.any())
+        coords.append(points)
+        labels.append(np.full(len(points), name))
+    return SimilarityIndex(np.concatenate(vectors), np.concatenate(coords), np.concatenate(labels),
+                           stand_in=stand_in)
+
+
+class LazyIndex:
+    """
+    Builds an index on first use (thread-safe), so server start-up stays fast
+
+    An index built from fallback stand-ins is used once and rebuilt next time.
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    index = self._builder()
+                    if index.stand_in:
+                        return index
+                    self._index = index
+        return self._index
+
+    @property
+    def ready(self):
+        return self._index is not None
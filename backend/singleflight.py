@@ -0,0 +1,136 @@
+"""
+Single-flight coalescing of duplicate in-flight work
+
+The first caller for a key runs the function; callers that arrive with the
+same key while it is still running wait for it and receive the same result
+(or exception) instead of starting their own run.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Per-key deduplication of concurrent calls"""
+
+    def __init__(self, name='singleflight'):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, token=None):
+        """
+        Run fn() once for all concurrent callers with the same key
+
+        Args:
+            key: Hashable identity of the work
+            fn: Zero-argument callable
+            token: Optional jobs.CancelToken; a cancelled waiter stops waiting
+                   (the shared run continues for the others)
+
+        Returns:
+            (result, shared) where shared is True if this caller joined
+            another caller's run
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        while not call.done.wait(0.5):
+            if token is not None:
+                token.check()
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+            }
+
+
+class AsyncSingleFlight:
+    """
+    Per-key deduplication of concurrent coroutines (one event loop)
+
+    The shared run is a task of its own: a caller that is cancelled stops
+    waiting, and the run itself is only cancelled once every caller has gone.
+    """
+
+    def __init__(self, name='singleflight'):
+        self.name = name
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """
+        Await fn() once for all concurrent callers with the same key
+
+        Returns:
+            (result, shared)
+        """
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            call = {'task': asyncio.ensure_future(fn()), 'waiters': 0}
+            self._calls[key] = call
+            self.leaders += 1
+
+            def forget(_, key=key, call=call):
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+            call['task'].add_done_callback(forget)
+
+        call['waiters'] += 1
+        try:
+            return await asyncio.shield(call['task']), shared
+        except asyncio.CancelledError:
+            if not call['task'].done() and call['waiters'] == 1:
+                call['task'].cancel()
+            raise
+        finally:
+            call['waiters'] -= 1
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+        }
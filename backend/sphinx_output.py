@@ -0,0 +1,213 @@
+"""
+Incremental JSON extraction from sphinx-cli output
+
+Sphinx answers are usually pretty-printed JSON wrapped in prose and code
+fences. JSONStreamExtractor is fed stdout chunks as they arrive and yields
+each complete top-level JSON object/array in a single pass, tracking a
+stack of open brackets and string/escape state so braces inside strings don't
+confuse it. Extracted values are checked against the expected shape for the
+endpoint, so the first answer that actually matches wins.
+"""
+
+import json
+import re
+
+# Expected answer shape per analysis kind
+SCHEMAS = {
+    'analyze-site': {'type': dict, 'required': ['score']},
+    'rank-sites': {'type': list, 'item_required': ['name', 'score']},
+    'compare-sites': {'type': dict, 'required_any': ['recommendation', 'comparison_table', 'best_for']},
+    'analyze-sites-batch': {'type': dict},
+}
+
+
+def matches_schema(value, schema):
+    """True if value has the shape described by schema (None accepts anything)"""
+    if schema is None:
+        return True
+    if not isinstance(value, schema['type']):
+        return False
+    if isinstance(value, dict):
+        if any(key not in value for key in schema.get('required', [])):
+            return False
+        required_any = schema.get('required_any')
+        if required_any and not any(key in value for key in required_any):
+            return False
+    if isinstance(value, list):
+        if not value:
+            return False
+        item_required = schema.get('item_required', [])
+        for item in value:
+            if not isinstance(item, dict) or any(key not in item for key in item_required):
+                return False
+    return True
+
+
+_CLOSERS = {'}': '{', ']': '['}
+
+# What the scanner looks for: an opener outside any value, a bracket or quote
+# inside one, and the rest of a string (with escapes) once inside it
+_OPENER = re.compile(r'[{\[]')
+_STRUCTURAL = re.compile(r'[{}\[\]"]')
+_STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+_STRING_TAIL = re.compile(r'(?:[^"\\]|\\.)*(\\?)\Z', re.S)
+
+
+class JSONStreamExtractor:
+    """
+    Single-pass extractor of top-level JSON values from a text stream
+
+    feed() returns the values completed by that chunk. Only the text from
+    the outermost value currently being read is buffered.
+
+    Open brackets are kept as a stack of (opener, offset, closed children).
+    A stray '{' or '[' in prose can swallow the real answer into a candidate
+    that never parses. Because openers are only recorded outside strings, a
+    fresh scan from any later recorded opener would see exactly the same
+    brackets, so no re-scan is needed: when the outermost candidate fails to
+    parse, its recorded children are tried instead (and theirs in turn).
+    A closing bracket of the wrong type, or the stream ending with brackets
+    still open, gives up on every open candidate the same way.
+    """
+
+    def __init__(self):
+        self._stack = []        # [opener, stream offset, closed children] per open bracket
+        self._in_string = False
+        self._escaped = False   # the last chunk ended inside a string on a backslash
+        self._pending = []      # chunks from the outermost open value on
+        self._pending_start = 0
+        self._offset = 0        # stream offset of the next chunk
+        self.text = []          # the whole stream, kept for the raw_output fallback
+
+    def feed(self, chunk):
+        self.text.append(chunk)
+        base = self._offset
+        self._offset += len(chunk)
+        if self._stack:
+            self._pending.append(chunk)
+        values = []
+
+        pos = 0
+        while pos < len(chunk):
+            if self._in_string:
+                if self._escaped:
+                    pos += 1  # a backslash ended the previous chunk
+                    self._escaped = False
+                end = _STRING_END.match(chunk, pos)
+                if end is None:
+                    self._escaped = bool(_STRING_TAIL.match(chunk, pos).group(1))
+                    break
+                pos = end.end()
+                self._in_string = False
+                continue
+
+            match = (_STRUCTURAL if self._stack else _OPENER).search(chunk, pos)
+            if match is None:
+                break
+            i = match.start()
+            char = chunk[i]
+            pos = i + 1
+
+            if not self._stack:
+                self._stack.append((char, base + i, []))
+                self._in_string = False
+                self._pending = [chunk[i:]]
+                self._pending_start = base + i
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._stack.append((char, base + i, []))
+            else:
+                opener, start, children = self._stack[-1]
+                if _CLOSERS[char] != opener:
+                    values.extend(self._give_up())
+                    continue
+                self._stack.pop()
+                node = (start, base + i + 1, children)
+                if self._stack:
+                    self._stack[-1][2].append(node)
+                else:
+                    values.extend(self._parse(node))
+                    self._pending = []
+
+        return values
+
+    def finish(self):
+        """Values recovered from the candidates still open when the stream ended"""
+        return self._give_up()
+
+    def _give_up(self):
+        """Drop every open candidate, keeping what its closed children parse to"""
+        values = []
+        for _, _, children in self._stack:
+            for node in children:
+                values.extend(self._parse(node))
+        self._stack = []
+        self._pending = []
+        return values
+
+    def _slice(self, start, end):
+        if len(self._pending) > 1:
+            self._pending = [''.join(self._pending)]
+        return self._pending[0][start - self._pending_start:end - self._pending_start]
+
+    def _parse(self, node):
+        """
+        Values of a closed candidate: the candidate itself if it parses,
+        otherwise its children, in stream order (no recursion)
+        """
+        values = []
+        todo = [node]
+        while todo:
+            start, end, children = todo.pop()
+            try:
+                values.append(json.loads(self._slice(start, end)))
+            except json.JSONDecodeError:
+                todo.extend(reversed(children))
+            except RecursionError:
+                pass  # nested too deep to be an answer (and so are its children)
+        return values
+
+    @property
+    def output(self):
+        return ''.join(self.text)
+
+
+def select_result(values, kind=None):
+    """
+    Pick the answer from extracted values
+
+    The last value matching the endpoint's schema wins (Sphinx tends to
+    restate its final answer at the end). Otherwise the largest value is
+    used. Returns None if nothing was extracted.
+    """
+    schema = SCHEMAS.get(kind)
+    matching = [value for value in values if matches_schema(value, schema)]
+    if matching:
+        return matching[-1]
+    if values:
+        return max(values, key=lambda value: len(json.dumps(value)))
+    return None
+
+
+def final_result(extractor, values, kind=None):
+    """
+    The answer once a stream has ended
+
+    Uses the values extracted in the single pass, falling back to the ones
+    finish() recovers when none matched the schema. Returns None if nothing
+    parseable was found.
+    """
+    result = select_result(values, kind)
+    if result is None or not matches_schema(result, SCHEMAS.get(kind)):
+        recovered = select_result(values + extractor.finish(), kind)
+        result = recovered if recovered is not None else result
+    return result
+
+
+def extract_result(output, kind=None):
+    """One-shot helper: extract the answer from complete output (or None)"""
+    extractor = JSONStreamExtractor()
+    values = extractor.feed(output)
+    values += extractor.finish()
+    return select_result(values, kind)
@@ -0,0 +1,79 @@
+"""The mock only stands in for an unavailable API, and its answers are never cached"""
+
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from alphaearth_service import EMBEDDING_DIM, AlphaEarthError, AlphaEarthService, HTTPProvider
+from embedding_cache import EmbeddingCache
+
+
+class _StubAPI(BaseHTTPRequestHandler):
+    status = 200
+
+    def _answer(self, count):
+        if self.status != 200:
+            self.send_error(self.status)
+            return
+        body = json.dumps({'embeddings': [[0.5] * EMBEDDING_DIM] * count}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self._answer(len(payload['locations']))
+
+    def log_message(self, *args):
+        pass
+
+
+class FallbackTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubAPI)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.api = HTTPProvider(f'http://127.0.0.1:{self.server.server_port}', retries=0, batch_window=0.001)
+        self.cache = EmbeddingCache(AlphaEarthService(provider=self.api))
+
+    def tearDown(self):
+        _StubAPI.status = 200
+        self.api.close()
+
+    def test_outage_answers_are_not_cached(self):
+        _StubAPI.status = 503
+        mock = self.cache.get_embeddings(10.0, 20.0)
+        batch = self.cache.batch_get_embeddings([(11.0, 21.0), (12.0, 22.0)])
+        self.assertEqual(batch.shape, (2, EMBEDDING_DIM))
+        self.assertEqual(self.cache.stats()['fallbacks'], 3)
+
+        _StubAPI.status = 200
+        self.assertFalse(np.allclose(mock, 0.5))
+        np.testing.assert_allclose(self.cache.get_embeddings(10.0, 20.0), 0.5)
+        np.testing.assert_allclose(self.cache.batch_get_embeddings([(11.0, 21.0), (12.0, 22.0)]), 0.5)
+        self.assertEqual(self.cache.stats()['lru_size'], 3)
+
+    def test_rejected_request_is_raised(self):
+        _StubAPI.status = 400
+        with self.assertRaises(AlphaEarthError):
+            self.cache.get_embeddings(10.0, 20.0)
+        with self.assertRaises(AlphaEarthError):
+            self.cache.batch_get_embeddings([(11.0, 21.0)])
+        self.assertEqual(self.cache.stats()['fallbacks'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Rolling chat summaries: prefix reuse and the extractive fallback"""
+
+import unittest
+
+from chat_context import ConversationContext, extractive_summary
+
+
+def _conversation(turns):
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'Turn {i}. ' + 'words ' * 60}
+        for i in range(turns)
+    ]
+
+
+class SummaryCacheTest(unittest.TestCase):
+
+    def test_model_summary_is_reused_and_extended(self):
+        calls = []
+
+        def summarizer(previous, messages, timeout=None):
+            calls.append((previous, len(messages)))
+            return f'summary of {len(messages)} after {previous}'
+
+        context = ConversationContext(budget_tokens=400, summarizer=summarizer, chunk=2)
+        messages = _conversation(12)
+        first, _, info = context.fit(messages)
+        context.fit(messages)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(context.stats()['summary_hits'], 1)
+
+        context.fit(messages + _conversation(4))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[-1][0], first)
+        self.assertLess(calls[-1][1], info['summarized'] + 4)
+
+    def test_extractive_fallback_is_not_cached(self):
+        calls = []
+
+        def summarizer(previous, messages, timeout=None):
+            calls.append(previous)
+            return extractive_summary(previous, messages)
+
+        context = ConversationContext(budget_tokens=400, summarizer=summarizer, chunk=2)
+        messages = _conversation(12)
+        summary, _, _ = context.fit(messages)
+        self.assertIn('user: Turn 0', summary)
+        context.fit(messages)
+        self.assertEqual(calls, [None, None])
+        self.assertEqual(context.stats()['cached_summaries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Garbage collection must not delete notebooks a Sphinx run is still reading"""
+
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from alphaearth_service import EMBEDDING_DIM
+from notebooks import NotebookStore
+
+
+class NotebookLeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.store = NotebookStore(self._tmp.name, max_age=60, max_files=1000, gc_every=10 ** 9)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _expire(self, notebook_path):
+        old = time.time() - 3600
+        for path in (Path(notebook_path), Path(notebook_path).with_suffix('.npy')):
+            os.utime(path, (old, old))
+
+    def _notebook(self, lat):
+        return self.store.site_analysis([0.1] * EMBEDDING_DIM, {'lat': lat, 'lon': 0}, 'kelp')
+
+    def test_leased_notebook_survives_gc(self):
+        leased = self._notebook(1)
+        self._expire(leased)
+
+        self.assertEqual(self.store.collect_garbage(), 0)
+        self.assertTrue(Path(leased).exists())
+        self.assertTrue(Path(leased).with_suffix('.npy').exists())
+
+        self.store.release(leased)
+        self.assertEqual(self.store.collect_garbage(), 1)
+        self.assertFalse(Path(leased).exists())
+
+    def test_reuse_holds_its_own_lease(self):
+        first = self._notebook(2)
+        second = self._notebook(2)
+        self.assertEqual(first, second)
+        self._expire(first)
+
+        self.store.release(first)
+        self.assertEqual(self.store.collect_garbage(), 0)
+        self.store.release(second)
+        self.assertEqual(self.store.collect_garbage(), 1)
+        self.assertEqual(self.store.stats()['leased'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
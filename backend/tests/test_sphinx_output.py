@@ -0,0 +1,43 @@
+"""Regression tests for the streaming JSON extractor"""
+
+import time
+import unittest
+
+from sphinx_output import JSONStreamExtractor, extract_result
+
+
+class ExtractResultTest(unittest.TestCase):
+
+    def test_unclosed_brackets_are_linear(self):
+        for count in (20, 200, 5000):
+            started = time.perf_counter()
+            self.assertIsNone(extract_result('[' * count))
+            self.assertLess(time.perf_counter() - started, 1.0)
+
+    def test_unclosed_brackets_before_answer(self):
+        output = 'Progress [' * 300 + '\n{"score": 61}'
+        self.assertEqual(extract_result(output, 'analyze-site'), {'score': 61})
+
+    def test_stray_brace_in_prose_before_answer(self):
+        output = 'Looking at the { notebook now.\n```json\n{"score": 72, "metrics": {"ph": 8.1}}\n```\nDone.'
+        self.assertEqual(extract_result(output, 'analyze-site'), {'score': 72, 'metrics': {'ph': 8.1}})
+
+    def test_mismatched_closer_does_not_pair(self):
+        output = '{"a": [1, 2} then {"score": 9}'
+        self.assertEqual(extract_result(output, 'analyze-site'), {'score': 9})
+
+    def test_chunked_feed_matches_whole_output(self):
+        output = 'note {x} [ {"score": 3, "s": "a\\\\\\"}[", "m": [1, 2]} tail'
+        whole = JSONStreamExtractor()
+        expected = whole.feed(output) + whole.finish()
+        for size in (1, 2, 3, 7):
+            extractor = JSONStreamExtractor()
+            values = []
+            for start in range(0, len(output), size):
+                values += extractor.feed(output[start:start + size])
+            self.assertEqual(values + extractor.finish(), expected)
+        self.assertEqual(expected, [{'score': 3, 's': 'a\\"}[', 'm': [1, 2]}])
+
+
+if __name__ == '__main__':
+    unittest.main()
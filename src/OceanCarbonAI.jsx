@@ -2,7 +2,7 @@ import React, { useState, useMemo, useEffect } from 'react';
 import { MapContainer, TileLayer, CircleMarker, Tooltip as LeafletTooltip, useMap } from 'react-leaflet';
 import 'leaflet/dist/leaflet.css';
 import { LineChart, Line, AreaChart, Area, BarChart, Bar, PieChart, Pie, Cell, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, RadarChart, PolarGrid, PolarAngleAxis, PolarRadiusAxis, Radar } from 'recharts';
-// import { analyzeSite, rankSites } from './services/api';  // Uncomment when backend is ready
+// import { analyzeSite, rankSites, rankSitesStreaming } from './services/api';  // Uncomment when backend is ready
 
 const REGION_SITE_COORDS = {
   Monterey: [
@@ -102,6 +102,11 @@ const OceanCarbonAI = () => {
       
       // TODO: Uncomment when backend is ready
       // const rankedSites = await rankSites(sitesToAnalyze, selectedProjectType);
+      // Or, to show sites as they are scored instead of waiting for Sphinx:
+      // const rankedSites = await rankSitesStreaming(sitesToAnalyze, selectedProjectType, {
+      //   onSite: (site) => setAnalysisResults(prev => [...(prev || []), site]),
+      //   onRanking: (ranking) => setAnalysisResults(ranking)
+      // });
       
       // MOCK DATA FOR NOW - Replace with real Sphinx AI results
       await new Promise(resolve => setTimeout(resolve, 2000)); // Simulate API delay
@@ -1,27 +1,135 @@
 const API_BASE = 'http://localhost:5001/api';
 
-export const analyzeSite = async (lat, lon, projectType) => {
+// ---------------------------------------------------------------------------
+// Deadlines and cancellation
+// ---------------------------------------------------------------------------
+// Long-running calls accept { timeoutMs, signal, supersede }:
+//   timeoutMs   sent as X-Request-Timeout-Ms; the backend stops the Sphinx or
+//               Claude call at the deadline (capped server-side) with a 504
+//   signal      an AbortSignal; aborting closes the connection, which kills
+//               the Sphinx run on the backend straight away
+//   supersede   tag the request with this tab's session id, so a newer call
+//               of the same kind cancels this one (it then fails with 409)
+
+export const SESSION_ID = globalThis.crypto?.randomUUID?.()
+  ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
+const requestHeaders = ({ timeoutMs, supersede = false } = {}, extra = {}) => ({
+  'Content-Type': 'application/json',
+  ...(timeoutMs ? { 'X-Request-Timeout-Ms': String(Math.round(timeoutMs)) } : {}),
+  ...(supersede ? { 'X-Session-Id': SESSION_ID } : {}),
+  ...extra
+});
+
+// ---------------------------------------------------------------------------
+// Embedding transport
+// ---------------------------------------------------------------------------
+// Embeddings can travel as packed little-endian float32 instead of JSON
+// number lists: 'f32' (raw octet-stream), 'f32-base64' (inside JSON), or the
+// int8-quantized 'i8' / 'i8-base64' variants. Encoded objects look like
+// { dtype, shape, data[, scale] } and can be sent straight back to the API.
+
+const base64ToBytes = (data) => Uint8Array.from(atob(data), (c) => c.charCodeAt(0));
+
+const bytesToBase64 = (bytes) => {
+  let binary = '';
+  for (let i = 0; i < bytes.length; i += 0x8000) {
+    binary += String.fromCharCode(...bytes.subarray(i, i + 0x8000));
+  }
+  return btoa(binary);
+};
+
+const splitRows = (values, shape) => {
+  if (shape.length < 2) return values;
+  const width = shape[shape.length - 1];
+  return Array.from({ length: values.length / width }, (_, i) => values.subarray(i * width, (i + 1) * width));
+};
+
+const dequantize = (int8, scales, width) => {
+  const out = new Float32Array(int8.length);
+  for (let i = 0; i < int8.length; i += 1) out[i] = int8[i] * scales[Math.floor(i / width)];
+  return out;
+};
+
+// Encoded object (or plain list) -> Float32Array, or an array of them for a matrix
+export const decodeEmbeddings = (value) => {
+  if (!value || Array.isArray(value)) return value;
+  const bytes = base64ToBytes(value.data);
+  const width = value.shape[value.shape.length - 1];
+  const values = value.dtype === 'int8'
+    ? dequantize(new Int8Array(bytes.buffer), value.scale, width)
+    : new Float32Array(bytes.buffer);
+  return splitRows(values, value.shape);
+};
+
+// One vector or a list of vectors -> { dtype: 'float32', shape, data }
+export const encodeEmbeddings = (vectors) => {
+  const rows = Array.isArray(vectors[0]) || ArrayBuffer.isView(vectors[0]) ? vectors : [vectors];
+  const width = rows[0].length;
+  const packed = new Float32Array(rows.length * width);
+  rows.forEach((row, i) => packed.set(row, i * width));
+  const shape = rows === vectors ? [rows.length, width] : [width];
+  return { dtype: 'float32', shape, data: bytesToBase64(new Uint8Array(packed.buffer)) };
+};
+
+// Fetch embeddings for many sites. encoding 'json' returns number lists;
+// 'f32' / 'i8' fetch a raw binary body and return Float32Array rows;
+// 'f32-base64' / 'i8-base64' return the encoded matrix as sent by the API.
+export const getEmbeddingsBatch = async (sites, { encoding = 'json' } = {}) => {
+  const binary = encoding === 'f32' || encoding === 'i8';
+  const response = await fetch(`${API_BASE}/get-embeddings-batch?encoding=${encoding}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Accept: binary ? 'application/octet-stream' : 'application/json'
+    },
+    body: JSON.stringify({
+      locations: sites.map((site) => ({ lat: site.lat, lon: site.lon }))
+    })
+  });
+
+  if (binary) {
+    const shape = response.headers.get('X-Embedding-Shape').split(',').map(Number);
+    const buffer = await response.arrayBuffer();
+    if (response.headers.get('X-Embedding-Dtype') === 'int8') {
+      const rows = shape[0];
+      const scales = new Float32Array(buffer, 0, rows);
+      return splitRows(dequantize(new Int8Array(buffer, rows * 4), scales, shape[1]), shape);
+    }
+    return splitRows(new Float32Array(buffer), shape);
+  }
+
+  const { embeddings } = await response.json();
+  return embeddings;
+};
+
+export const analyzeSite = async (lat, lon, projectType, { bypassCache = false, ...scope } = {}) => {
   try {
     // Step 1: Get AlphaEarth embeddings
+    // (packed float32, passed back to the API as is)
     const embeddingsResponse = await fetch(`${API_BASE}/get-embeddings`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ lat, lon })
+      body: JSON.stringify({ lat, lon, encoding: 'f32-base64' }),
+      signal: scope.signal
     });
     const { embeddings } = await embeddingsResponse.json();
     
     // Step 2: Send to Sphinx AI for analysis
     const analysisResponse = await fetch(`${API_BASE}/analyze-site`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: requestHeaders(scope),
       body: JSON.stringify({
         embeddings,
         location: { lat, lon },
-        projectType
-      })
+        projectType,
+        bypassCache
+      }),
+      signal: scope.signal
     });
     
     const result = await analysisResponse.json();
+    if (result.reason) throw new Error(result.error);
     return result.data;
     
   } catch (error) {
@@ -30,32 +138,52 @@ export const analyzeSite = async (lat, lon, projectType) => {
   }
 };
 
-export const rankSites = async (sites, projectType) => {
+// Analyze many sites in shared Sphinx sessions (much cheaper per site than
+// calling analyzeSite in a loop). Sites need lat/lon and may carry an id.
+// Resolves to { [id or index]: analysis or null } plus the batch stats.
+export const analyzeSitesBatch = async (sites, projectType, { bypassCache = false, ...scope } = {}) => {
   try {
-    // Get embeddings for all sites
-    const sitesWithEmbeddings = await Promise.all(
-      sites.map(async (site) => {
-        const embeddingsResponse = await fetch(`${API_BASE}/get-embeddings`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ lat: site.lat, lon: site.lon })
-        });
-        const { embeddings } = await embeddingsResponse.json();
-        return { ...site, embeddings };
-      })
+    const response = await fetch(`${API_BASE}/analyze-sites-batch`, {
+      method: 'POST',
+      headers: requestHeaders(scope),
+      body: JSON.stringify({ sites, projectType, bypassCache }),
+      signal: scope.signal
+    });
+
+    const result = await response.json();
+    if (!response.ok) throw new Error(result.error);
+    const analyses = Object.fromEntries(
+      result.results.map((entry) => [entry.key, entry.success ? entry.data : null])
     );
+    return { analyses, stats: result.stats };
+
+  } catch (error) {
+    console.error('Error analyzing sites:', error);
+    throw error;
+  }
+};
+
+export const rankSites = async (sites, projectType, { bypassCache = false, ...scope } = {}) => {
+  try {
+    // Get embeddings for all sites in a single batch request, as one packed
+    // float32 matrix (row i belongs to sites[i])
+    const siteEmbeddings = await getEmbeddingsBatch(sites, { encoding: 'f32-base64' });
     
     // Send to Sphinx for ranking
     const response = await fetch(`${API_BASE}/rank-sites`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: requestHeaders(scope),
       body: JSON.stringify({
-        sites: sitesWithEmbeddings,
-        projectType
-      })
+        sites,
+        siteEmbeddings,
+        projectType,
+        bypassCache
+      }),
+      signal: scope.signal
     });
     
     const result = await response.json();
+    if (result.reason) throw new Error(result.error);
     return result.data;
     
   } catch (error) {
@@ -64,19 +192,305 @@ export const rankSites = async (sites, projectType) => {
   }
 };
 
-export const compareSites = async (sites, projectType) => {
+// Rank locally on the backend (no Sphinx round trip). Sites only need
+// name/lat/lon; pass narrativeTopK to also get a Sphinx write-up of the top K.
+export const rankSitesFast = async (sites, projectType, { narrativeTopK = 0, limit } = {}) => {
+  const response = await fetch(`${API_BASE}/rank-sites?mode=fast`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ sites, projectType, narrativeTopK, limit })
+  });
+
+  const result = await response.json();
+  return { ranking: result.data, narrative: result.narrative?.data };
+};
+
+// Find the k ocean locations most similar to a site (by AlphaEarth embeddings)
+export const findSimilarSites = async (lat, lon, k = 10) => {
+  const response = await fetch(`${API_BASE}/similar-sites`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ lat, lon, k })
+  });
+
+  const result = await response.json();
+  return result.results;
+};
+
+// Suitability heatmap tiles for a region (a preset name such as 'monterey')
+// or a bbox { minLat, maxLat, minLon, maxLon }, at one or more zoom levels.
+// Resolves to { tileSize, scale, tiles: [{ z, x, y, bounds, scores }] } where
+// scores is a Uint8Array of tileSize * tileSize cells, rows north to south
+// (score = value * scale). Tiles are cached on the backend, so re-requesting
+// a region after panning or zooming back is cheap.
+export const getHeatmap = async (area, zooms, projectType) => {
+  const params = new URLSearchParams({ zoom: [].concat(zooms).join(','), projectType });
+  if (typeof area === 'string') {
+    params.set('region', area);
+  } else {
+    params.set('min_lat', area.minLat);
+    params.set('max_lat', area.maxLat);
+    params.set('min_lon', area.minLon);
+    params.set('max_lon', area.maxLon);
+  }
+
+  const response = await fetch(`${API_BASE}/heatmap?${params}`);
+  const result = await response.json();
+  if (!response.ok) throw new Error(result.error);
+  return {
+    ...result,
+    tiles: result.tiles.map(({ data, ...tile }) => ({ ...tile, scores: base64ToBytes(data) }))
+  };
+};
+
+// Call handle(event) for each line of an NDJSON response body
+const readNdjson = async (response, handle) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let newline;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) handle(JSON.parse(line));
+    }
+  }
+  if (buffer.trim()) handle(JSON.parse(buffer));
+};
+
+// Rank sites with incremental results. The backend streams NDJSON events:
+//   onSite(site)         each site's local score/metrics as soon as it is ready
+//   onRanking(ranking)   the local ordering of all sites
+//   onFinal(result)      the Sphinx ranking (not sent with mode 'fast')
+// Resolves with the final result (or the local ranking in fast mode).
+export const rankSitesStreaming = async (
+  sites,
+  projectType,
+  { mode, onSite = () => {}, onRanking = () => {}, onFinal = () => {}, ...scope } = {}
+) => {
+  const response = await fetch(`${API_BASE}/rank-sites?stream=ndjson`, {
+    method: 'POST',
+    headers: requestHeaders(scope),
+    body: JSON.stringify({ sites, projectType, mode }),
+    signal: scope.signal
+  });
+
+  let ranking = null;
+  let final = null;
+
+  const handle = (event) => {
+    if (event.type === 'site') onSite(event);
+    else if (event.type === 'ranking') {
+      ranking = event.data;
+      onRanking(ranking);
+    } else if (event.type === 'final') {
+      final = event.result;
+      onFinal(final);
+    } else if (event.type === 'error') {
+      throw new Error(event.error);
+    }
+  };
+
+  await readNdjson(response, handle);
+  return final ? final.data : ranking;
+};
+
+// Compare 2-5 sites. The backend computes the comparison table, metric deltas
+// and "best for" table locally first; pass onLocal to receive them while the
+// Sphinx narrative is still running (the response is then streamed as NDJSON).
+// Resolves with the Sphinx comparison.
+export const compareSites = async (sites, projectType, { onLocal, ...scope } = {}) => {
   try {
-    const response = await fetch(`${API_BASE}/compare-sites`, {
+    const response = await fetch(`${API_BASE}/compare-sites${onLocal ? '?stream=ndjson' : ''}`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ sites, projectType })
+      headers: requestHeaders(scope),
+      body: JSON.stringify({ sites, projectType }),
+      signal: scope.signal
     });
     
-    const result = await response.json();
-    return result.data;
+    if (!onLocal) {
+      const result = await response.json();
+      if (result.reason) throw new Error(result.error);
+      return result.data;
+    }
+
+    let final = null;
+    await readNdjson(response, (event) => {
+      if (event.type === 'local') onLocal(event.data);
+      else if (event.type === 'final') final = event.result;
+      else if (event.type === 'error') throw new Error(event.error);
+    });
+    return final?.data;
     
   } catch (error) {
     console.error('Error comparing sites:', error);
     throw error;
   }
-};
\ No newline at end of file
+};
+
+// Local comparison only (no Sphinx round trip)
+export const compareSitesFast = async (sites, projectType) => {
+  const response = await fetch(`${API_BASE}/compare-sites?mode=fast`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ sites, projectType })
+  });
+
+  const result = await response.json();
+  return result.data;
+};
+
+// ---------------------------------------------------------------------------
+// Ranking sessions
+// ---------------------------------------------------------------------------
+// A session keeps every site's local score on the backend, so editing the
+// candidate list only scores the sites that changed. Sites are keyed by id
+// (else name). Each call resolves to { sessionId, version, sites, data }
+// where data is the ranking (or the { offset, limit } window of it); pass
+// narrativeTopK to also get a Sphinx write-up of the top K, which is reused
+// while the top K is unchanged.
+
+const rankingSessionRequest = async (path, method, body) => {
+  const response = await fetch(`${API_BASE}/rank-sessions${path}`, {
+    method,
+    headers: { 'Content-Type': 'application/json' },
+    body: body && JSON.stringify(body)
+  });
+  const result = await response.json();
+  if (!response.ok) throw new Error(result.error);
+  return result;
+};
+
+export const createRankingSession = (sites, projectType, view = {}) =>
+  rankingSessionRequest('', 'POST', { sites, projectType, ...view });
+
+// changes: { add: [sites], remove: [ids], update: [{ id, ...fields }], projectType }
+// The result's changes.ranks gives the new rank of every added or updated site.
+export const editRankingSession = (sessionId, changes, view = {}) =>
+  rankingSessionRequest(`/${sessionId}`, 'PATCH', { ...changes, ...view });
+
+export const getRankingSession = (sessionId, view = {}) => {
+  const query = new URLSearchParams(
+    Object.entries(view).filter(([, value]) => value !== undefined && value !== null)
+  ).toString();
+  return rankingSessionRequest(`/${sessionId}${query ? `?${query}` : ''}`, 'GET');
+};
+
+export const deleteRankingSession = (sessionId) => rankingSessionRequest(`/${sessionId}`, 'DELETE');
+
+// ---------------------------------------------------------------------------
+// Async analysis jobs
+// ---------------------------------------------------------------------------
+
+// Submit an analysis as a background job. `endpoint` is one of
+// 'analyze-site', 'rank-sites' or 'compare-sites'. Resolves to the job
+// ({ jobId, status, ... }); rejects with error.retryAfter set when the
+// backend queue is full (HTTP 429). With { supersede: true } a newer job of
+// the same kind from this tab cancels this one; timeoutMs includes queueing.
+export const submitAnalysisJob = async (endpoint, body, scope = {}) => {
+  const response = await fetch(`${API_BASE}/${endpoint}`, {
+    method: 'POST',
+    headers: requestHeaders(scope),
+    body: JSON.stringify({ ...body, async: true })
+  });
+
+  if (response.status === 429) {
+    const error = new Error('Analysis queue is full');
+    error.retryAfter = Number(response.headers.get('Retry-After')) || 30;
+    throw error;
+  }
+
+  return response.json();
+};
+
+export const getJob = async (jobId) => {
+  const response = await fetch(`${API_BASE}/jobs/${jobId}`);
+  return response.json();
+};
+
+export const cancelJob = async (jobId) => {
+  const response = await fetch(`${API_BASE}/jobs/${jobId}`, { method: 'DELETE' });
+  return response.json();
+};
+
+// Follow a job over server-sent events. onStatus is called with every state
+// change; the returned promise resolves with the final job. Call
+// `promise.close()` to stop listening early.
+export const subscribeToJob = (jobId, onStatus = () => {}) => {
+  const source = new EventSource(`${API_BASE}/jobs/${jobId}/events`);
+
+  const promise = new Promise((resolve, reject) => {
+    source.addEventListener('status', (event) => {
+      const job = JSON.parse(event.data);
+      onStatus(job);
+      if (['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+        source.close();
+        resolve(job);
+      }
+    });
+    source.onerror = (error) => {
+      source.close();
+      reject(error);
+    };
+  });
+
+  promise.close = () => source.close();
+  return promise;
+};
+
+
+// ---------------------------------------------------------------------------
+// Chat
+// ---------------------------------------------------------------------------
+
+// Stream a Claude chat reply. onDelta receives each text chunk as it
+// arrives; resolves with the full message once the stream is done.
+// Pass { supersede: true } to stop a reply still streaming when the next
+// message is sent.
+export const chatStream = async (messages, context, onDelta = () => {}, scope = {}) => {
+  const response = await fetch(`${API_BASE}/chat`, {
+    method: 'POST',
+    headers: requestHeaders(scope, { Accept: 'text/event-stream' }),
+    body: JSON.stringify({ messages, context, stream: true }),
+    signal: scope.signal
+  });
+
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.message);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let message = '';
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      const type = (rawEvent.match(/^event: (.*)$/m) || [])[1];
+      const payload = JSON.parse((rawEvent.match(/^data: (.*)$/m) || [])[1] || '{}');
+      if (type === 'delta') {
+        message += payload.text;
+        onDelta(payload.text, message);
+      } else if (type === 'error') {
+        throw new Error(payload.message || payload.error);
+      }
+    }
+  }
+
+  return message;
+};